@@ -7,7 +7,6 @@ import codecs
 import sys
 
 import re
-from distutils.version import LooseVersion
 
 from pip import get_installed_distributions
 # noinspection PyProtectedMember
@@ -19,6 +18,8 @@ from pip.req import parse_requirements
 from pip.req.req_install import InstallRequirement
 from stdeb.util import debianize_name
 
+from debtools.versions import get_version, sort_versions
+
 __author__ = 'Matthieu Gallet'
 
 ubuntu_distribs = ['precise', 'precise-updates', 'trusty', 'trusty-updates', 'wily', 'wily-updates', 'xenial',
@@ -104,11 +105,10 @@ class EnvironmentBuilder(object):
 
     def get_best_available_package_version(self, debian_package, descending=True):
         versions = [self.get_available_package_version_in_url(base_url, debian_package) for base_url in self.base_urls]
-        loose_versions = [LooseVersion(x) for x in versions if x]
-        loose_versions.sort(reverse=descending)
-        if not loose_versions:
+        debian_versions = sort_versions([get_version(x) for x in versions if x], reverse=descending)
+        if not debian_versions:
             return None
-        return loose_versions[0]
+        return debian_versions[0]
 
     def print_requirements(self):
         for python_package in self.required_packages:
@@ -1,9 +1,118 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import errno
+import io
+import mmap
 import os
+import stat
 from tarfile import InvalidHeaderError
 __author__ = 'Matthieu Gallet'
 
+# errors raised by os.copy_file_range/os.sendfile when the kernel cannot copy between these two files
+KERNEL_COPY_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ESPIPE}
+
+
+def _fileno(fileobj):
+    try:
+        return fileobj.fileno()
+    except (AttributeError, io.UnsupportedOperation, ValueError):
+        return None
+
+
+def _kernel_copy(src_fd, dst_fd, src_offset, dst_offset, size):
+    """Copy `size` bytes between two file descriptors without going through Python buffers.
+    Use `copy_file_range` and then `sendfile`, stopping as soon as the kernel refuses the copy.
+
+    :return: the number of copied bytes (may be less than `size`)
+    :rtype: :class:`int`
+    """
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                count = os.copy_file_range(src_fd, dst_fd, size - copied, src_offset + copied, dst_offset + copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError as e:
+            if e.errno not in KERNEL_COPY_ERRORS:
+                raise
+        if copied == size:
+            return copied
+    if hasattr(os, 'sendfile'):
+        try:
+            os.lseek(dst_fd, dst_offset + copied, os.SEEK_SET)
+            while copied < size:
+                count = os.sendfile(dst_fd, src_fd, src_offset + copied, size - copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError as e:
+            if e.errno not in KERNEL_COPY_ERRORS:
+                raise
+    return copied
+
+
+def _pread_copy(src_fd, dst, offset, size, bufsize=1048576):
+    """Copy `size` bytes from the file descriptor `src_fd` at `offset` to the file object `dst`, through a single
+    buffer and without using (nor modifying) the current position of `src_fd`."""
+    if size <= 0:
+        return
+    buffer = bytearray(min(bufsize, size))
+    view = memoryview(buffer)
+    copied = 0
+    while copied < size:
+        length = min(len(buffer), size - copied)
+        if hasattr(os, 'preadv'):
+            count = os.preadv(src_fd, [view[:length]], offset + copied)
+            data = view[:count]
+        else:
+            data = os.pread(src_fd, length, offset + copied)
+            count = len(data)
+        if not count:
+            raise IOError('unexpected end of data')
+        dst.write(data)
+        copied += count
+
+
+def copy_fileobj(src, dst, size, src_offset=None, bufsize=1048576):
+    """Copy `size` bytes from `src` (starting at `src_offset` or at its current position) to the current position of
+    `dst`. The copy is done by the kernel when both are real files, otherwise through a single reusable buffer.
+    Both positions are moved after the copied data, as with a `read` followed by a `write`.
+
+    :param src: readable file object
+    :param dst: writable file object
+    :param size: number of bytes to copy
+    :type size: :class:`int`
+    :param src_offset: position of the data in `src`
+    :type src_offset: :class:`int`
+    :param bufsize: size of the buffer used when the kernel copy is unavailable
+    :type bufsize: :class:`int`
+    :return: the number of copied bytes
+    :rtype: :class:`int`
+    """
+    if src_offset is None:
+        src_offset = src.tell()
+    copied = 0
+    src_fd, dst_fd = _fileno(src), _fileno(dst)
+    if src_fd is not None and dst_fd is not None and size > 0:
+        dst.flush()
+        dst_offset = dst.tell()
+        copied = _kernel_copy(src_fd, dst_fd, src_offset, dst_offset, size)
+        # resynchronize the position of the Python file object with the file descriptor
+        dst.seek(dst_offset + copied)
+    src.seek(src_offset + copied)
+    if copied < size:
+        buffer = bytearray(min(bufsize, size - copied))
+        view = memoryview(buffer)
+        while copied < size:
+            count = src.readinto(view[:min(len(buffer), size - copied)])
+            if not count:
+                raise IOError('unexpected end of data')
+            dst.write(view[:count])
+            copied += count
+    return copied
+
 
 class ArInfo(object):
     def __init__(self, name=''):
@@ -13,6 +122,24 @@ class ArInfo(object):
         self.owner_id = 0
         self.group_id = 0
         self.file_mode = 0
+        # position of the header and of the data in the archive (set when the archive is read)
+        self.header_offset = None
+        self.data_offset = None
+
+    def tobuf(self):
+        """Return the 60-byte header of this member
+
+        :rtype: :class:`bytes`
+        """
+        # fields are padded to their size in bytes, not in characters
+        name = self.name.encode('utf-8')
+        if len(name) > 16:
+            raise ValueError('member name %r is longer than 16 bytes' % self.name)
+        fields = '%-12d%-6d%-6d%-8o%-10d' % (self.timestamp, self.owner_id, self.group_id, self.file_mode, self.size)
+        header = name.ljust(16, b' ') + fields.encode('ascii') + b'`\n'
+        if len(header) != 60:
+            raise ValueError('invalid header for member %r' % self.name)
+        return header
 
 
 class ArObjFile(object):
@@ -37,12 +164,19 @@ class ArObjFile(object):
         self.fileobj.seek(self.read_size + self.seek_offset)
 
     def read(self, size=None):
-        if size is None:
+        if size is None or size < 0:
             size = self.file_size - self.read_size
         size = min(self.file_size - self.read_size, size)
+        # the archive file object is shared between members and header lookups
+        self.fileobj.seek(self.seek_offset + self.read_size)
         self.read_size += size
         return self.fileobj.read(size)
 
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[0:len(data)] = data
+        return len(data)
+
     def close(self):
         pass
 
@@ -50,113 +184,355 @@ class ArObjFile(object):
         return self.read_size
 
 
+class ArBufferFile(io.RawIOBase):
+    """Read-only file object over a member of a memory-mapped archive.
+
+    Data is never copied until it is read; :meth:`getbuffer` gives a zero-copy view of the whole member.
+    """
+    def __init__(self, buffer):
+        super(ArBufferFile, self).__init__()
+        self.buffer = buffer
+        self.file_size = len(buffer)
+        self.read_size = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self.read_size = offset
+        elif whence == os.SEEK_CUR:
+            self.read_size += offset
+        elif whence == os.SEEK_END:
+            self.read_size = self.file_size + offset
+        self.read_size = max(0, self.read_size)
+        return self.read_size
+
+    def tell(self):
+        return self.read_size
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            size = self.file_size - self.read_size
+        start = min(self.read_size, self.file_size)
+        end = min(start + size, self.file_size)
+        self.read_size = end
+        return bytes(self.buffer[start:end])
+
+    def readinto(self, b):
+        start = min(self.read_size, self.file_size)
+        end = min(start + len(b), self.file_size)
+        b[0:end - start] = self.buffer[start:end]
+        self.read_size = end
+        return end - start
+
+    def getbuffer(self):
+        return self.buffer
+
+    def close(self):
+        if not self.closed and isinstance(self.buffer, memoryview):
+            try:
+                # the archive can only be unmapped once all views are released
+                self.buffer.release()
+            except BufferError:
+                pass
+        super(ArBufferFile, self).close()
+
+
 class ArFile(object):
     GLOBAL_HEADER = b'!<arch>\n'
+    HEADER_SIZE = 60
 
-    def __init__(self, name=None, mode='r', fileobj=None, bufsize=10240):
+    def __init__(self, name=None, mode='r', fileobj=None, bufsize=10240, use_mmap=False, reproducible=False,
+                 mtime=None):
+        """
+        :param use_mmap: memory-map the archive (read mode only); members are then returned as :class:`ArBufferFile`
+            and read without any seek. Silently ignored when `fileobj` is not a real file.
+        :type use_mmap: :class:`bool`
+        :param reproducible: write mode only: all members are owned by root, have a fixed mode
+            (0644, or 0755 for executable files) and the timestamp `mtime`
+        :type reproducible: :class:`bool`
+        :param mtime: timestamp of added members in reproducible mode (default: `$SOURCE_DATE_EPOCH` or 0)
+        :type mtime: :class:`int`
+        """
         self.name = name
         self.mode = mode[0]
         self.fileobj = fileobj
         self.bufsize = bufsize
+        self._extfileobj = fileobj is not None
+        self.reproducible = reproducible
+        if mtime is None:
+            mtime = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+        self.mtime = mtime
         if fileobj is None:
             self.fileobj = open(name, self.mode + 'b')
+        self.__mmap = None
+        self.__buffer = None
+        if use_mmap and self.mode == 'r':
+            try:
+                self.__mmap = mmap.mmap(self.fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+                self.__buffer = memoryview(self.__mmap)
+            except (AttributeError, io.UnsupportedOperation, ValueError, mmap.error):
+                # no file descriptor or empty file
+                self.__mmap = None
+        # members already read, in archive order, and the same members indexed by name
+        self.__members = []
+        self.__members_by_name = {}
+        self.__scan_complete = False
+        self.__iter_index = 0
         if self.mode == 'r':
-            if self.fileobj.read(8) != self.GLOBAL_HEADER:
+            if self.__read_bytes(0, 8) != self.GLOBAL_HEADER:
+                self.close()
                 raise InvalidHeaderError
         else:
             self.fileobj.write(self.GLOBAL_HEADER)
-        self.__current_pos = self.fileobj.tell()
-
-    def __reset(self):
-        self.fileobj.seek(0)
-        if self.fileobj.read(8) != self.GLOBAL_HEADER:
-            raise InvalidHeaderError
         self.__current_pos = 8
 
-    def getmember(self, name):
-        self.__reset()
-        ar_info = self.next()
-        while ar_info is not None and ar_info.name != name:
-            ar_info = self.next()
-        return ar_info
-
-    def getmembers(self):
-        self.__reset()
-        members = []
-        ar_info = self.next()
-        while ar_info is not None:
-            members.append(ar_info)
-            ar_info = self.next()
-        return members
-
-    def getnames(self):
-        self.__reset()
-        members = []
-        ar_info = self.next()
-        while ar_info is not None:
-            members.append(ar_info.name)
+    def __read_bytes(self, offset, size):
+        if self.__buffer is not None:
+            return bytes(self.__buffer[offset:offset + size])
+        self.fileobj.seek(offset)
+        return self.fileobj.read(size)
 
-            ar_info = self.next()
-        return members
+    def __read_header(self):
+        """Read the next header at the end of the already scanned part of the archive and add it to the index.
 
-    def next(self):
-        self.fileobj.seek(self.__current_pos)
-        data = self.fileobj.read(60)
+        :return: the new member, or `None` when the end of the archive is reached
+        :rtype: :class:`ArInfo`
+        """
+        if self.__scan_complete:
+            return None
+        data = self.__read_bytes(self.__current_pos, self.HEADER_SIZE)
         magic = data[58:60]  # byte
         if magic != b'\x60\x0a':
+            self.__scan_complete = True
             return None
         assert isinstance(data, bytes)
-        ar_info = ArInfo(data[0:16].decode('utf-8').strip())
-        ar_info.filename = data[0:16].decode('utf-8').strip()
-        ar_info.timestamp = data[16:28]
-        ar_info.owner_id = data[28:34]
-        ar_info.group_id = data[34:40]
-        ar_info.file_mode = data[40:48]
+        name = data[0:16].decode('utf-8').strip()
+        if name.endswith('/') and name not in ('/', '//'):
+            # GNU ar terminates names by a slash
+            name = name[:-1]
+        ar_info = ArInfo(name)
+        ar_info.filename = name
+        ar_info.timestamp = int(data[16:28].strip() or 0)
+        ar_info.owner_id = int(data[28:34].strip() or 0)
+        ar_info.group_id = int(data[34:40].strip() or 0)
+        ar_info.file_mode = int(data[40:48].strip() or 0, 8)
         ar_info.size = int(data[48:58])
-        self.__current_pos += (60 + int((ar_info.size + 1) / 2) * 2)
+        ar_info.header_offset = self.__current_pos
+        ar_info.data_offset = self.__current_pos + self.HEADER_SIZE
+        self.__current_pos += (self.HEADER_SIZE + int((ar_info.size + 1) / 2) * 2)
+        self.__members.append(ar_info)
+        # like tarfile, the last occurrence of a name wins
+        self.__members_by_name[ar_info.name] = ar_info
+        return ar_info
+
+    def __scan(self, name=None):
+        """Read headers until the member `name` is found (or until the end of the archive if `name` is `None`)."""
+        if name is not None and name in self.__members_by_name:
+            return self.__members_by_name[name]
+        ar_info = self.__read_header()
+        while ar_info is not None:
+            if name is not None and ar_info.name == name:
+                return ar_info
+            ar_info = self.__read_header()
+        return None
+
+    def __iter__(self):
+        """Iterate over members, reading headers only when they have not been indexed yet."""
+        index = 0
+        while True:
+            if index < len(self.__members):
+                ar_info = self.__members[index]
+            else:
+                ar_info = self.__read_header()
+                if ar_info is None:
+                    return
+            yield ar_info
+            index += 1
+
+    def getmember(self, name):
+        return self.__scan(name)
+
+    def getmembers(self):
+        self.__scan()
+        return list(self.__members)
+
+    def getnames(self):
+        self.__scan()
+        return [ar_info.name for ar_info in self.__members]
+
+    def next(self):
+        index = self.__iter_index
+        if index < len(self.__members):
+            ar_info = self.__members[index]
+        else:
+            ar_info = self.__read_header()
+        if ar_info is not None:
+            self.__iter_index = index + 1
         return ar_info
 
-    def extractall(self, path='.', members=None):
-        members = set([x.name for x in members]) if members is not None else None
-        self.__reset()
-        member = self.next()
-        while member is not None:
-            if members is None or member.name in members:
-                fullpath = os.path.join(path, member.name)
-                e = ArObjFile(self.fileobj, member.size)
-                with open(fullpath, 'wb') as fd:
-                    data = e.read(self.bufsize)
-                    while data:
-                        fd.write(data)
-                        data = e.read(self.bufsize)
-            member = self.next()
+    def extractall(self, path='.', members=None, workers=1):
+        """Extract members to the directory `path`.
+        Data is copied by the kernel when possible; with several workers, members are extracted in parallel threads
+        that read the archive with `pread` (so they never share a file position).
+
+        :param path: destination directory
+        :type path: :class:`str`
+        :param members: list of names or :class:`ArInfo` to extract (default: all members)
+        :param workers: number of members extracted simultaneously
+        :type workers: :class:`int`
+        """
+        if members is None:
+            members = self.getmembers()
+        else:
+            members = [self.__scan(x.name if isinstance(x, ArInfo) else x) for x in members]
+        members = [x for x in members if x is not None]
+        fileno = _fileno(self.fileobj)
+        if workers > 1 and len(members) > 1 and (fileno is not None or self.__buffer is not None):
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self.__extract_member, member, path, fileno) for member in members]
+                for future in futures:
+                    future.result()
+        else:
+            for member in members:
+                self.__extract_member(member, path, fileno)
+
+    def __extract_member(self, member, path, fileno):
+        fullpath = os.path.join(path, member.name)
+        with open(fullpath, 'wb') as fd:
+            if self.__buffer is not None:
+                fd.write(self.__buffer[member.data_offset:member.data_offset + member.size])
+            elif fileno is not None:
+                copied = _kernel_copy(fileno, fd.fileno(), member.data_offset, 0, member.size)
+                fd.seek(copied)
+                _pread_copy(fileno, fd, member.data_offset + copied, member.size - copied,
+                            bufsize=max(self.bufsize, 1048576))
+            else:
+                copy_fileobj(self.fileobj, fd, member.size, src_offset=member.data_offset,
+                             bufsize=max(self.bufsize, 1048576))
 
     def extract(self, member, path=''):
-        self.__reset()
         if not isinstance(member, ArInfo):
             member = ArInfo(name=member)
         return self.extractall(path=path, members=(member, ))
 
     def extractfile(self, member):
         name = member.name if isinstance(member, ArInfo) else member
-        self.__reset()
-        member = self.next()
-        while member is not None:
-            if member.name == name:
-                return ArObjFile(self.fileobj, member.size)
-            member = self.next()
+        member = self.__scan(name)
+        if member is None:
+            return None
+        if self.__buffer is not None:
+            return ArBufferFile(self.__buffer[member.data_offset:member.data_offset + member.size])
+        self.fileobj.seek(member.data_offset)
+        return ArObjFile(self.fileobj, member.size)
+
+    def getbuffer(self, member):
+        """Return the content of a member as a zero-copy :class:`memoryview` (only when the archive is memory-mapped)
+
+        :param member: name of the member or :class:`ArInfo`
+        :return: `None` if the member does not exist
+        :rtype: :class:`memoryview`
+        """
+        if self.__buffer is None:
+            raise ValueError('%s is not memory-mapped' % self.name)
+        name = member.name if isinstance(member, ArInfo) else member
+        member = self.__scan(name)
+        if member is None:
+            return None
+        return self.__buffer[member.data_offset:member.data_offset + member.size]
 
     def add(self, name, arcname=None):
-        pass
+        """Add the file `name` to the archive, under the name `arcname`.
+        Its content is streamed to the archive and is never loaded in memory.
+        """
+        arinfo = self.getarinfo(name, arcname=arcname)
+        with open(name, 'rb') as fileobj:
+            self.addfile(arinfo, fileobj=fileobj)
 
     def addfile(self, arinfo, fileobj=None):
-        pass
+        """Add the :class:`ArInfo` object `arinfo` to the archive.
+        `arinfo.size` bytes are copied from the current position of `fileobj`.
+
+        :param arinfo: header of the new member
+        :type arinfo: :class:`ArInfo`
+        :param fileobj: readable file object (may be `None` for empty members)
+        """
+        if self.mode == 'r':
+            raise IOError('archive %s is opened in read mode' % self.name)
+        if self.reproducible:
+            arinfo.timestamp = self.mtime
+            arinfo.owner_id = 0
+            arinfo.group_id = 0
+            arinfo.file_mode = 0o100755 if arinfo.file_mode & 0o111 else 0o100644
+        arinfo.header_offset = self.__current_pos
+        arinfo.data_offset = self.__current_pos + self.HEADER_SIZE
+        self.fileobj.write(arinfo.tobuf())
+        if arinfo.size:
+            copy_fileobj(fileobj, self.fileobj, arinfo.size, bufsize=max(self.bufsize, 1048576))
+        if arinfo.size % 2:
+            self.fileobj.write(b'\n')
+        self.__current_pos = arinfo.data_offset + int((arinfo.size + 1) / 2) * 2
+        self.__members.append(arinfo)
+        self.__members_by_name[arinfo.name] = arinfo
 
     def getarinfo(self, name=None, arcname=None, fileobj=None):
-        pass
+        """Create an :class:`ArInfo` object from the result of `os.stat` on an existing file
+
+        :param name: path of the file
+        :param arcname: name in the archive (default: basename of `name`)
+        :param fileobj: file object, used instead of `name`
+        :rtype: :class:`ArInfo`
+        """
+        if name is None:
+            name = getattr(fileobj, 'name', '')
+        if arcname is None:
+            arcname = os.path.basename(name)
+        arinfo = ArInfo(arcname)
+        fileno = _fileno(fileobj) if fileobj is not None else None
+        if fileobj is not None and fileno is None:
+            # in-memory file object: only its size is known
+            position = fileobj.tell()
+            fileobj.seek(0, os.SEEK_END)
+            arinfo.size = fileobj.tell() - position
+            fileobj.seek(position)
+            arinfo.timestamp = self.mtime
+            arinfo.file_mode = 0o100644
+            return arinfo
+        stat_result = os.fstat(fileno) if fileno is not None else os.stat(name)
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise ValueError('%s is not a regular file' % name)
+        arinfo.size = stat_result.st_size
+        arinfo.timestamp = int(stat_result.st_mtime)
+        arinfo.owner_id = stat_result.st_uid
+        arinfo.group_id = stat_result.st_gid
+        arinfo.file_mode = stat_result.st_mode
+        return arinfo
 
     def close(self):
-        pass
+        if self.__mmap is not None:
+            self.__buffer.release()
+            self.__buffer = None
+            try:
+                self.__mmap.close()
+            except BufferError:
+                # some members are still in use, the map is closed when they are garbage-collected
+                pass
+            self.__mmap = None
+        if self.mode != 'r':
+            self.fileobj.flush()
+        if not self._extfileobj:
+            self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 if __name__ == '__main__':
     import doctest
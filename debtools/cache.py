@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""Persistent caches, stored in `~/.cache/debtools` by default
+
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from debtools.utils import get_control_data, get_dependencies
+from debtools.versions import VersionRange
+
+__author__ = 'Matthieu Gallet'
+
+
+def get_cache_dir(*subdirs):
+    """Return the cache directory of debtools (`$XDG_CACHE_HOME/debtools` or `~/.cache/debtools`), creating it if
+    required.
+
+    :param subdirs: optional sub-directories
+    :rtype: :class:`str`
+    """
+    base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    cache_dir = os.path.join(base_dir, 'debtools', *subdirs)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
+def dump_dependencies(deps):
+    return json.dumps({name: [[op, str(version)] for (op, version) in constraints]
+                       for (name, constraints) in deps.items()})
+
+
+def load_dependencies(value):
+    return {name: VersionRange(constraints) for (name, constraints) in json.loads(value).items()}
+
+
+class ControlDataCache(object):
+    """ SQLite cache of control data and dependencies of `.deb` files.
+    An entry is valid as long as the path, inode, size and modification time of the file are unchanged.
+    The least recently used entries are removed when there are more than `max_entries` entries.
+    """
+    # increase it when the format of stored data changes: all previous entries are then discarded
+    FORMAT_VERSION = 1
+    commit_interval = 1000
+
+    def __init__(self, filename=None, max_entries=100000):
+        """
+        :param filename: path of the SQLite database (default: `~/.cache/debtools/control_data.sqlite3`)
+        :type filename: :class:`str`
+        :param max_entries: maximum number of stored packages
+        :type max_entries: :class:`int`
+        """
+        if filename is None:
+            filename = os.path.join(get_cache_dir(), 'control_data.sqlite3')
+        self.filename = filename
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS control_data (path TEXT PRIMARY KEY, inode INTEGER, '
+                                'size INTEGER, mtime INTEGER, control TEXT, dependencies TEXT, last_access REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS control_data_access ON control_data (last_access)')
+        row = self.connection.execute("SELECT value FROM metadata WHERE key = 'version'").fetchone()
+        if row is None or row[0] != str(self.FORMAT_VERSION):
+            self.connection.execute('DELETE FROM control_data')
+            self.connection.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('version', ?)",
+                                    (str(self.FORMAT_VERSION), ))
+        self.connection.commit()
+        self.entries_count = self.connection.execute('SELECT COUNT(*) FROM control_data').fetchone()[0]
+        self.pending_changes = 0
+
+    @staticmethod
+    def get_identity(filename):
+        """Return the key (path, inode, size, modification time in ns) of a file"""
+        stat_result = os.stat(filename)
+        mtime = getattr(stat_result, 'st_mtime_ns', None) or int(stat_result.st_mtime * 1000000000)
+        return os.path.abspath(filename), stat_result.st_ino, stat_result.st_size, mtime
+
+    def get(self, filename):
+        """Return the cached data of a `.deb` file
+
+        :param filename: path of the `.deb` file
+        :return: `(control data, dependencies)` or `None` if the file is unknown or has been modified
+        :rtype: :class:`tuple`
+        """
+        path, inode, size, mtime = self.get_identity(filename)
+        row = self.connection.execute('SELECT control, dependencies FROM control_data '
+                                      'WHERE path = ? AND inode = ? AND size = ? AND mtime = ?',
+                                      (path, inode, size, mtime)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute('UPDATE control_data SET last_access = ? WHERE path = ?', (time.time(), path))
+        self._changed()
+        return json.loads(row[0]), load_dependencies(row[1])
+
+    def set(self, filename, control_data, deps=None):
+        """Store the data of a `.deb` file
+
+        :param filename: path of the `.deb` file
+        :param control_data: control data of the file
+        :type control_data: :class:`dict`
+        :param deps: parsed dependencies (computed from `control_data` if not provided)
+        :type deps: :class:`dict`
+        """
+        if deps is None:
+            deps = get_dependencies(control_data)
+        path, inode, size, mtime = self.get_identity(filename)
+        cursor = self.connection.execute('UPDATE control_data SET inode = ?, size = ?, mtime = ?, control = ?, '
+                                         'dependencies = ?, last_access = ? WHERE path = ?',
+                                         (inode, size, mtime, json.dumps(control_data), dump_dependencies(deps),
+                                          time.time(), path))
+        if cursor.rowcount == 0:
+            self.connection.execute('INSERT INTO control_data (path, inode, size, mtime, control, dependencies, '
+                                    'last_access) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (path, inode, size, mtime, json.dumps(control_data), dump_dependencies(deps),
+                                     time.time()))
+            self.entries_count += 1
+            if self.entries_count > self.max_entries:
+                self.evict()
+        self._changed()
+
+    def get_control_data(self, filename):
+        """Return the control data and the dependencies of a `.deb` file, reading it only if it is not cached
+
+        :rtype: :class:`tuple`
+        """
+        result = self.get(filename)
+        if result is None:
+            control_data = get_control_data(filename)
+            result = control_data, get_dependencies(control_data)
+            self.set(filename, *result)
+        return result
+
+    def evict(self, max_entries=None):
+        """Remove the least recently used entries, keeping only `max_entries` entries (default: 90% of the maximum)"""
+        if max_entries is None:
+            max_entries = int(self.max_entries * 0.9)
+        self.connection.execute('DELETE FROM control_data WHERE path IN (SELECT path FROM control_data '
+                                'ORDER BY last_access DESC LIMIT -1 OFFSET ?)', (max_entries, ))
+        self.entries_count = min(self.entries_count, max_entries)
+        self.connection.commit()
+
+    def invalidate(self, filename=None):
+        """Remove a given file from the cache, or all files if `filename` is `None`"""
+        if filename is None:
+            self.connection.execute('DELETE FROM control_data')
+            self.entries_count = 0
+        else:
+            cursor = self.connection.execute('DELETE FROM control_data WHERE path = ?', (os.path.abspath(filename), ))
+            self.entries_count -= cursor.rowcount
+        self.connection.commit()
+
+    def _changed(self):
+        self.pending_changes += 1
+        if self.pending_changes >= self.commit_interval:
+            self.connection.commit()
+            self.pending_changes = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def copy_or_link(src, dst):
+    """Hardlink `src` to `dst` (replacing `dst`) when both are on the same filesystem, copy it otherwise"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def copy_file(src, dst):
+    """Copy `src` to `dst` through a temporary file, so `dst` is replaced by a new inode and never rewritten in place"""
+    tmp_dst = '%s.tmp%d' % (dst, os.getpid())
+    try:
+        shutil.copy2(src, tmp_dst)
+        os.rename(tmp_dst, dst)
+    finally:
+        if os.path.exists(tmp_dst):
+            os.remove(tmp_dst)
+
+
+class BuildCache(object):
+    """ Cache of built .deb files, stored in `~/.cache/debtools/builds` by default.
+    Packages are identified by a key computed by :meth:`get_key`.
+    When the total size of stored packages exceeds `max_size`, the least recently used ones are removed.
+    Packages are always copied (never hardlinked) to and from the cache, since a later build may rewrite a file of the
+    destination directory in place.
+    Can be used by several threads.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, directory=None, max_size=2 * 1024 ** 3):
+        """
+        :param directory: storage directory
+        :type directory: :class:`str`
+        :param max_size: maximum total size of stored packages, in bytes
+        :type max_size: :class:`int`
+        """
+        if directory is None:
+            directory = get_cache_dir('builds')
+        elif not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, 'builds.sqlite3'), check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS builds (key TEXT PRIMARY KEY, filename TEXT, '
+                                'size INTEGER, last_access REAL)')
+        self.connection.commit()
+
+    @classmethod
+    def get_key(cls, *values):
+        """ Return the key of a package, from any JSON-serializable values
+        (like package name, version, options, Python version, version of the builder)
+
+        :rtype: :class:`str`
+        """
+        content = json.dumps([cls.FORMAT_VERSION] + list(values), sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, destination_dir):
+        """ Copy a stored package to `destination_dir`
+
+        :return: path of the copied .deb file, or `None` if the key is unknown
+        :rtype: :class:`str`
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT filename FROM builds WHERE key = ?', (key, )).fetchone()
+            if row is None:
+                return None
+            path = os.path.join(self.get_path(key), row[0])
+            if not os.path.isfile(path):
+                self.connection.execute('DELETE FROM builds WHERE key = ?', (key, ))
+                self.connection.commit()
+                return None
+            self.connection.execute('UPDATE builds SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+        destination = os.path.join(destination_dir, row[0])
+        copy_file(path, destination)
+        return destination
+
+    def set(self, key, filename):
+        """Store a copy of a .deb file"""
+        directory = self.get_path(key)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        copy_file(filename, os.path.join(directory, os.path.basename(filename)))
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO builds (key, filename, size, last_access) '
+                                    'VALUES (?, ?, ?, ?)',
+                                    (key, os.path.basename(filename), os.path.getsize(filename), time.time()))
+            self.connection.commit()
+            self.evict()
+
+    def evict(self, max_size=None):
+        """Remove the least recently used packages until the total size is lower than `max_size`"""
+        if max_size is None:
+            max_size = self.max_size
+        total_size = 0
+        removed_keys = []
+        for key, size in self.connection.execute('SELECT key, size FROM builds ORDER BY last_access DESC').fetchall():
+            total_size += size
+            if total_size > max_size:
+                removed_keys.append(key)
+        for key in removed_keys:
+            shutil.rmtree(self.get_path(key), ignore_errors=True)
+            self.connection.execute('DELETE FROM builds WHERE key = ?', (key, ))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class SourceCache(object):
+    """ Content-addressed cache of source archives (sdists), stored in `~/.cache/debtools/sources` by default.
+    Archives are stored by their SHA256 and indexed by (normalized name, version).
+    Can be used by several threads.
+    """
+    extensions = ('.tar.gz', '.tar.bz2', '.tgz', '.zip')
+
+    def __init__(self, directory=None):
+        """
+        :param directory: storage directory
+        :type directory: :class:`str`
+        """
+        if directory is None:
+            directory = get_cache_dir('sources')
+        elif not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, 'sources.sqlite3'), check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sources (name TEXT, version TEXT, sha256 TEXT, '
+                                'filename TEXT, PRIMARY KEY (name, version))')
+        self.connection.commit()
+
+    @staticmethod
+    def normalize_name(name):
+        return name.lower().replace('_', '-').strip()
+
+    @classmethod
+    def parse_filename(cls, filename):
+        """ Return the name and the version of a source archive, from its filename
+
+        >>> SourceCache.parse_filename('/tmp/Django-1.8.3.tar.gz')
+        ('django', '1.8.3')
+
+        :return: `(normalized name, version)`, or `None` if this is not a source archive
+        :rtype: :class:`tuple`
+        """
+        basename = os.path.basename(filename)
+        for extension in cls.extensions:
+            if basename.lower().endswith(extension):
+                name, sep, version = basename[:-len(extension)].rpartition('-')
+                if sep and name and version:
+                    return cls.normalize_name(name), version
+        return None
+
+    @staticmethod
+    def get_sha256(filename):
+        sha256 = hashlib.sha256()
+        with open(filename, 'rb') as fd:
+            for block in iter(lambda: fd.read(1048576), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def get_path(self, sha256, filename):
+        return os.path.join(self.directory, sha256[:2], sha256, os.path.basename(filename))
+
+    def get(self, name, version, destination_dir):
+        """ Copy (or hardlink) a stored archive to `destination_dir`. The archive is checked against its SHA256.
+
+        :return: path of the copied archive, or `None` if it is unknown
+        :rtype: :class:`str`
+        """
+        name = self.normalize_name(name)
+        with self.lock:
+            row = self.connection.execute('SELECT sha256, filename FROM sources WHERE name = ? AND version = ?',
+                                          (name, version)).fetchone()
+        if row is None:
+            return None
+        path = self.get_path(*row)
+        if not os.path.isfile(path) or self.get_sha256(path) != row[0]:
+            with self.lock:
+                self.connection.execute('DELETE FROM sources WHERE name = ? AND version = ?', (name, version))
+                self.connection.commit()
+            return None
+        destination = os.path.join(destination_dir, row[1])
+        copy_or_link(path, destination)
+        return destination
+
+    def add(self, filename, name=None, version=None):
+        """ Store a source archive
+
+        :param name: name of the package (guessed from `filename` if not provided)
+        :param version: version of the package (guessed from `filename` if not provided)
+        :return: the SHA256 of the archive
+        :rtype: :class:`str`
+        """
+        if name is None or version is None:
+            parsed = self.parse_filename(filename)
+            if parsed is None:
+                raise ValueError('unable to guess the name and the version of %s' % filename)
+            name, version = name or parsed[0], version or parsed[1]
+        sha256 = self.get_sha256(filename)
+        path = self.get_path(sha256, filename)
+        if not os.path.isfile(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            copy_or_link(filename, path)
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO sources (name, version, sha256, filename) '
+                                    'VALUES (?, ?, ?, ?)',
+                                    (self.normalize_name(name), version, sha256, os.path.basename(filename)))
+            self.connection.commit()
+        return sha256
+
+    def seed(self, directory):
+        """ Add all source archives of a directory
+
+        :return: number of added archives
+        :rtype: :class:`int`
+        """
+        count = 0
+        for basename in sorted(os.listdir(directory)):
+            filename = os.path.join(directory, basename)
+            if os.path.isfile(filename) and self.parse_filename(filename) is not None:
+                self.add(filename)
+                count += 1
+        return count
+
+    def close(self):
+        self.connection.close()
@@ -5,72 +5,370 @@
 from __future__ import unicode_literals, print_function
 
 import argparse
-import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
 import subprocess
+import sys
 
-from debtools.utils import get_control_data, parse_deps, parse_dpkg, check_version_constraint
+from debtools.cache import ControlDataCache
+from debtools.download import AptGetDownloader, MirrorDownloader
+from debtools.graph import DependencyGraph, GraphStore, get_file_source, get_index_source
+from debtools.index import DirectoryIndex, PackageIndex, APT_LISTS_DIR
+from debtools.resolver import ResolutionError, Resolver
+from debtools.utils import get_control_data, get_control_data_many, get_dependencies, read_installed_packages, \
+    DPKG_STATUS_FILE
 
 __author__ = 'Matthieu Gallet'
 
 
 class DepTree(object):
-    def __init__(self, recursive=False, ignored_packages=None, local_packages=None):
-        self.dependencies_by_package = {}
+    def __init__(self, recursive=False, ignored_packages=None, local_packages=None, cache=None, downloader=None,
+                 jobs=1, index=None, graph_store=None):
+        """
+        :param cache: persistent cache of control data
+        :type cache: :class:`debtools.cache.ControlDataCache`
+        :param downloader: if set, packages are concurrently downloaded by `downloader`, otherwise each level of the
+            tree is downloaded by a single `apt-get download` call
+        :type downloader: :class:`debtools.download.Downloader`
+        :param jobs: maximum number of concurrent downloads when `downloader` is set
+        :type jobs: :class:`int`
+        :param index: if set, packages are not downloaded: their dependencies are read from this index
+        :type index: :class:`debtools.index.PackageIndex`
+        :param graph_store: loaded graph of a previous run: packages whose .deb file or index entry is unchanged
+            are not read again; call :meth:`save_graph` to update it
+        :type graph_store: :class:`debtools.graph.GraphStore`
+        """
+        # the only store of the resolved packages and their dependencies
+        self.graph = DependencyGraph()
         self.recursive = recursive
         self.ignored_packages = ignored_packages or {}
         self.local_packages = local_packages
+        self.cache = cache
+        self.downloader = downloader
+        self.jobs = jobs
+        self.index = index
+        # {package name: fields} of packages found in `index`
+        self.selected_packages = {}
+        self._directory_index = None
+        self.graph_store = graph_store
+        # {package name: source (.deb file or index entry)}, used by the graph store
+        self.sources_by_package = {}
+        # {filename: package name} of .deb files that have been added
+        self.package_by_filename = {}
+        # control data of .deb files that have already been read
+        self.control_data_by_filename = {}
+        # dependencies of .deb files that have been found in the cache
+        self.cached_dependencies_by_filename = {}
 
-    @staticmethod
-    def find_package(package_name):
-        """ Tries to find the .deb in the working dir
+    @property
+    def dependencies_by_package(self):
+        """{package name: {dependency name: VersionRange}} of resolved packages, built from :attr:`graph`"""
+        return {x: dict(self.graph.dependencies(x)) for x in self.graph.resolved_names()}
+
+    def preload(self, filenames, workers=None):
+        """ Read the control data of several .deb files in parallel.
+
+        :param filenames: list of .deb files
+        :type filenames: :class:`list`
+        :param workers: number of processes
+        :type workers: :class:`int`
+        :return: list of (filename, exception) for invalid files
+        :rtype: :class:`list`
+        """
+        errors = []
+        if self.cache is not None:
+            missing_filenames = []
+            for filename in filenames:
+                if not os.path.isfile(filename) or not self.__load_from_cache(filename):
+                    missing_filenames.append(filename)
+            filenames = missing_filenames
+        for filename, control_data, error in get_control_data_many(filenames, workers=workers, ordered=False):
+            if error is None:
+                self.control_data_by_filename[filename] = control_data
+                if self.cache is not None:
+                    self.cache.set(filename, control_data)
+            else:
+                errors.append((filename, error))
+        return errors
+
+    def __load_from_cache(self, filename):
+        cached_data = self.cache.get(filename)
+        if cached_data is None:
+            return False
+        self.control_data_by_filename[filename], self.cached_dependencies_by_filename[filename] = cached_data
+        return True
+
+    def get_control_data(self, filename):
+        if filename in self.control_data_by_filename:
+            return self.control_data_by_filename[filename]
+        if self.cache is None or not self.__load_from_cache(filename):
+            self.control_data_by_filename[filename] = get_control_data(filename)
+            if self.cache is not None:
+                self.cache.set(filename, self.control_data_by_filename[filename])
+        return self.control_data_by_filename[filename]
+
+    def get_dependencies(self, filename):
+        # cached dependencies are computed without any locally installed package
+        if self.local_packages is None and filename in self.cached_dependencies_by_filename:
+            return self.cached_dependencies_by_filename[filename]
+        return get_dependencies(self.get_control_data(filename), local_packages=self.local_packages)
+
+    @property
+    def directory_index(self):
+        """:class:`debtools.index.DirectoryIndex` of the working dir, built on first use"""
+        if self._directory_index is None:
+            self._directory_index = DirectoryIndex('.', get_control_data=self.get_control_data)
+            self._directory_index.refresh()
+        return self._directory_index
+
+    def find_package(self, package_name):
+        """ Tries to find the .deb in the working dir (the highest version if there are several ones)
         :param package_name:
         :type package_name:
         :return:
         :rtype:
         """
-        present_files = [x for x in os.listdir('.')
-                         if x.startswith(package_name + '_') and os.path.isfile(x) and x.endswith('.deb')]
-        if len(present_files) == 1:
-            return present_files[0]
-        return None
+        return self.directory_index.get(package_name)
 
     def add(self, file_or_package_name):
-        if file_or_package_name in self.dependencies_by_package:
-            return
-        if not file_or_package_name.endswith('.deb'):
-            proposed_filename = self.find_package(file_or_package_name)
-            if proposed_filename:
-                file_or_package_name = proposed_filename
+        self.resolve([file_or_package_name])
+
+    def resolve(self, files_or_package_names):
+        """ Add several packages (and their dependencies if `recursive` is set), breadth-first.
+        All unknown packages of a given depth are downloaded by a single `apt-get download` call.
+
+        :param files_or_package_names: list of package names or .deb filenames
+        :type files_or_package_names: :class:`list`
+        """
+        if self.index is not None:
+            return self.__resolve_from_index(files_or_package_names)
+        elif self.downloader is not None:
+            return self.__resolve_concurrently(files_or_package_names)
+        frontier = list(files_or_package_names)
+        queued = set(frontier)
+        while frontier:
+            missing_package_names = []
+            next_frontier = []
+            for file_or_package_name in frontier:
+                if self.graph.is_resolved(file_or_package_name):
+                    continue
+                filename = file_or_package_name
+                if not file_or_package_name.endswith('.deb'):
+                    filename = self.find_package(file_or_package_name)
+                    if filename is None:
+                        missing_package_names.append(file_or_package_name)
+                        continue
+                next_frontier += self.__add_file(filename)
+            if missing_package_names:
+                for filename in self.download(missing_package_names):
+                    next_frontier += self.__add_file(filename)
+            frontier = []
+            for file_or_package_name in next_frontier:
+                if file_or_package_name not in queued:
+                    queued.add(file_or_package_name)
+                    frontier.append(file_or_package_name)
+
+    def __resolve_concurrently(self, files_or_package_names):
+        """ Add several packages, downloading up to `jobs` packages at the same time.
+        Each downloaded file is read as soon as it is available and its dependencies are immediately scheduled,
+        so downloads and reads overlap.
+        """
+        to_process = deque(files_or_package_names)
+        queued = set(to_process)
+        pending = {}
+        if self.downloader.directory_index is None and \
+                os.path.abspath(self.downloader.directory) == os.path.abspath('.'):
+            # downloaded files are directly added to our index, without listing the directory again
+            self.downloader.directory_index = self.directory_index
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as executor:
+            try:
+                while to_process or pending:
+                    while to_process:
+                        file_or_package_name = to_process.popleft()
+                        if self.graph.is_resolved(file_or_package_name):
+                            continue
+                        filename = file_or_package_name
+                        if not file_or_package_name.endswith('.deb'):
+                            filename = self.find_package(file_or_package_name)
+                            if filename is None:
+                                future = executor.submit(self.downloader.download, file_or_package_name)
+                                pending[future] = file_or_package_name
+                                continue
+                        to_process += self.__new_names(self.__add_file(filename), queued)
+                    if pending:
+                        done, __ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            del pending[future]
+                            filename = future.result()
+                            self.directory_index.add_file(filename)
+                            to_process += self.__new_names(self.__add_file(filename), queued)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+    def __resolve_from_index(self, files_or_package_names):
+        """ Add several packages, using only the metadata of `index` (.deb files are read, but never downloaded).
+        A :class:`debtools.resolver.Resolver` selects a package for each dependency, including alternatives and
+        virtual packages; each dependency of the tree is then replaced by its selected package.
+        Packages whose index entry is unchanged in `graph_store` keep their stored dependencies: the resolver only
+        runs if some package is not found there.
+        """
+        roots = []
+        # {package name: source} of local .deb files
+        local_sources = {}
+        for file_or_package_name in files_or_package_names:
+            if file_or_package_name.endswith('.deb'):
+                control_data = self.get_control_data(file_or_package_name)
+                local_sources[control_data['Package']] = get_file_source(file_or_package_name)
+                roots.append(control_data)
+            elif not self.graph.is_resolved(file_or_package_name):
+                roots.append(file_or_package_name)
+        resolvers = []
+
+        def get_resolver():
+            if not resolvers:
+                resolvers.append(Resolver(self.index, installed=self.local_packages, ignored=self.ignored_packages))
+                if self.recursive:
+                    resolvers[0].resolve(roots)
+            return resolvers[0]
+
+        def select(package_name, version_range=None):
+            if resolvers and package_name in resolvers[0].selected:
+                return resolvers[0].selected[package_name]
+            control_data = self.index.get(package_name, version_range)
+            if control_data is None or self.__lookup_graph_store(get_index_source(control_data)) is None:
+                control_data = get_resolver().selected.get(package_name, control_data)
+            return control_data
+
+        to_process = deque()
+        for root in roots:
+            control_data = root if isinstance(root, dict) else select(root)
+            if control_data is None:
+                raise ValueError('Unknown package %s' % root)
+            to_process.append(control_data)
+        while to_process:
+            control_data = to_process.popleft()
+            package_name = control_data['Package']
+            if self.graph.is_resolved(package_name):
+                continue
+            source = local_sources.get(package_name)
+            if source is None:
+                self.selected_packages[package_name] = control_data
+                source = get_index_source(control_data)
+            stored = self.__lookup_graph_store(source)
+            if stored is not None:
+                dependencies = stored[1]
             else:
-                previous_content = set(os.listdir('.'))
-                subprocess.check_call(['apt-get', 'download', file_or_package_name])
-                new_content = set(os.listdir('.'))
-                diff = [x for x in (new_content - previous_content) if x.endswith('.deb')]
-                if not diff:
-                    raise ValueError('Unable to download %s' % file_or_package_name)
-                elif len(diff) > 1:
-                    raise ValueError('Unable to find %s in %s' % (file_or_package_name, diff))
-                file_or_package_name = diff[0]
-        control_data = get_control_data(file_or_package_name)
-        package_name = control_data['Package']
-        deps = {}
-        for key in ('Depends', 'Pre-Depends'):
-            if key in control_data:
-                deps.update(parse_deps(control_data[key], local_packages=self.local_packages))
-        self.dependencies_by_package[package_name] = deps
-        if not self.recursive:
+                dependencies = get_resolver().get_dependencies(control_data)
+            new_names = self.__add_package(package_name, dependencies, source=source)
+            to_process += [x for x in (select(y, dependencies[y]) for y in new_names) if x is not None]
+
+    def download_selected(self, downloader, jobs=None):
+        """ Download the packages selected in `index`, concurrently.
+
+        :param downloader: downloader to use
+        :type downloader: :class:`debtools.download.Downloader`
+        :param jobs: maximum number of concurrent downloads (default: `jobs`)
+        :type jobs: :class:`int`
+        :return: list of downloaded files
+        :rtype: :class:`list`
+        """
+        package_names = sorted(self.selected_packages)
+        with ThreadPoolExecutor(max_workers=max(jobs or self.jobs, 1)) as executor:
+            return list(executor.map(lambda x: downloader.download(x, self.selected_packages[x]['Version']),
+                                     package_names))
+
+    @staticmethod
+    def __new_names(names, queued):
+        result = [x for x in names if x not in queued]
+        queued.update(result)
+        return result
+
+    def __add_file(self, filename):
+        """ Read the dependencies of a .deb file
+
+        :return: list of dependencies to add
+        :rtype: :class:`list`
+        """
+        source = get_file_source(filename) if self.graph_store is not None else None
+        stored = self.__lookup_graph_store(source)
+        if stored is not None:
+            package_name, dependencies = stored
+        else:
+            package_name, dependencies = self.get_control_data(filename)['Package'], None
+        self.package_by_filename[filename] = package_name
+        if self.graph.is_resolved(package_name):
+            return []
+        if dependencies is None:
+            dependencies = self.get_dependencies(filename)
+        return self.__add_package(package_name, dependencies, source=source)
+
+    def __lookup_graph_store(self, source):
+        # stored dependencies are computed without any locally installed package
+        if self.graph_store is None or source is None or self.local_packages is not None:
+            return None
+        return self.graph_store.lookup(source)
+
+    def save_graph(self):
+        """Store the resolved packages in `graph_store`, for the next run"""
+        if self.graph_store is None or self.local_packages is not None:
             return
-        for other_package_name, version_constraints in self.dependencies_by_package[package_name].items():
-            is_ignored = False
-            if other_package_name in self.ignored_packages:
-                ignored_version = self.ignored_packages[other_package_name]
-                is_ignored = True
-                for version_constraint in version_constraints:
-                    if not check_version_constraint(ignored_version, version_constraint[0], version_constraint[1]):
-                        is_ignored = False
-            if not is_ignored:
-                self.add(other_package_name)
+        self.graph_store.update({x: dict(self.graph.dependencies(x)) for x in self.sources_by_package},
+                                self.sources_by_package)
+        self.graph_store.save()
+
+    def __add_package(self, package_name, dependencies, source=None):
+        """ Add a package, given its parsed dependencies
+
+        :param source: origin of the package (see :mod:`debtools.graph`)
+        :return: list of dependencies to add
+        :rtype: :class:`list`
+        """
+        self.graph.add_package(package_name, dependencies)
+        if source is not None:
+            self.sources_by_package[package_name] = source
+        if not self.recursive:
+            return []
+        result = []
+        for other_package_name, version_range in dependencies.items():
+            if other_package_name in self.ignored_packages and \
+                    version_range.satisfied_by(self.ignored_packages[other_package_name]):
+                continue
+            elif not self.graph.is_resolved(other_package_name):
+                result.append(other_package_name)
+        return result
+
+    @staticmethod
+    def apt_get_download(package_names):
+        subprocess.check_call(['apt-get', 'download'] + list(package_names))
+
+    def download(self, package_names):
+        """ Download packages with a single `apt-get download` call.
+        Downloaded files are identified by their control data (read through the cache, if any), not by their names.
+
+        :param package_names: names of the packages to download
+        :type package_names: :class:`list`
+        :return: list of downloaded files, in the same order as `package_names`
+        :rtype: :class:`list`
+        """
+        # existing files must be indexed before the download, so they are not mistaken for new ones
+        directory_index = self.directory_index
+        try:
+            self.apt_get_download(package_names)
+        except subprocess.CalledProcessError:
+            if len(package_names) == 1:
+                raise ValueError('Unable to download %s' % package_names[0])
+            # apt-get stops at the first unknown package: find which one
+            return [filename for package_name in package_names for filename in self.download([package_name])]
+        # only new files are indexed
+        directory_index.refresh(parse_filenames=False)
+        filenames = [self.find_package(x) for x in package_names]
+        for package_name, filename in zip(package_names, filenames):
+            if filename is None:
+                raise ValueError('Unable to download %s' % package_name)
+        return filenames
 
 
 def main():
@@ -84,42 +382,130 @@ def main():
     parser.add_argument('package', nargs='+', default=None,
                         help='Filename (must ends by .deb) or package name to analyze')
     parser.add_argument('-r', '--recursive', action='store_true', default=False, help='Recursive download')
-    parser.add_argument('-i', '--ignored', default=None, help='file with the result of `dpkg -l`')
+    parser.add_argument('-i', '--ignored', default=None,
+                        help='file with packages to ignore: copy of /var/lib/dpkg/status or result of `dpkg -l`')
     parser.add_argument('-l', '--local', default=False, action='store_true',
                         help='use locally installed packages for solving dependencies with choices')
+    parser.add_argument('--status-file', default=DPKG_STATUS_FILE,
+                        help='dpkg status database used by --local (default: %(default)s)')
+    parser.add_argument('--cache', default=False, action='store_true',
+                        help='use a persistent cache of control data')
+    parser.add_argument('--cache-file', default=None,
+                        help='path of the cache file (default: ~/.cache/debtools/control_data.sqlite3)')
+    parser.add_argument('--clear-cache', default=False, action='store_true',
+                        help='empty the cache (and the stored graph) before use')
+    parser.add_argument('--format', default='text', choices=('text', 'dot', 'jsonl', 'order'),
+                        help='output format: readable text, Graphviz, one JSON document per package, or installation '
+                             'order (one line per package, or per group of packages that depend on each other)')
+    parser.add_argument('--graph', default=False, action='store_true',
+                        help='store the resolved graph and only re-resolve modified packages on the next run')
+    parser.add_argument('--graph-file', default=None,
+                        help='path of the stored graph (default: ~/.cache/debtools/graph.json)')
+    parser.add_argument('-j', '--jobs', default=os.cpu_count() or 1, type=int,
+                        help='number of processes used for reading .deb files and of concurrent downloads '
+                             '(default: %(default)s)')
+    parser.add_argument('--mirror', default=None,
+                        help='download packages from this flat mirror (http:// or file:// URL of a directory with a '
+                             'Packages index) instead of apt-get')
+    parser.add_argument('--parallel-download', default=False, action='store_true',
+                        help='run one apt-get download per package, up to --jobs at the same time')
+    parser.add_argument('--index', default=[], action='append',
+                        help='solve dependencies with this Packages index (can be compressed) instead of downloading '
+                             'packages; can be repeated')
+    parser.add_argument('--apt-lists', default=False, action='store_true',
+                        help='solve dependencies with the Packages indexes of apt (%s/*_Packages) instead of '
+                             'downloading packages' % APT_LISTS_DIR)
+    parser.add_argument('--arch', default=[], action='append',
+                        help='only use packages of this architecture (and "all") from indexes; can be repeated')
+    parser.add_argument('--download', default=False, action='store_true',
+                        help='with --index or --apt-lists, download selected packages once all dependencies are '
+                             'solved')
     args = parser.parse_args()
+    if args.cache_file:
+        args.cache_file = os.path.abspath(args.cache_file)
+    if args.graph_file:
+        args.graph_file = os.path.abspath(args.graph_file)
+    if args.ignored:
+        args.ignored = os.path.abspath(args.ignored)
+    args.index = [os.path.abspath(x) for x in args.index]
+    args.status_file = os.path.abspath(args.status_file)
     os.chdir(args.dir)
     if not args.package:
         print('Please provide a package name')
         return 1
 
     if args.ignored:
-        with codecs.open(args.ignored, 'r', encoding='utf-8') as fd:
-            dpkg_content = fd.read()
-        ignored_packages = parse_dpkg(dpkg_content)
+        ignored_packages = read_installed_packages(args.ignored)
     else:
         ignored_packages = {}
 
     local_packages = None
     if args.local:
-        dpkg_output = subprocess.check_output(['dpkg', '-l'])
-        local_packages = parse_dpkg(dpkg_output.decode('utf-8'))
-
-    dep_tree = DepTree(recursive=args.recursive, ignored_packages=ignored_packages, local_packages=local_packages)
-    for file_or_package_name in args.package:
-        dep_tree.add(file_or_package_name)
-    package_names = list(dep_tree.dependencies_by_package.keys())
-    package_names.sort()
-    for package_name in package_names:
-        dependencies = dep_tree.dependencies_by_package[package_name]
-        print(package_name)
-        print('=' * len(package_name))
-        print('')
-        for other_package, constraints in dependencies.items():
-            constraint_str = ''
-            if constraints:
-                constraint_str = ', ' .join(['%s %s' % x for x in constraints])
-                constraint_str = '(%s)' % constraint_str
-            print('  * %s %s' % (other_package, constraint_str))
-        print('')
-    return 0
+        local_packages = read_installed_packages(args.status_file)
+
+    cache = None
+    if args.cache or args.cache_file:
+        cache = ControlDataCache(filename=args.cache_file)
+        if args.clear_cache:
+            cache.invalidate()
+    downloader = None
+    if args.mirror:
+        downloader = MirrorDownloader(args.mirror)
+    elif args.parallel_download:
+        downloader = AptGetDownloader()
+    index = None
+    if args.index or args.apt_lists:
+        index = PackageIndex(architectures=args.arch or None)
+        for filename in args.index:
+            index.load(filename)
+        if args.apt_lists:
+            index.load_apt_lists()
+    graph_store = None
+    if args.graph or args.graph_file:
+        graph_store = GraphStore(filename=args.graph_file)
+        if not args.clear_cache:
+            graph_store.load()
+    dep_tree = DepTree(recursive=args.recursive, ignored_packages=ignored_packages, local_packages=local_packages,
+                       cache=cache, downloader=None if index else downloader, jobs=args.jobs, index=index,
+                       graph_store=graph_store)
+    deb_filenames = [x for x in args.package if x.endswith('.deb')]
+    invalid_filenames = set()
+    if len(deb_filenames) > 1:
+        for filename, error in dep_tree.preload(deb_filenames, workers=args.jobs):
+            print('Unable to read %s: %s' % (filename, error), file=sys.stderr)
+            invalid_filenames.add(filename)
+    try:
+        dep_tree.resolve([x for x in args.package if x not in invalid_filenames])
+    except ResolutionError as e:
+        print('Unable to resolve dependencies: %s' % e, file=sys.stderr)
+        if cache is not None:
+            cache.close()
+        return 2
+    if args.format == 'dot':
+        for line in dep_tree.graph.iter_dot():
+            print(line)
+    elif args.format == 'jsonl':
+        for line in dep_tree.graph.iter_jsonl():
+            print(line)
+    elif args.format == 'order':
+        for component in dep_tree.graph.strongly_connected_components():
+            component = [x for x in component if dep_tree.graph.is_resolved(x)]
+            if component:
+                print(' '.join(component))
+    else:
+        for package_name in sorted(dep_tree.graph.resolved_names()):
+            print(package_name)
+            print('=' * len(package_name))
+            print('')
+            for other_package, constraints in dep_tree.graph.dependencies(package_name):
+                constraint_str = ''
+                if constraints:
+                    constraint_str = '(%s)' % constraints
+                print('  * %s %s' % (other_package, constraint_str))
+            print('')
+    dep_tree.save_graph()
+    if index is not None and args.download:
+        dep_tree.download_selected(downloader or AptGetDownloader())
+    if cache is not None:
+        cache.close()
+    return 1 if invalid_filenames else 0
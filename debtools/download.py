@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Download .deb files, with `apt-get download` or from a HTTP (or `file://`) mirror
+
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+try:
+    from urllib.request import urlopen
+    from urllib.parse import urljoin
+except ImportError:
+    from urllib2 import urlopen
+    from urlparse import urljoin
+
+from debtools.index import DirectoryIndex, PackageIndex
+from debtools.utils import get_control_data
+from debtools.versions import VersionRange
+
+__author__ = 'Matthieu Gallet'
+
+
+def find_downloaded_files(directory, package_names, get_control_data=get_control_data, version_ranges=None):
+    """ Find the .deb files of some packages in a directory, with a single listing of this directory
+    (see :class:`debtools.index.DirectoryIndex`). The highest version is selected when several files are available.
+
+    :param directory: directory containing .deb files
+    :type directory: :class:`str`
+    :param package_names: names of the packages
+    :type package_names: :class:`list`
+    :param get_control_data: function returning the control data of a .deb file
+    :param version_ranges: optional dict {package name: allowed versions (:class:`debtools.versions.VersionRange`)}
+    :type version_ranges: :class:`dict`
+    :return: dict {package name: path of its .deb file}; packages that are not found are missing
+    :rtype: :class:`dict`
+    """
+    directory_index = DirectoryIndex(directory, get_control_data=get_control_data)
+    directory_index.refresh()
+    result = {}
+    version_ranges = version_ranges or {}
+    for package_name in package_names:
+        filename = directory_index.get(package_name, version_ranges.get(package_name))
+        if filename is not None:
+            result[package_name] = filename
+    return result
+
+
+class Downloader(object):
+    """ Download packages into a directory. Subclasses must implement :meth:`download`, that may be called by
+    several threads at the same time.
+    """
+
+    def __init__(self, directory='.', directory_index=None):
+        """
+        :param directory: destination directory of .deb files
+        :type directory: :class:`str`
+        :param directory_index: index of `directory`, shared with the caller: downloaded files are added to it
+        :type directory_index: :class:`debtools.index.DirectoryIndex`
+        """
+        self.directory = directory
+        self.directory_index = directory_index
+
+    def download(self, package_name, version=None):
+        """ Download a package
+
+        :param package_name: name of the package
+        :type package_name: :class:`str`
+        :param version: version to download (the highest available one if `None`)
+        :type version: :class:`str`
+        :return: path of the downloaded .deb file
+        :rtype: :class:`str`
+        :raise ValueError: if the package cannot be downloaded
+        """
+        raise NotImplementedError
+
+
+class AptGetDownloader(Downloader):
+    """ Download packages with `apt-get download`, one process per package.
+    Each process runs in its own temporary subdirectory, so the downloaded file is identified without listing
+    `directory` again; it is then moved to `directory` and added to `directory_index`.
+    """
+
+    def download(self, package_name, version=None):
+        argument = package_name
+        version_range = None
+        if version is not None:
+            version_range = VersionRange([('=', version)])
+            argument = '%s=%s' % (package_name, version)
+        if self.directory_index is not None:
+            filename = self.directory_index.get(package_name, version_range)
+            if filename is not None:
+                return filename
+        tmp_dir = tempfile.mkdtemp(prefix='.apt-get-', dir=self.directory)
+        try:
+            try:
+                subprocess.check_call(['apt-get', 'download', argument], cwd=tmp_dir)
+            except subprocess.CalledProcessError:
+                raise ValueError('Unable to download %s' % argument)
+            basenames = [x for x in os.listdir(tmp_dir) if x.endswith('.deb')]
+            if len(basenames) != 1:
+                raise ValueError('Unable to download %s' % argument)
+            filename = os.path.join(self.directory, basenames[0])
+            os.rename(os.path.join(tmp_dir, basenames[0]), filename)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if self.directory_index is not None:
+            self.directory_index.add_file(filename)
+        return filename
+
+
+class MirrorDownloader(Downloader):
+    """ Download packages from a flat mirror: a base URL (`http://`, `https://` or `file://`) with a `Packages`
+    index (possibly compressed as `Packages.xz` or `Packages.gz`), whose `Filename` fields are relative to this URL.
+    When several versions of a package are available, the highest one is downloaded.
+    """
+    index_names = ('Packages.xz', 'Packages.gz', 'Packages')
+    chunk_size = 1048576
+
+    def __init__(self, url, directory='.', directory_index=None):
+        """
+        :param url: base URL of the mirror
+        :type url: :class:`str`
+        """
+        super(MirrorDownloader, self).__init__(directory=directory, directory_index=directory_index)
+        self.url = url if url.endswith('/') else url + '/'
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def index(self):
+        """:class:`debtools.index.PackageIndex` of the mirror, loaded on first use"""
+        with self._index_lock:
+            if self._index is None:
+                self._index = self.load_index()
+        return self._index
+
+    def load_index(self):
+        for index_name in self.index_names:
+            try:
+                response = urlopen(urljoin(self.url, index_name))
+            except (IOError, OSError):
+                continue
+            try:
+                content = io.BytesIO(response.read())
+            finally:
+                response.close()
+            break
+        else:
+            raise ValueError('No Packages index found at %s' % self.url)
+        index = PackageIndex()
+        index.load_fileobj(content, name=index_name)
+        return index
+
+    def download(self, package_name, version=None):
+        stanza = self.index.get(package_name, VersionRange([('=', version)]) if version is not None else None)
+        if stanza is None or 'Filename' not in stanza:
+            raise ValueError('Unable to download %s: unknown package' % package_name)
+        filename = os.path.join(self.directory, os.path.basename(stanza['Filename']))
+        size = int(stanza['Size']) if stanza.get('Size', '').isdigit() else None
+        if size is not None and os.path.isfile(filename) and os.path.getsize(filename) == size:
+            return filename
+        url = urljoin(self.url, stanza['Filename'])
+        # write to a temporary file, so a partial download is never mistaken for a valid .deb
+        fd, tmp_filename = tempfile.mkstemp(suffix='.part', dir=self.directory)
+        try:
+            sha256 = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as fileobj:
+                response = urlopen(url)
+                try:
+                    chunk = response.read(self.chunk_size)
+                    while chunk:
+                        sha256.update(chunk)
+                        fileobj.write(chunk)
+                        chunk = response.read(self.chunk_size)
+                finally:
+                    response.close()
+            if stanza.get('SHA256') and sha256.hexdigest() != stanza['SHA256'].lower():
+                raise ValueError('Unable to download %s: invalid checksum' % package_name)
+            os.chmod(tmp_filename, 0o644)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            raise ValueError('Unable to download %s: %s' % (package_name, e))
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+        if self.directory_index is not None:
+            self.directory_index.add_file(filename)
+        return filename
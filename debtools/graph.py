@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""Dependency graphs, and their storage between runs
+
+"""
+from __future__ import unicode_literals
+
+from array import array
+from collections import deque
+import json
+import os
+import tempfile
+
+from debtools.cache import get_cache_dir
+from debtools.versions import VersionRange
+
+__author__ = 'Matthieu Gallet'
+
+
+class DependencyGraph(object):
+    """ Compact dependency graph: package names are interned as integer ids, and the dependencies (forward edges)
+    and reverse dependencies (reverse edges) of each package are stored in integer arrays, built together.
+    Each distinct constraint is stored once, as a :class:`debtools.versions.VersionRange`.
+
+    Edges go from a package to its dependencies, so dependencies come first in the installation order.
+
+    >>> graph = DependencyGraph()
+    >>> graph.add_package('a', {'b': VersionRange([('>=', '1.0')]), 'c': VersionRange()})
+    >>> graph.add_package('b', {'c': VersionRange()})
+    >>> graph.reverse_dependencies('c'), sorted(graph.closure(['b'])), graph.topological_order()
+    (['a', 'b'], ['b', 'c'], ['c', 'b', 'a'])
+    """
+
+    def __init__(self):
+        # package names, by id
+        self.names = []
+        self.ids = {}
+        # packages whose dependencies are known (1) or not (0), by id
+        self.resolved = bytearray()
+        # VersionRange, by constraint id
+        self.constraints = []
+        self.constraint_ids = {}
+        # dependency ids, constraint ids of these dependencies, and reverse dependency ids, by package id
+        self.forward = []
+        self.forward_constraints = []
+        self.reverse = []
+
+    def intern(self, package_name):
+        """Return the id of a package, creating it if required"""
+        package_id = self.ids.get(package_name)
+        if package_id is None:
+            package_id = len(self.names)
+            self.ids[package_name] = package_id
+            self.names.append(package_name)
+            self.resolved.append(0)
+            self.forward.append(array('i'))
+            self.forward_constraints.append(array('i'))
+            self.reverse.append(array('i'))
+        return package_id
+
+    def intern_constraint(self, version_range):
+        """Return the id of a constraint, creating it if required"""
+        key = str(version_range)
+        constraint_id = self.constraint_ids.get(key)
+        if constraint_id is None:
+            constraint_id = len(self.constraints)
+            self.constraint_ids[key] = constraint_id
+            self.constraints.append(version_range)
+        return constraint_id
+
+    def add_package(self, package_name, dependencies):
+        """ Add a package and its dependencies (a package can only be added once)
+
+        :param dependencies: {dependency name: VersionRange}
+        :type dependencies: :class:`dict`
+        """
+        package_id = self.intern(package_name)
+        if self.resolved[package_id]:
+            raise ValueError('%s is already in the graph' % package_name)
+        self.resolved[package_id] = 1
+        targets, constraints = self.forward[package_id], self.forward_constraints[package_id]
+        for other_package_name, version_range in dependencies.items():
+            other_package_id = self.intern(other_package_name)
+            targets.append(other_package_id)
+            constraints.append(self.intern_constraint(version_range))
+            self.reverse[other_package_id].append(package_id)
+
+    @classmethod
+    def from_dependencies(cls, dependencies_by_package):
+        """Build a graph from a dict {package name: {dependency name: VersionRange}}"""
+        graph = cls()
+        for package_name in sorted(dependencies_by_package):
+            graph.add_package(package_name, dependencies_by_package[package_name])
+        return graph
+
+    def to_arrays(self):
+        """ Return the graph as flat lists: dependencies of package `i` are the edges `offsets[i]:offsets[i + 1]`,
+        whose targets and constraint ids are in `targets` and `edge_constraints`.
+
+        :return: dict with `packages`, `constraints` (lists of `[operator, version]`), `offsets`, `targets` and
+            `edge_constraints` keys
+        :rtype: :class:`dict`
+        """
+        offsets, targets, edge_constraints = [0], [], []
+        for package_id in range(len(self.names)):
+            targets += self.forward[package_id]
+            edge_constraints += self.forward_constraints[package_id]
+            offsets.append(len(targets))
+        constraints = [[[op, str(version)] for (op, version) in x] for x in self.constraints]
+        return {'packages': list(self.names), 'constraints': constraints, 'offsets': offsets, 'targets': targets,
+                'edge_constraints': edge_constraints}
+
+    def __contains__(self, package_name):
+        return package_name in self.ids
+
+    def is_resolved(self, package_name):
+        """Return `True` if the dependencies of a package have been added"""
+        package_id = self.ids.get(package_name)
+        return package_id is not None and self.resolved[package_id] == 1
+
+    def resolved_names(self):
+        """Return the names of the packages whose dependencies have been added, by id"""
+        return [x for (x, y) in zip(self.names, self.resolved) if y]
+
+    def __len__(self):
+        return len(self.names)
+
+    def dependencies(self, package_name):
+        """Return the list of `(dependency name, VersionRange)` of a package"""
+        package_id = self.ids[package_name]
+        return [(self.names[x], self.constraints[y])
+                for (x, y) in zip(self.forward[package_id], self.forward_constraints[package_id])]
+
+    def reverse_dependencies(self, package_name):
+        """Return the sorted names of the packages that directly depend on a package"""
+        return sorted({self.names[x] for x in self.reverse[self.ids[package_name]]})
+
+    def closure(self, package_names, reverse=False):
+        """ Return the transitive closure of some packages (including themselves)
+
+        :param package_names: names of the packages
+        :param reverse: follow reverse dependencies (all packages that depend on them) instead of dependencies
+        :type reverse: :class:`bool`
+        :rtype: :class:`set`
+        """
+        edges = self.reverse if reverse else self.forward
+        visited = bytearray(len(self.names))
+        to_visit = deque(self.ids[x] for x in package_names)
+        for package_id in to_visit:
+            visited[package_id] = 1
+        while to_visit:
+            for other_package_id in edges[to_visit.popleft()]:
+                if not visited[other_package_id]:
+                    visited[other_package_id] = 1
+                    to_visit.append(other_package_id)
+        return {self.names[x] for x in range(len(self.names)) if visited[x]}
+
+    def strongly_connected_components(self):
+        """ Return the strongly connected components of the graph (iterative Tarjan's algorithm).
+        Components are in installation order: the dependencies of a component are in previous components.
+        Packages of a component with more than one package depend on each other (like Pre-Depends loops).
+
+        :return: list of lists of package names
+        :rtype: :class:`list`
+        """
+        count = len(self.names)
+        index = array('i', [-1]) * count
+        lowlink = array('i', [0]) * count
+        on_stack = bytearray(count)
+        stack = []
+        components = []
+        next_index = 0
+        for root in range(count):
+            if index[root] != -1:
+                continue
+            # (package id, position in its dependencies)
+            work = [(root, 0)]
+            index[root] = lowlink[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = 1
+            while work:
+                package_id, position = work[-1]
+                targets = self.forward[package_id]
+                if position < len(targets):
+                    work[-1] = (package_id, position + 1)
+                    other_package_id = targets[position]
+                    if index[other_package_id] == -1:
+                        index[other_package_id] = lowlink[other_package_id] = next_index
+                        next_index += 1
+                        stack.append(other_package_id)
+                        on_stack[other_package_id] = 1
+                        work.append((other_package_id, 0))
+                    elif on_stack[other_package_id] and index[other_package_id] < lowlink[package_id]:
+                        lowlink[package_id] = index[other_package_id]
+                    continue
+                work.pop()
+                if work and lowlink[package_id] < lowlink[work[-1][0]]:
+                    lowlink[work[-1][0]] = lowlink[package_id]
+                if lowlink[package_id] == index[package_id]:
+                    component = []
+                    while True:
+                        other_package_id = stack.pop()
+                        on_stack[other_package_id] = 0
+                        component.append(self.names[other_package_id])
+                        if other_package_id == package_id:
+                            break
+                    components.append(sorted(component))
+        return components
+
+    def cycles(self):
+        """Return the strongly connected components with more than one package, or with a package depending on
+        itself"""
+        return [x for x in self.strongly_connected_components()
+                if len(x) > 1 or self.ids[x[0]] in self.forward[self.ids[x[0]]]]
+
+    def topological_order(self):
+        """ Return the package names in installation order (dependencies first).
+        Packages of a cycle are consecutive, in alphabetical order.
+
+        :rtype: :class:`list`
+        """
+        return [x for component in self.strongly_connected_components() for x in component]
+
+    def iter_dot(self, name='dependencies'):
+        """ Yield the lines of a Graphviz representation of the graph
+
+        :rtype: :class:`generator`
+        """
+        yield 'digraph %s {' % json.dumps(name)
+        for package_id, package_name in enumerate(self.names):
+            if not self.resolved[package_id]:
+                yield '  %s [style=dashed];' % json.dumps(package_name)
+        for package_id, package_name in enumerate(self.names):
+            for other_package_id, constraint_id in zip(self.forward[package_id], self.forward_constraints[package_id]):
+                version_range = self.constraints[constraint_id]
+                label = ' [label=%s]' % json.dumps(str(version_range)) if version_range else ''
+                yield '  %s -> %s%s;' % (json.dumps(package_name), json.dumps(self.names[other_package_id]), label)
+        yield '}'
+
+    def iter_jsonl(self):
+        """ Yield one JSON document per package: `{"package": name, "resolved": bool, "depends": {name: constraint}}`
+
+        :rtype: :class:`generator`
+        """
+        for package_id, package_name in enumerate(self.names):
+            depends = {self.names[x]: str(self.constraints[y])
+                       for (x, y) in zip(self.forward[package_id], self.forward_constraints[package_id])}
+            yield json.dumps({'package': package_name, 'resolved': bool(self.resolved[package_id]),
+                              'depends': depends}, sort_keys=True)
+
+
+def get_file_source(filename):
+    """Return the source of a package read from a .deb file: `['deb', path, inode, size, modification time in ns]`"""
+    stat_result = os.stat(filename)
+    mtime = getattr(stat_result, 'st_mtime_ns', None) or int(stat_result.st_mtime * 1000000000)
+    return ['deb', os.path.abspath(filename), stat_result.st_ino, stat_result.st_size, mtime]
+
+
+def get_index_source(control_data):
+    """Return the source of a package read from a `Packages` index: `['index', package, version, checksum]`"""
+    return ['index', control_data['Package'], control_data.get('Version', ''),
+            control_data.get('SHA256') or control_data.get('Filename', '')]
+
+
+class GraphStore(object):
+    """ Store the resolved dependency graph on disk, so the next run only re-resolves packages whose
+    .deb file or index entry has changed.
+
+    The graph is stored as JSON with integer package ids and flat arrays::
+
+        {"version": 1,
+         "packages": ["a", "b", "c"],                    # package names, by id
+         "sources": [["deb", "/x/a_1.0_all.deb", inode, size, mtime], null, ...],    # null if not resolved
+         "constraints": [[], [[">=", "1.0"]]],           # distinct constraints, by id
+         "offsets": [0, 2, 2, 2],                        # dependencies of package i are edges offsets[i]:offsets[i+1]
+         "targets": [1, 2], "edge_constraints": [1, 0]}  # dependency and constraint id of each edge
+
+    Each distinct constraint is loaded as a single :class:`debtools.versions.VersionRange`, shared by all edges.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, filename=None):
+        """
+        :param filename: path of the graph file (default: `~/.cache/debtools/graph.json`)
+        :type filename: :class:`str`
+        """
+        if filename is None:
+            filename = os.path.join(get_cache_dir(), 'graph.json')
+        self.filename = filename
+        # {package name: (source, {dependency name: VersionRange})}
+        self.packages = {}
+        # {json of the source: package name}
+        self.names_by_source = {}
+
+    def load(self):
+        """ Load the stored graph; an invalid or missing file is silently ignored
+
+        :return: number of loaded packages
+        :rtype: :class:`int`
+        """
+        self.packages = {}
+        self.names_by_source = {}
+        try:
+            with open(self.filename, 'rb') as fd:
+                content = json.loads(fd.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return 0
+        if not isinstance(content, dict) or content.get('version') != self.FORMAT_VERSION:
+            return 0
+        packages, names_by_source = {}, {}
+        try:
+            names = content['packages']
+            version_ranges = [VersionRange(x) for x in content['constraints']]
+            offsets, targets, edge_constraints = content['offsets'], content['targets'], content['edge_constraints']
+            for package_id, source in enumerate(content['sources']):
+                if source is None:
+                    continue
+                dependencies = {names[targets[edge]]: version_ranges[edge_constraints[edge]]
+                                for edge in range(offsets[package_id], offsets[package_id + 1])}
+                packages[names[package_id]] = (source, dependencies)
+                names_by_source[json.dumps(source)] = names[package_id]
+        except (KeyError, IndexError, TypeError, ValueError):
+            # truncated or foreign content
+            return 0
+        self.packages, self.names_by_source = packages, names_by_source
+        return len(self.packages)
+
+    def lookup(self, source):
+        """ Return the stored package read from a given source
+
+        :param source: result of :func:`get_file_source` or :func:`get_index_source`
+        :type source: :class:`list`
+        :return: `(package name, dependencies)` or `None` if this source is unknown (or has been modified)
+        :rtype: :class:`tuple`
+        """
+        package_name = self.names_by_source.get(json.dumps(source))
+        if package_name is None:
+            return None
+        return package_name, self.packages[package_name][1]
+
+    def update(self, dependencies_by_package, sources_by_package):
+        """ Add (or replace) resolved packages; packages without any source are ignored
+
+        :param dependencies_by_package: {package name: {dependency name: VersionRange}}
+        :type dependencies_by_package: :class:`dict`
+        :param sources_by_package: {package name: source}
+        :type sources_by_package: :class:`dict`
+        """
+        for package_name, source in sources_by_package.items():
+            previous = self.packages.get(package_name)
+            if previous is not None:
+                self.names_by_source.pop(json.dumps(previous[0]), None)
+            self.packages[package_name] = (source, dependencies_by_package[package_name])
+            self.names_by_source[json.dumps(source)] = package_name
+
+    def save(self):
+        """Write the graph, atomically"""
+        graph = DependencyGraph.from_dependencies({x: y[1] for (x, y) in self.packages.items()})
+        content = graph.to_arrays()
+        # dependencies that are not resolved themselves have no source
+        content['sources'] = [self.packages[x][0] if x in self.packages else None for x in graph.names]
+        content['version'] = self.FORMAT_VERSION
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp_filename = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fileobj:
+                fileobj.write(json.dumps(content, separators=(',', ':')).encode('utf-8'))
+            os.rename(tmp_filename, self.filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""In-memory index of the packages described by apt `Packages` files
+
+"""
+from __future__ import unicode_literals
+
+import glob
+import os
+import tarfile
+import threading
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+from debtools.utils import get_control_data, iter_deb822, iter_deb822_file, open_decompressed, parse_relationships
+from debtools.versions import get_version
+
+__author__ = 'Matthieu Gallet'
+
+APT_LISTS_DIR = '/var/lib/apt/lists'
+
+
+class PackageIndex(object):
+    """ Packages available in one or more `Packages` indexes (like `/var/lib/apt/lists/*_Packages`).
+    Only the fields required for solving dependencies and downloading packages are kept.
+    Packages are indexed by name, and by the virtual packages they provide.
+
+    >>> index = PackageIndex()
+    >>> index.add({'Package': 'mawk', 'Version': '1.3.4', 'Provides': 'awk'})
+    >>> index.get('mawk')['Version'], index.get_providers('awk')
+    ('1.3.4', ['mawk'])
+    """
+    fields = ('Package', 'Version', 'Architecture', 'Depends', 'Pre-Depends', 'Provides', 'Filename', 'Size',
+              'SHA256')
+
+    def __init__(self, architectures=None):
+        """
+        :param architectures: if not `None`, only packages of these architectures (and `all`) are kept
+        :type architectures: :class:`list`
+        """
+        self.architectures = set(architectures) | {'all'} if architectures else None
+        # {package name: [stanza, ...]}, highest version first
+        self.packages = {}
+        # {virtual package name: [(package name, provided version or None), ...]}
+        self.providers = {}
+
+    def add(self, stanza):
+        """Add a package, given as a dict of its fields. Packages without a valid version are ignored."""
+        package_name = stanza.get('Package')
+        if not package_name or 'Version' not in stanza:
+            return
+        architecture = stanza.get('Architecture', 'all')
+        if self.architectures is not None and architecture not in self.architectures:
+            return
+        try:
+            version_key = get_version(stanza['Version']).key
+        except ValueError:
+            return
+        versions = self.packages.setdefault(package_name, [])
+        if any(get_version(x['Version']).key == version_key and x.get('Architecture', 'all') == architecture
+               for x in versions):
+            # the same version may be available from several repositories
+            return
+        versions.append(stanza)
+        versions.sort(key=lambda x: get_version(x['Version']).key, reverse=True)
+        for alternatives in parse_relationships(stanza.get('Provides', '')):
+            for relation in alternatives:
+                providers = self.providers.setdefault(relation.name, [])
+                provided = (package_name, relation.constraint[1] if relation.constraint else None)
+                if provided not in providers:
+                    providers.append(provided)
+
+    def load(self, filename):
+        """Add the packages of a `Packages` file, that can be compressed (`.gz`, `.xz`, …)"""
+        for stanza in iter_deb822_file(filename, fields=self.fields):
+            self.add(stanza)
+
+    def load_fileobj(self, fileobj, name=''):
+        """Add the packages of a `Packages` file object, that must be seekable if it is compressed"""
+        for stanza in iter_deb822(open_decompressed(fileobj, name=name), fields=self.fields):
+            self.add(stanza)
+
+    def load_apt_lists(self, directory=APT_LISTS_DIR):
+        """Add all the packages known by apt (`/var/lib/apt/lists/*_Packages`)
+
+        :return: the loaded files
+        :rtype: :class:`list`
+        """
+        filenames = sorted(x for x in glob.glob(os.path.join(directory, '*_Packages*'))
+                           if not x.endswith('.diff_Index'))
+        for filename in filenames:
+            self.load(filename)
+        return filenames
+
+    def get(self, package_name, version_range=None):
+        """ Return the highest version of a package satisfying `version_range`
+
+        :param package_name: name of a real package
+        :type package_name: :class:`str`
+        :param version_range: required versions (all versions if `None`)
+        :type version_range: :class:`debtools.versions.VersionRange`
+        :return: the fields of the package, or `None` if there is no such package
+        :rtype: :class:`dict`
+        """
+        for stanza in self.packages.get(package_name, []):
+            if not version_range or version_range.satisfied_by(stanza['Version']):
+                return stanza
+        return None
+
+    def get_providers(self, package_name):
+        """Return the names of the packages that provide a virtual package"""
+        result = []
+        for provider, version in self.providers.get(package_name, []):
+            if provider not in result:
+                result.append(provider)
+        return result
+
+    def get_provides(self, package_name):
+        """Return the list of `(package name, provided version or None)` that provide a virtual package"""
+        return self.providers.get(package_name, [])
+
+    def __contains__(self, package_name):
+        return package_name in self.packages
+
+    def __len__(self):
+        return len(self.packages)
+
+
+class DirectoryIndex(object):
+    """ Index of the .deb files of a directory: {package name: [(version, architecture, filename), ...]}.
+    The directory is listed once with `os.scandir`; files named like `package_version_arch.deb` (as `apt-get download`
+    does) are indexed from their name, other ones from their control data (`parse_filenames=False` always reads the
+    control data, for example to identify files that have just been downloaded).
+    New files are added by :meth:`add_file` (that can be called by several threads) or by :meth:`refresh`,
+    which only reads unknown files.
+
+    >>> index = DirectoryIndex('/nonexistent')
+    >>> index.add_file('/nonexistent/libgcc1_1%3a4.7.2-5_amd64.deb')
+    'libgcc1'
+    >>> index.get('libgcc1'), index.get_all('libgcc1')[0][:2]
+    ('/nonexistent/libgcc1_1%3a4.7.2-5_amd64.deb', ('1:4.7.2-5', 'amd64'))
+    """
+
+    def __init__(self, directory='.', get_control_data=get_control_data):
+        """
+        :param directory: directory containing .deb files
+        :type directory: :class:`str`
+        :param get_control_data: function returning the control data of a .deb file
+        """
+        self.directory = directory
+        self.get_control_data = get_control_data
+        # {package name: [(version, architecture, filename), ...]}, highest version first
+        self.packages = {}
+        self.filenames = set()
+        self.lock = threading.Lock()
+
+    def refresh(self, parse_filenames=True):
+        """ Index the .deb files of the directory that are not yet known, with a single listing
+
+        :param parse_filenames: identify files named like `package_version_arch.deb` from their name
+        :type parse_filenames: :class:`bool`
+        :return: names of the new packages
+        :rtype: :class:`list`
+        """
+        package_names = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.deb') or entry.path in self.filenames or not entry.is_file():
+                continue
+            package_name = self.add_file(entry.path, parse_filename=parse_filenames)
+            if package_name is not None:
+                package_names.append(package_name)
+        return package_names
+
+    def add_file(self, filename, parse_filename=True):
+        """ Add a .deb file
+
+        :param filename: path of the .deb file
+        :type filename: :class:`str`
+        :param parse_filename: identify the file from its name if it is named like `package_version_arch.deb`,
+            instead of reading its control data
+        :type parse_filename: :class:`bool`
+        :return: name of its package, or `None` if this is not a valid package
+        :rtype: :class:`str`
+        """
+        if filename in self.filenames:
+            return None
+        parts = os.path.basename(filename)[:-4].split('_')
+        if parse_filename and len(parts) == 3 and all(parts):
+            package_name, version, architecture = parts[0], unquote(parts[1]), parts[2]
+        else:
+            try:
+                control_data = self.get_control_data(filename)
+            except (ValueError, IOError, OSError, EOFError, tarfile.TarError):
+                return None
+            if 'Package' not in control_data or 'Version' not in control_data:
+                return None
+            package_name, version = control_data['Package'], control_data['Version']
+            architecture = control_data.get('Architecture', 'all')
+        with self.lock:
+            if filename in self.filenames:
+                return None
+            self.filenames.add(filename)
+            versions = self.packages.setdefault(package_name, [])
+            versions.append((version, architecture, filename))
+            versions.sort(key=lambda x: get_version(x[0]).key, reverse=True)
+        return package_name
+
+    def get(self, package_name, version_range=None):
+        """ Return the .deb file of the highest version of a package satisfying `version_range`
+
+        :param version_range: required versions (all versions if `None`)
+        :type version_range: :class:`debtools.versions.VersionRange`
+        :return: path of the .deb file, or `None`
+        :rtype: :class:`str`
+        """
+        for version, architecture, filename in self.packages.get(package_name, []):
+            if not version_range or version_range.satisfied_by(version):
+                return filename
+        return None
+
+    def get_all(self, package_name):
+        """Return the list of (version, architecture, filename) of a package, highest version first"""
+        return self.packages.get(package_name, [])
+
+    def __contains__(self, package_name):
+        return package_name in self.packages
@@ -8,19 +8,26 @@ You should use a `stdeb.cfg` configuration file
 from __future__ import unicode_literals, print_function
 import argparse
 import codecs
+from concurrent.futures import ThreadPoolExecutor
 import glob
+import hashlib
 from importlib import import_module
+import inspect
 import os
 import shutil
 import subprocess
 from tempfile import mkdtemp
+import traceback
+import warnings
 
 # noinspection PyPackageRequirements
 from pip import get_installed_distributions
 # noinspection PyPackageRequirements,PyProtectedMember
 from pip._vendor.pkg_resources import Distribution
 # noinspection PyPackageRequirements
-from stdeb.downloader import get_source_tarball
+import stdeb
+# noinspection PyPackageRequirements
+from stdeb.downloader import find_tar_gz, USER_AGENT
 # noinspection PyPackageRequirements
 from stdeb.util import check_call, expand_sdist_file
 import sys
@@ -30,8 +37,23 @@ try:
 except ImportError:
     # noinspection PyUnresolvedReferences,PyPep8Naming
     import ConfigParser as configparser
+try:
+    from urllib.request import urlopen, Request
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    from urllib2 import urlopen, Request
+
+from debtools import __version__ as debtools_version
+from debtools.cache import BuildCache, SourceCache
+from debtools.pydeb import build_python_deb, find_wheel, get_architecture, get_interpreter_depends, \
+    get_shlibs_depends, install_to_root, install_wheel, is_pure_python
 
 __author__ = 'Matthieu Gallet'
+HOOK_NAMES = ('pre_source', 'post_source')
+# hooks may depend on the current working dir: each one is run in its own process, in the source dir
+HOOK_RUNNER = ("import sys; from importlib import import_module; "
+               "module_path, sep, name = sys.argv[1].rpartition('.'); "
+               "getattr(import_module(module_path), name)(sys.argv[2], sys.argv[3], sys.argv[4] or None)")
 
 
 def normalize_package_name(name):
@@ -66,6 +88,29 @@ def main():
     args_parser.add_argument('--dry', help='show what should be done', default=False, action='store_true')
     args_parser.add_argument('--exclude', default=[], action='append', help='modules to exclude from packaging')
     args_parser.add_argument('--include', default=[], action='append', help='other modules to package')
+    args_parser.add_argument('--jobs', '-j', default=1, type=int, help='number of packages built at the same time')
+    args_parser.add_argument('--log-dir', default=None,
+                             help='keep the output of each package in this dir (default: only shown on failure)')
+    args_parser.add_argument('--build-cache', default=False, action='store_true',
+                             help='reuse packages built by previous runs with the same version and options')
+    args_parser.add_argument('--build-cache-dir', default=None,
+                             help='directory of the build cache (default: ~/.cache/debtools/builds)')
+    args_parser.add_argument('--build-cache-size', default=2048, type=int,
+                             help='maximum size of the build cache, in MB (default: %(default)s)')
+    args_parser.add_argument('--source-cache', default=False, action='store_true',
+                             help='keep downloaded source archives for next runs')
+    args_parser.add_argument('--source-cache-dir', default=None,
+                             help='directory of the source cache (default: ~/.cache/debtools/sources)')
+    args_parser.add_argument('--seed-source-cache', default=[], action='append',
+                             help='add the source archives (name-version.tar.gz) of this dir to the source cache')
+    args_parser.add_argument('--offline', default=False, action='store_true',
+                             help='never download source archives: only use the source cache')
+    args_parser.add_argument('--direct', default=False, action='store_true',
+                             help='directly create packages of pure-Python distributions, without stdeb')
+    args_parser.add_argument('--wheelhouse', default=[], action='append',
+                             help='create packages from the compatible wheels of this dir, instead of source archives')
+    args_parser.add_argument('--download-wheels', default=False, action='store_true',
+                             help='download compatible wheels with pip when they are not in a wheelhouse')
 
     args = args_parser.parse_args()
     dry = args.dry
@@ -135,30 +180,224 @@ def main():
                               for (package_name, package_version) in packages_to_create.items()
                               if package_name in set(only_packages)}
 
-    # create a temp dir and do the work
-    cwd = os.getcwd()
+    log_dir = os.path.abspath(args.log_dir) if args.log_dir else None
+    if log_dir and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
     package_names = [x for x in packages_to_create]
     package_names.sort()
+    to_build = []
     for package_name in package_names:
-        package_version = packages_to_create[package_name]
         if normalize_package_name(package_name) in excluded_packages:
             print('%s is excluded' % package_name)
             continue
         print('packaging %s...' % package_name)
-        if dry:
-            continue
-        temp_dir = mkdtemp(suffix='-multideb')
-        os.chdir(temp_dir)
-        prepare_package(package_name, package_version, deb_dest_dir, config_parser, allow_unsafe_download, verbose=verbose)
-        if not keep_temp:
-            shutil.rmtree(temp_dir)
+        if not dry:
+            to_build.append((package_name, packages_to_create[package_name]))
+
+    # each package is built in its own temp dir, with its own log: a failure does not stop other packages
+    build_cache = None
+    if args.build_cache or args.build_cache_dir:
+        build_cache = BuildCache(directory=args.build_cache_dir, max_size=args.build_cache_size * 1024 * 1024)
+    source_cache = None
+    if args.source_cache or args.source_cache_dir or args.seed_source_cache or args.offline:
+        source_cache = SourceCache(directory=args.source_cache_dir)
+        for directory in args.seed_source_cache:
+            print('%d source archive(s) added from %s' % (source_cache.seed(directory), directory))
+    build_kwargs = {'deb_dest_dir': deb_dest_dir, 'multideb_config_parser': config_parser,
+                    'allow_unsafe_download': allow_unsafe_download, 'verbose': verbose and args.jobs <= 1,
+                    'keep_temp': keep_temp, 'log_dir': log_dir, 'build_cache': build_cache,
+                    'source_cache': source_cache, 'offline': args.offline, 'direct': args.direct,
+                    'wheelhouses': [os.path.abspath(x) for x in args.wheelhouse],
+                    'download_wheels': args.download_wheels}
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+        futures = [executor.submit(build_package, package_name, package_version, **build_kwargs)
+                   for (package_name, package_version) in to_build]
+        failures = [x for x in (future.result() for future in futures) if x is not None]
+    if build_cache is not None:
+        build_cache.close()
+    if source_cache is not None:
+        source_cache.close()
+    if failures:
+        print('Unable to create %d package(s): %s' % (len(failures), ', '.join(failures)))
+        return 1
+    return 0
+
+
+def get_section_names(package_name):
+    """Return the sections of the multideb configuration that apply to a package"""
+    if sys.version_info[0] == 3:
+        return package_name, package_name + '-python3'
+    return package_name,
+
+
+def get_package_options(package_name, multideb_config_parser):
+    """Return the effective options {lowercased option name: value} of the multideb sections of a package"""
+    options = {}
+    for section_name in get_section_names(package_name):
+        if multideb_config_parser.has_section(section_name):
+            for option_name in multideb_config_parser.options(section_name):
+                options[option_name] = multideb_config_parser.get(section_name, option_name)
+    return options
+
+
+def get_build_key(package_name, package_version, multideb_config_parser, direct=False, wheelhouses=None,
+                  download_wheels=False):
+    """ Return the key of a package in the build cache: it depends on the package, its version, the effective
+    options of its sections (and the code of its hooks), the Python major version, the versions of the builders
+    and the way the package is built. When wheels are used, it also depends on the Python minor version
+    and on the name and the SHA256 of the selected wheel, if any.
+
+    :rtype: :class:`str`
+    """
+    options = get_package_options(package_name, multideb_config_parser)
+    hooks = {}
+    for hook_name in HOOK_NAMES:
+        if multideb_config_parser.has_option(package_name, hook_name):
+            dotted_path = multideb_config_parser.get(package_name, hook_name)
+            try:
+                hooks[hook_name] = inspect.getsource(import_string(dotted_path))
+            except (ImportError, IOError, OSError, TypeError):
+                hooks[hook_name] = dotted_path
+    wheel_values = None
+    if wheelhouses or download_wheels:
+        # packages created from compiled wheels depend on the interpreter ABI and on the wheel itself
+        wheel = find_wheel(wheelhouses or [], package_name, package_version)
+        wheel_values = [sys.version_info[0], sys.version_info[1], None, None]
+        if wheel is not None:
+            wheel_values[2:] = [os.path.basename(wheel), SourceCache.get_sha256(wheel)]
+    return BuildCache.get_key(package_name, package_version, options, hooks, sys.version_info[0],
+                              debtools_version, stdeb.__version__, direct, sorted(wheelhouses or []),
+                              download_wheels, wheel_values)
+
+
+def build_package(package_name, package_version, deb_dest_dir, multideb_config_parser, allow_unsafe_download,
+                  verbose=False, keep_temp=False, log_dir=None, build_cache=None, source_cache=None, offline=False,
+                  direct=False, wheelhouses=None, download_wheels=False):
+    """ Build a package in a new temp dir, without modifying the current working dir.
+    The output of the build is written to a log file, displayed on failure.
+
+    :param build_cache: if the package is in this cache, it is copied instead of being built
+    :type build_cache: :class:`debtools.cache.BuildCache`
+    :param source_cache: source archives are taken from (and added to) this cache
+    :type source_cache: :class:`debtools.cache.SourceCache`
+    :param offline: never download source archives
+    :type offline: :class:`bool`
+    :param direct: directly create the package if the distribution is pure Python (see :func:`prepare_package`)
+    :type direct: :class:`bool`
+    :param wheelhouses: directories of wheels, used instead of source archives (see :func:`prepare_package`)
+    :type wheelhouses: :class:`list`
+    :param download_wheels: download wheels that are not in `wheelhouses`
+    :type download_wheels: :class:`bool`
+    :return: `None` if the package has been created, `'package_name-package_version'` otherwise
+    :rtype: :class:`str`
+    """
+    name = '%s-%s' % (package_name, package_version)
+    build_key = None
+    if build_cache is not None:
+        build_key = get_build_key(package_name, package_version, multideb_config_parser, direct=direct,
+                                  wheelhouses=wheelhouses, download_wheels=download_wheels)
+        filename = build_cache.get(build_key, deb_dest_dir)
+        if filename is not None:
+            print('%s: using %s from the build cache' % (name, os.path.basename(filename)))
+            return None
+    temp_dir = mkdtemp(suffix='-multideb')
+    log_filename = os.path.join(log_dir or temp_dir, '%s.log' % name)
+    success = False
+    with codecs.open(log_filename, 'w', encoding='utf-8') as output:
+        try:
+            filename = prepare_package(package_name, package_version, deb_dest_dir, multideb_config_parser,
+                                       allow_unsafe_download, verbose=verbose, work_dir=temp_dir,
+                                       output=None if verbose else output, source_cache=source_cache,
+                                       offline=offline, direct=direct, wheelhouses=wheelhouses,
+                                       download_wheels=download_wheels)
+            if build_cache is not None:
+                build_cache.set(build_key, filename)
+            success = True
+        except Exception:
+            output.write(traceback.format_exc())
+    if not success:
+        print('Unable to create %s:' % name)
+        with codecs.open(log_filename, 'r', encoding='utf-8') as fd:
+            print(fd.read())
+    if keep_temp:
+        print('%s: %s' % (name, temp_dir))
+    else:
+        shutil.rmtree(temp_dir)
+    return None if success else name
+
+
+def download_source_tarball(package_name, package_version, directory, allow_unsafe_download=False,
+                            source_cache=None, offline=False):
+    """ Download the source archive of a package from PyPI into a given directory,
+    like `stdeb.downloader.get_source_tarball` (that always uses the current working dir).
+
+    :param source_cache: if the archive is in this cache, it is copied instead of being downloaded;
+        downloaded archives are added to it
+    :type source_cache: :class:`debtools.cache.SourceCache`
+    :param offline: never use the network: the archive must be in `source_cache`
+    :type offline: :class:`bool`
+    :return: complete path of the downloaded file
+    :rtype: :class:`str`
+    """
+    if source_cache is not None:
+        filename = source_cache.get(package_name, package_version, directory)
+        if filename is not None:
+            return filename
+    if offline:
+        raise ValueError('%s %s is not in the source cache (offline mode)' % (package_name, package_version))
+    download_url, expected_md5_digest = find_tar_gz(package_name, release=package_version)
+    if not download_url.startswith('https://'):
+        if allow_unsafe_download:
+            warnings.warn('downloading from unsafe url: %r' % download_url)
         else:
-            print('%s-%s: %s' % (package_name, package_version, temp_dir))
-    os.chdir(cwd)
+            raise ValueError('PYPI returned unsafe url: %r' % download_url)
+    filename = os.path.join(directory, download_url.split('/')[-1])
+    response = urlopen(Request(download_url, headers={'User-Agent': USER_AGENT}))
+    try:
+        content = response.read()
+    finally:
+        response.close()
+    if expected_md5_digest is not None:
+        if hashlib.md5(content).hexdigest() != expected_md5_digest:
+            raise ValueError('actual and expected md5 digests do not match')
+    else:
+        warnings.warn('no md5 digest found -- cannot verify source file')
+    with open(filename, 'wb') as fd:
+        fd.write(content)
+    if source_cache is not None:
+        source_cache.add(filename, name=package_name, version=package_version)
+    return filename
 
 
-def prepare_package(package_name, package_version, deb_dest_dir, multideb_config_parser, allow_unsafe_download, verbose=True):
+def download_wheel(package_name, package_version, directory, output=None):
+    """ Download a compatible wheel of a package with pip
+
+    :return: path of the downloaded wheel, or `None` if there is no compatible wheel
+    :rtype: :class:`str`
     """
+    wheel_dir = os.path.join(directory, 'wheels')
+    if output is not None:
+        output.flush()
+    call_kwargs = {'stdout': output, 'stderr': subprocess.STDOUT} if output is not None else {}
+    try:
+        subprocess.check_call([sys.executable, '-m', 'pip', 'download', '--no-deps', '--only-binary', ':all:',
+                               '--dest', wheel_dir, '%s==%s' % (package_name, package_version)], **call_kwargs)
+    except subprocess.CalledProcessError:
+        wheel = None
+    else:
+        wheel = find_wheel([wheel_dir], package_name, package_version)
+    if wheel is None:
+        # the work dir must only contain the expanded source archive
+        shutil.rmtree(wheel_dir, ignore_errors=True)
+    return wheel
+
+
+def prepare_package(package_name, package_version, deb_dest_dir, multideb_config_parser, allow_unsafe_download,
+                    verbose=True, work_dir=None, output=None, source_cache=None, offline=False, direct=False,
+                    wheelhouses=None, download_wheels=False):
+    """ Build a package in `work_dir`. Only explicit paths are used, so several packages can be built at the same time.
+
     :param package_name: name of the package to prepare
     :type package_name: :class:`str`
     :param package_version: version of the package to prepare
@@ -169,60 +408,140 @@ def prepare_package(package_name, package_version, deb_dest_dir, multideb_config
     :type multideb_config_parser: :class:`configparser.ConfigParser`
     :param allow_unsafe_download:  allow unsafe downloads?  (see pip documentation)
     :type allow_unsafe_download: :class:`bool`
+    :param work_dir: empty directory used for building the package (default: the current working dir)
+    :type work_dir: :class:`str`
+    :param output: file object receiving messages and output of commands (default: standard output)
+    :param source_cache: cache of source archives, checked before downloading
+    :type source_cache: :class:`debtools.cache.SourceCache`
+    :param offline: never download the source archive (it must be in `source_cache`)
+    :type offline: :class:`bool`
+    :param direct: if the distribution is pure Python (and has no `post_source` hook), install it into a staging root
+        and directly create the .deb file from it (see :mod:`debtools.pydeb`), instead of using `stdeb` and
+        `dpkg-buildpackage`
+    :type direct: :class:`bool`
+    :param wheelhouses: if a compatible wheel of the package is in one of these directories (and if the package has
+        no hook), the .deb file is directly created from this wheel, without building anything
+    :type wheelhouses: :class:`list`
+    :param download_wheels: if no wheel is found in `wheelhouses`, try to download one with pip (except if `offline`)
+    :type download_wheels: :class:`bool`
+    :return: path of the created .deb file
+    :rtype: :class:`str`
     """
     assert isinstance(multideb_config_parser, configparser.ConfigParser)
-    print('downloading %s %s' % (package_name, package_version))
-    filename = get_source_tarball(package_name, verbose=False, release=package_version, allow_unsafe_download=allow_unsafe_download)
+    work_dir = os.path.abspath(work_dir or os.getcwd())
+    if (wheelhouses or download_wheels) and \
+            not any(multideb_config_parser.has_option(package_name, x) for x in HOOK_NAMES):
+        wheel = find_wheel(wheelhouses or [], package_name, package_version)
+        if wheel is None and download_wheels and not offline:
+            wheel = download_wheel(package_name, package_version, work_dir, output=output)
+        if wheel is not None:
+            print('installing %s' % os.path.basename(wheel), file=output)
+            root = os.path.join(work_dir, 'root')
+            install_wheel(wheel, root)
+            architecture, depends = 'all', []
+            try:
+                if not is_pure_python(root):
+                    # compiled extensions: restrict the package to the interpreter ABI and its shared libraries
+                    architecture = get_architecture()
+                    depends = get_interpreter_depends(wheel) + get_shlibs_depends(root)
+            except (ValueError, OSError, subprocess.CalledProcessError) as e:
+                # no dependencies (like missing shared libraries), or no dpkg
+                print('%s: using the source archive' % e, file=output)
+            else:
+                print('creating package', file=output)
+                return build_python_deb(root, deb_dest_dir, architecture=architecture, depends=depends,
+                                        options=get_package_options(package_name, multideb_config_parser))
+            # the work dir must only contain the expanded source archive
+            shutil.rmtree(root)
+            shutil.rmtree(os.path.join(work_dir, 'wheels'), ignore_errors=True)
+        else:
+            print('no compatible wheel found: using the source archive', file=output)
+    print('downloading %s %s' % (package_name, package_version), file=output)
+    filename = download_source_tarball(package_name, package_version, work_dir,
+                                       allow_unsafe_download=allow_unsafe_download, source_cache=source_cache,
+                                       offline=offline)
     # expand source file
-    expand_sdist_file(os.path.abspath(filename), cwd=os.getcwd())
-    directories = [x for x in os.listdir(os.getcwd()) if os.path.isdir(os.path.join(os.getcwd(), x))]
+    expand_sdist_file(filename, cwd=work_dir)
+    directories = [x for x in os.listdir(work_dir) if os.path.isdir(os.path.join(work_dir, x))]
     if len(directories) != 1:
-        raise ValueError('Require a single directory in %s' % os.getcwd())
-    os.chdir(directories[0])
-    subprocess.check_output("rm -rf `find * | grep \\.pyc$`", shell=True)
-    run_hook(package_name, package_version, 'pre_source', None, multideb_config_parser)
+        raise ValueError('Require a single directory in %s' % work_dir)
+    source_dir = os.path.join(work_dir, directories[0])
+    subprocess.check_output("rm -rf `find * | grep \\.pyc$`", shell=True, cwd=source_dir)
+    run_hook(package_name, package_version, 'pre_source', None, multideb_config_parser, cwd=source_dir,
+             output=output)
 
     # config file for each package?
+    stdeb_cfg = os.path.join(source_dir, 'stdeb.cfg')
     new_config_parser = configparser.ConfigParser()
-    new_config_parser.read(['stdeb.cfg'])
-    section_names = (package_name, )
-    if sys.version_info[0] == 3:
-        section_names = (package_name, package_name + '-python3')
-    for section_name in section_names:
-        if multideb_config_parser.has_section(section_name):
-            for option_name in multideb_config_parser.options(section_name):
-                option_value = multideb_config_parser.get(section_name, option_name)
-                new_config_parser.set('DEFAULT', option_name, option_value)
-    with codecs.open('stdeb.cfg', 'w', encoding='utf-8') as fd:
+    new_config_parser.read([stdeb_cfg])
+    for option_name, option_value in get_package_options(package_name, multideb_config_parser).items():
+        new_config_parser.set('DEFAULT', option_name, option_value)
+    with codecs.open(stdeb_cfg, 'w', encoding='utf-8') as fd:
         new_config_parser.write(fd)
-    call_kwargs = {} if verbose else {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
-    print('preparing Debian source')
-    check_call(['python', 'setup.py', '--command-packages', 'stdeb.command', 'sdist_dsc'], **call_kwargs)
+    if direct and not multideb_config_parser.has_option(package_name, 'post_source'):
+        # stdeb uses the [DEFAULT] section, overridden by the section of the package
+        options = dict(new_config_parser.defaults())
+        for section_name in new_config_parser.sections():
+            if normalize_package_name(section_name) == normalize_package_name(package_name):
+                options.update(new_config_parser.items(section_name))
+        root = os.path.join(work_dir, 'root')
+        print('installing into a staging root', file=output)
+        install_to_root(source_dir, root, output=output)
+        if is_pure_python(root):
+            print('creating package', file=output)
+            return build_python_deb(root, deb_dest_dir, options=options)
+        print('compiled extensions found: using stdeb', file=output)
+        shutil.rmtree(root)
+    if output is not None:
+        output.flush()
+        call_kwargs = {'stdout': output, 'stderr': subprocess.STDOUT}
+    else:
+        call_kwargs = {} if verbose else {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
+    print('preparing Debian source', file=output)
+    check_call(['python', 'setup.py', '--command-packages', 'stdeb.command', 'sdist_dsc'], cwd=source_dir,
+               **call_kwargs)
 
     # find the actual debian source dir
-    directories = [x for x in os.listdir('deb_dist') if x != 'tmp_py2dsc' and os.path.isdir(os.path.join('deb_dist', x))]
+    deb_dist = os.path.join(source_dir, 'deb_dist')
+    directories = [x for x in os.listdir(deb_dist) if x != 'tmp_py2dsc' and os.path.isdir(os.path.join(deb_dist, x))]
     if len(directories) != 1:
-        raise ValueError('Require a single directory in %s/deb_dist' % os.getcwd())
-    debian_source_dir = os.path.abspath(os.path.join('deb_dist', directories[0]))
+        raise ValueError('Require a single directory in %s' % deb_dist)
+    debian_source_dir = os.path.join(deb_dist, directories[0])
     # check if we have a post-source to execute
-    run_hook(package_name, package_version, 'post_source', debian_source_dir, multideb_config_parser)
+    run_hook(package_name, package_version, 'post_source', debian_source_dir, multideb_config_parser, cwd=source_dir,
+             output=output)
     # build .deb from the source
-    print('creating package')
+    print('creating package', file=output)
+    if output is not None:
+        output.flush()
     check_call(['dpkg-buildpackage', '-rfakeroot', '-uc', '-b'], cwd=debian_source_dir, **call_kwargs)
     # move the .deb to destination dir
-    packages = glob.glob('deb_dist/*.deb')
+    packages = glob.glob(os.path.join(deb_dist, '*.deb'))
     if not packages:
         raise ValueError('Unable to create %s-%s' % (package_name, package_version))
-    print('moving %s' % os.path.basename(packages[0]))
-    shutil.move(packages[0], os.path.join(deb_dest_dir, os.path.basename(packages[0])))
+    print('moving %s' % os.path.basename(packages[0]), file=output)
+    destination = os.path.join(deb_dest_dir, os.path.basename(packages[0]))
+    shutil.move(packages[0], destination)
+    return destination
 
 
-def run_hook(package_name, package_version, hook_name, debian_source_dir, multideb_config_parser):
+def run_hook(package_name, package_version, hook_name, debian_source_dir, multideb_config_parser, cwd=None,
+             output=None):
+    """ Run a `pre_source` or `post_source` hook, if defined for this package.
+    Hooks expect to be run in the expanded source dir (`cwd`): each hook is called in a new Python process, started
+    in this directory, so the working dir of the other builds is never changed.
+    The hook can import the same modules as the current process.
+    """
     if multideb_config_parser.has_option(package_name, hook_name):
-        hook_name = multideb_config_parser.get(package_name, hook_name)
-        print("Using %s as %s hook for %s" % (hook_name, hook_name, package_name))
-        source_hook = import_string(hook_name)
-        source_hook(package_name, package_version, debian_source_dir)
+        dotted_path = multideb_config_parser.get(package_name, hook_name)
+        print("Using %s as %s hook for %s" % (dotted_path, hook_name, package_name), file=output)
+        python_path = os.pathsep.join(os.path.abspath(x or '.') for x in sys.path)
+        env = dict(os.environ, PYTHONPATH=python_path)
+        if output is not None:
+            output.flush()
+        call_kwargs = {'stdout': output, 'stderr': subprocess.STDOUT} if output is not None else {}
+        subprocess.check_call([sys.executable, '-c', HOOK_RUNNER, dotted_path, package_name, package_version,
+                               debian_source_dir or ''], cwd=cwd, env=env, **call_kwargs)
 
 
 # noinspection PyUnusedLocal
@@ -0,0 +1,586 @@
+# -*- coding: utf-8 -*-
+"""Create Debian packages of Python distributions without `stdeb` or `dpkg-buildpackage`:
+the distribution is installed into a staging root, whose content is directly written to a `.deb` file.
+
+"""
+from __future__ import unicode_literals
+
+import codecs
+import email.parser
+import glob
+import hashlib
+import io
+import os
+import re
+import subprocess
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+try:
+    # noinspection PyPackageRequirements
+    from packaging.markers import Marker, InvalidMarker
+except ImportError:
+    Marker, InvalidMarker = None, ValueError
+try:
+    # noinspection PyPackageRequirements
+    from packaging.tags import sys_tags
+except ImportError:
+    sys_tags = None
+
+from debtools.utils import build_deb
+
+__author__ = 'Matthieu Gallet'
+
+# run setup.py with setuptools, even if it only imports distutils (like pip does)
+SETUPTOOLS_SHIM = ("import setuptools, tokenize; __file__ = 'setup.py'; "
+                   "f = getattr(tokenize, 'open', open)(__file__); code = f.read().replace('\\r\\n', '\\n'); "
+                   "f.close(); exec(compile(code, __file__, 'exec'))")
+EXTENSION_SUFFIXES = ('.so', '.pyd', '.dll', '.dylib')
+REQUIREMENT_RE = re.compile(r'^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._\-]*)\s*(\[[^\]]*\])?\s*'
+                            r'\(?(?P<specifiers>[^;()]*)\)?\s*(;(?P<marker>.*))?$')
+SPECIFIER_RE = re.compile(r'^\s*(===|==|~=|!=|<=|>=|<|>)\s*(\S+)\s*$')
+WHEEL_RE = re.compile(r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-(?P<build>\d[^-]*))?-(?P<python>[^-]+)-(?P<abi>[^-]+)-'
+                      r'(?P<platform>[^-]+)\.whl$')
+ENTRY_POINT_SCRIPT = """#!%(executable)s
+# -*- coding: utf-8 -*-
+import re
+import sys
+from %(module)s import %(name)s
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit(%(attribute)s())
+"""
+
+
+class NotPurePythonError(ValueError):
+    """Raised when a distribution contains compiled extensions"""
+    pass
+
+
+def get_python_lib_dir(python_major=None):
+    """ Return the directory of Python modules in Debian packages
+
+    >>> get_python_lib_dir(3)
+    '/usr/lib/python3/dist-packages'
+    """
+    if python_major is None:
+        python_major = sys.version_info[0]
+    if python_major == 2:
+        return '/usr/lib/python2.7/dist-packages'
+    return '/usr/lib/python3/dist-packages'
+
+
+def get_debian_package_name(project_name, python_major=None):
+    """ Return the name of the Debian package of a Python distribution, like `stdeb`
+
+    >>> get_debian_package_name('Django_Redis', 3), get_debian_package_name('backports.lzma', 2)
+    ('python3-django-redis', 'python-backports.lzma')
+    """
+    if python_major is None:
+        python_major = sys.version_info[0]
+    name = project_name.lower().replace('_', '-').strip()
+    if name.startswith('python-'):
+        name = name[7:]
+    return '%s-%s' % ('python' if python_major == 2 else 'python3', name)
+
+
+def get_debian_version(version):
+    """ Return a Python version as a Debian upstream version, like `stdeb`
+
+    >>> get_debian_version('1.8.dev2')
+    '1.8~dev2'
+    """
+    return version.replace('_', '-').replace('.dev', '~dev').lower()
+
+
+def convert_specifier(operator, version):
+    """ Convert a PEP 440 version specifier to Debian version constraints
+
+    >>> convert_specifier('~=', '1.4.5'), convert_specifier('==', '2.0')
+    ([('>=', '1.4.5'), ('<<', '1.5')], [('>=', '2.0'), ('<<', '2.0+')])
+    >>> convert_specifier('<=', '2.0'), convert_specifier('>', '1.0')
+    ([('<<', '2.0+')], [('>=', '1.0+')])
+
+    :return: list of `(operator, version)`, empty if the specifier cannot be expressed (like `!=`)
+    :rtype: :class:`list`
+    """
+    if operator in ('==', '===') and version.endswith('.*'):
+        return [('>=', get_debian_version(version[:-2]))]
+    version = get_debian_version(version)
+    # the Debian version is `version-1`: `= version` would never match, `<= version` would reject it and
+    # `>> version` would accept it
+    if operator in ('==', '==='):
+        return [('>=', version), ('<<', version + '+')]
+    elif operator == '~=':
+        parts = version.split('.')
+        result = [('>=', version)]
+        if len(parts) > 1 and parts[-2].isdigit():
+            result.append(('<<', '.'.join(parts[:-2] + [str(int(parts[-2]) + 1)])))
+        return result
+    elif operator == '<':
+        return [('<<', version)]
+    elif operator == '<=':
+        return [('<<', version + '+')]
+    elif operator == '>':
+        return [('>=', version + '+')]
+    elif operator == '>=':
+        return [('>=', version)]
+    return []
+
+
+def evaluate_marker(marker):
+    """ Return `True` if the environment marker of a requirement applies to this Python, without any extra.
+    Without the `packaging` module, only markers that do not refer to extras apply.
+
+    :rtype: :class:`bool`
+    """
+    marker = marker.strip()
+    if not marker:
+        return True
+    if Marker is None:
+        return 'extra' not in marker
+    try:
+        return Marker(marker).evaluate({'extra': ''})
+    except InvalidMarker:
+        return False
+
+
+def parse_requirement(requirement, python_major=None):
+    """ Convert a requirement (`Requires-Dist` or a line of `requires.txt`) to a Debian relation
+
+    >>> parse_requirement('Django (>=1.8,<1.9)', 3)
+    'python3-django (>= 1.8), python3-django (<< 1.9)'
+    >>> parse_requirement('six>=1.4; extra == "tests"', 3) is None
+    True
+
+    :return: the Debian relation, or `None` if the requirement does not apply (extras, markers)
+    :rtype: :class:`str`
+    """
+    matcher = REQUIREMENT_RE.match(requirement)
+    if not matcher:
+        raise ValueError('invalid requirement: %r' % requirement)
+    if not evaluate_marker(matcher.group('marker') or ''):
+        return None
+    package_name = get_debian_package_name(matcher.group('name'), python_major=python_major)
+    constraints = []
+    for specifier in (matcher.group('specifiers') or '').split(','):
+        if not specifier.strip():
+            continue
+        specifier_matcher = SPECIFIER_RE.match(specifier)
+        if not specifier_matcher:
+            raise ValueError('invalid requirement: %r' % requirement)
+        constraints += convert_specifier(*specifier_matcher.groups())
+    if not constraints:
+        return package_name
+    return ', '.join('%s (%s %s)' % (package_name, operator, version) for (operator, version) in constraints)
+
+
+def read_metadata(root, python_major=None):
+    """ Read the metadata of the distribution installed in a staging root (its `.dist-info` or `.egg-info` dir)
+
+    :param root: staging root
+    :type root: :class:`str`
+    :return: `(metadata, requirements)`: the fields of `METADATA` (or `PKG-INFO`), with the long description in
+        `'Description'`, and the list of requirements that apply to this Python
+    :rtype: :class:`tuple`
+    """
+    lib_dir = root + get_python_lib_dir(python_major)
+    info_dirs = sorted(glob.glob(os.path.join(lib_dir, '*.dist-info')) + glob.glob(os.path.join(lib_dir, '*.egg-info')))
+    if not info_dirs:
+        raise ValueError('no .dist-info or .egg-info directory in %s' % lib_dir)
+    info_dir = info_dirs[0]
+    metadata_filename = os.path.join(info_dir, 'METADATA' if info_dir.endswith('.dist-info') else 'PKG-INFO')
+    with codecs.open(metadata_filename, 'r', encoding='utf-8') as fd:
+        message = email.parser.Parser().parse(fd)
+    metadata = {key: value for (key, value) in message.items() if key != 'Requires-Dist'}
+    if message.get_payload():
+        metadata['Description'] = message.get_payload()
+    requirements = [x for x in message.get_all('Requires-Dist') or [] if evaluate_marker(x.partition(';')[2])]
+    requires_filename = os.path.join(info_dir, 'requires.txt')
+    # recent versions of setuptools also write `Requires-Dist` fields
+    if message.get_all('Requires-Dist') is None and os.path.isfile(requires_filename):
+        # sections are `[extra]`, `[:marker]` or `[extra:marker]`
+        marker = ''
+        with codecs.open(requires_filename, 'r', encoding='utf-8') as fd:
+            for line in fd:
+                line = line.strip()
+                if line.startswith('['):
+                    extra, sep, marker = line[1:-1].partition(':')
+                    if extra:
+                        marker = 'extra == "%s"' % extra
+                elif line and evaluate_marker(marker):
+                    requirements.append(line)
+    return metadata, requirements
+
+
+def format_description(summary, description=None):
+    """ Return the value of the `Description` field of a control file
+
+    >>> print(format_description('Short', 'Long\\n\\ntext'))
+    Short
+     Long
+     .
+     text
+    """
+    lines = [(summary or 'no summary').strip().splitlines()[0]]
+    for line in (description or '').strip().splitlines():
+        line = line.rstrip()
+        lines.append(' ' + line if line.strip() else ' .')
+    return '\n'.join(lines)
+
+
+def get_option(options, option_name, python_major=None):
+    """ Return a `stdeb.cfg` option (`option_name + '3'` with Python 3, like `Depends3`)
+
+    :param options: lowercased option names and their values
+    :type options: :class:`dict`
+    """
+    if python_major is None:
+        python_major = sys.version_info[0]
+    option_name = option_name.lower()
+    if python_major == 3 and option_name + '3' in options:
+        return options[option_name + '3']
+    return options.get(option_name)
+
+
+def is_pure_python(root):
+    """Return `False` if a staging root contains compiled extensions"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        if any(x.endswith(EXTENSION_SUFFIXES) for x in filenames):
+            return False
+    return True
+
+
+def install_to_root(source_dir, root, python=None, output=None, python_major=None):
+    """ Install an expanded source distribution into a staging root, with the Debian layout
+
+    :param source_dir: directory containing `setup.py`
+    :type source_dir: :class:`str`
+    :param root: staging root
+    :type root: :class:`str`
+    :param python: Python interpreter (default: the current one)
+    :param output: file object receiving the output of the command (default: standard output)
+    """
+    if python is None:
+        python = sys.executable
+    if python_major is None:
+        python_major = sys.version_info[0]
+    record = os.path.join(root, '.record')
+    call_kwargs = {'stdout': output, 'stderr': subprocess.STDOUT} if output is not None else {}
+    if output is not None:
+        output.flush()
+    # scripts must use the Python of the system, not the one of the build
+    executable = '/usr/bin/python' if python_major == 2 else '/usr/bin/python3'
+    subprocess.check_call([python, '-c', SETUPTOOLS_SHIM, 'build_scripts', '--executable', executable,
+                           'install', '--root', root,
+                           '--install-lib', get_python_lib_dir(python_major), '--install-scripts', '/usr/bin',
+                           '--install-data', '/usr', '--single-version-externally-managed', '--record', record,
+                           '--no-compile'], cwd=source_dir, **call_kwargs)
+    os.remove(record)
+
+
+def build_python_deb(root, deb_dest_dir, options=None, architecture='all', python_major=None, mtime=None,
+                     depends=None):
+    """ Create a `.deb` file from a staging root, that contains an installed distribution.
+    The control file is generated from the metadata of the distribution and from the `stdeb.cfg` options
+    (`Package`, `Depends`, `Maintainer`, `Section`, `Debian-Version`, `Epoch`, `Forced-Upstream-Version`,
+    `Conflicts`, `Breaks`, `Provides`, `Replaces`, `Recommends` and `Suggests`, with their `3` variants).
+    `Depends` is completed with the requirements of the distribution.
+
+    :param root: staging root (its content is the `data.tar` archive)
+    :type root: :class:`str`
+    :param deb_dest_dir: destination directory of the `.deb` file
+    :type deb_dest_dir: :class:`str`
+    :param options: lowercased `stdeb.cfg` options and their values
+    :type options: :class:`dict`
+    :param architecture: Debian architecture (`all` for pure-Python distributions)
+    :type architecture: :class:`str`
+    :param mtime: timestamp of archive members (default: now)
+    :type mtime: :class:`int`
+    :param depends: other relations added to `Depends` (like :func:`get_interpreter_depends` and
+        :func:`get_shlibs_depends` for distributions with compiled extensions)
+    :type depends: :class:`list`
+    :return: path of the created `.deb` file
+    :rtype: :class:`str`
+    """
+    if python_major is None:
+        python_major = sys.version_info[0]
+    if mtime is None:
+        mtime = int(time.time())
+    options = options or {}
+    metadata, requirements = read_metadata(root, python_major=python_major)
+    package_name = get_option(options, 'Package', python_major) or \
+        get_debian_package_name(metadata['Name'], python_major=python_major)
+    version = '%s-%s' % (get_option(options, 'Forced-Upstream-Version', python_major) or
+                         get_debian_version(metadata['Version']), options.get('debian-version', '1'))
+    if options.get('epoch'):
+        version = '%s:%s' % (options['epoch'], version)
+    python = 'python' if python_major == 2 else 'python3'
+    depends = [python] + list(depends or []) + \
+        [x for x in (parse_requirement(y, python_major) for y in requirements) if x]
+    if get_option(options, 'Depends', python_major):
+        depends.append(get_option(options, 'Depends', python_major))
+    maintainer = options.get('maintainer')
+    if not maintainer and metadata.get('Author-email') and '<' in metadata['Author-email']:
+        maintainer = metadata['Author-email']
+    elif not maintainer and metadata.get('Author-email'):
+        maintainer = '%s <%s>' % (metadata.get('Author') or metadata['Author-email'], metadata['Author-email'])
+    control = [('Package', package_name), ('Version', version), ('Architecture', architecture),
+               ('Maintainer', maintainer or 'unknown <unknown@unknown>'),
+               ('Section', options.get('section', 'python')), ('Priority', 'optional')]
+    data_members, md5sums, installed_size = [], [], 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        data_members.append(dirpath)
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            data_members.append(path)
+            if os.path.isfile(path) and not os.path.islink(path):
+                installed_size += os.path.getsize(path)
+                with open(path, 'rb') as fd:
+                    md5sums.append('%s  %s\n' % (hashlib.md5(fd.read()).hexdigest(), os.path.relpath(path, root)))
+    control.append(('Installed-Size', str((installed_size + 1023) // 1024)))
+    control.append(('Depends', ', '.join(depends)))
+    for field in ('Conflicts', 'Breaks', 'Provides', 'Replaces', 'Recommends', 'Suggests'):
+        if get_option(options, field, python_major):
+            control.append((field, get_option(options, field, python_major)))
+    if metadata.get('Home-page') and metadata['Home-page'] != 'UNKNOWN':
+        control.append(('Homepage', metadata['Home-page']))
+    control.append(('Description', format_description(metadata.get('Summary'), metadata.get('Description'))))
+    compile_command = 'py3compile' if python_major == 3 else 'pycompile'
+    clean_command = 'py3clean' if python_major == 3 else 'pyclean'
+    control_members = [
+        ('control', ''.join('%s: %s\n' % x for x in control), 0o644),
+        ('md5sums', ''.join(md5sums), 0o644),
+        # compiled files are created on installation, like dh_python does
+        ('postinst', '#!/bin/sh\nset -e\nif which %s >/dev/null 2>&1; then\n\t%s -p %s\nfi\n' %
+         (compile_command, compile_command, package_name), 0o755),
+        ('prerm', '#!/bin/sh\nset -e\nif which %s >/dev/null 2>&1; then\n\t%s -p %s\nfi\n' %
+         (clean_command, clean_command, package_name), 0o755),
+    ]
+    work_dir = os.path.dirname(os.path.abspath(root))
+    control_tar = os.path.join(work_dir, 'control.tar.gz')
+    data_tar = os.path.join(work_dir, 'data.tar.gz')
+
+    def reset(tar_info):
+        tar_info.uid = tar_info.gid = 0
+        tar_info.uname = tar_info.gname = 'root'
+        tar_info.mtime = mtime
+        return tar_info
+
+    with tarfile.open(control_tar, mode='w:gz', format=tarfile.GNU_FORMAT) as tar_file:
+        for name, content, mode in control_members:
+            content = content.encode('utf-8')
+            tar_info = reset(tarfile.TarInfo('./' + name))
+            tar_info.size = len(content)
+            tar_info.mode = mode
+            tar_file.addfile(tar_info, io.BytesIO(content))
+    with tarfile.open(data_tar, mode='w:gz', format=tarfile.GNU_FORMAT) as tar_file:
+        for path in data_members:
+            arcname = './' + os.path.relpath(path, root) if path != root else './'
+            tar_file.add(path, arcname=arcname, recursive=False, filter=reset)
+    filename = os.path.join(deb_dest_dir, '%s_%s_%s.deb' % (package_name, version.partition(':')[2] or version,
+                                                            architecture))
+    build_deb(filename, control_tar, data_tar)
+    os.remove(control_tar)
+    os.remove(data_tar)
+    return filename
+
+
+def get_architecture():
+    """Return the Debian architecture of this system (like `amd64`)"""
+    return subprocess.check_output(['dpkg', '--print-architecture']).decode('utf-8').strip()
+
+
+def get_interpreter_depends(filename, python_major=None):
+    """ Return the Debian relations that restrict a wheel with compiled extensions to the interpreters
+    of its tags: a single minor version, or a minimal version for the stable ABI (`abi3`)
+
+    >>> get_interpreter_depends('lxml-4.2.1-cp36-cp36m-manylinux1_x86_64.whl', 3)
+    ['python3 (>= 3.6~)', 'python3 (<< 3.7)']
+    >>> get_interpreter_depends('cryptography-41.0.1-cp37-abi3-manylinux_2_28_x86_64.whl', 3)
+    ['python3 (>= 3.7~)']
+
+    :return: list of relations
+    :rtype: :class:`list`
+    :raise ValueError: if the tags do not define the compatible interpreters
+    """
+    if python_major is None:
+        python_major = sys.version_info[0]
+    python = 'python' if python_major == 2 else 'python3'
+    matcher = WHEEL_RE.match(os.path.basename(filename))
+    if not matcher:
+        raise ValueError('invalid wheel filename: %s' % filename)
+    versions = sorted((int(x.group(1)), int(x.group(2)))
+                      for x in (re.match(r'^cp(%d)(\d+)$' % python_major, y)
+                                for y in matcher.group('python').split('.')) if x)
+    if not versions:
+        raise ValueError('unable to find the interpreter of %s' % filename)
+    major, minor = versions[0]
+    if matcher.group('abi') == 'abi3':
+        return ['%s (>= %d.%d~)' % (python, major, minor)]
+    elif len(versions) == 1:
+        return ['%s (>= %d.%d~)' % (python, major, minor), '%s (<< %d.%d)' % (python, major, minor + 1)]
+    raise ValueError('unable to find the interpreter of %s' % filename)
+
+
+def get_shlibs_depends(root):
+    """ Return the Debian relations required by the shared libraries used by the compiled extensions of
+    a staging root, with `dpkg-shlibdeps`. Libraries that are shipped in the root (like the ones vendored by
+    `auditwheel`) do not add any relation.
+
+    :return: list of relations
+    :rtype: :class:`list`
+    :raise ValueError: if `dpkg-shlibdeps` is not available or fails
+    """
+    filenames, lib_dirs = [], set()
+    for dirpath, dirnames, names in os.walk(root):
+        for name in names:
+            if name.endswith('.so') or '.so.' in name:
+                filenames.append(os.path.join(dirpath, name))
+                lib_dirs.add(dirpath)
+    if not filenames:
+        return []
+    # dpkg-shlibdeps requires a debian/control file
+    work_dir = tempfile.mkdtemp(suffix='-shlibdeps')
+    try:
+        os.mkdir(os.path.join(work_dir, 'debian'))
+        with codecs.open(os.path.join(work_dir, 'debian', 'control'), 'w', encoding='utf-8') as fd:
+            fd.write('Source: shlibdeps\n\nPackage: shlibdeps\nArchitecture: any\n')
+        try:
+            output = subprocess.check_output(['dpkg-shlibdeps', '-O', '--ignore-missing-info'] +
+                                             ['-l%s' % x for x in sorted(lib_dirs)] + ['-e%s' % x for x in filenames],
+                                             cwd=work_dir, stderr=subprocess.PIPE)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise ValueError('unable to find the dependencies of shared libraries: %s' % e)
+    finally:
+        shutil.rmtree(work_dir)
+    for line in output.decode('utf-8').splitlines():
+        if line.startswith('shlibs:Depends='):
+            return [x.strip() for x in line.partition('=')[2].split(',') if x.strip()]
+    return []
+
+
+def get_supported_tags():
+    """ Return the `(python, abi, platform)` wheel tags supported by this Python, the preferred ones first.
+    Without the `packaging` module, only pure-Python wheels are supported.
+
+    :rtype: :class:`list`
+    """
+    if sys_tags is not None:
+        return [(x.interpreter, x.abi, x.platform) for x in sys_tags()]
+    major, minor = sys.version_info[:2]
+    pythons = ['py%d%d' % (major, x) for x in range(minor, -1, -1)] + ['py%d' % major]
+    return [(x, 'none', 'any') for x in pythons]
+
+
+def normalize_project_name(name):
+    """ Return the normalized form of a project name (PEP 503)
+
+    >>> normalize_project_name('Django_Redis'), normalize_project_name('zope.interface')
+    ('django-redis', 'zope-interface')
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def find_wheel(directories, project_name, version, supported_tags=None):
+    """ Find the best wheel of a distribution in some directories (wheelhouses)
+
+    :param directories: directories containing `.whl` files
+    :type directories: :class:`list`
+    :param supported_tags: supported `(python, abi, platform)` tags, the preferred ones first
+        (default: :func:`get_supported_tags`)
+    :type supported_tags: :class:`list`
+    :return: path of the wheel, or `None` if no compatible wheel is available
+    :rtype: :class:`str`
+    """
+    if supported_tags is None:
+        supported_tags = get_supported_tags()
+    priorities = {tag: index for (index, tag) in enumerate(supported_tags)}
+    project_name = normalize_project_name(project_name)
+    best_priority, best_filename = None, None
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for basename in sorted(os.listdir(directory)):
+            matcher = WHEEL_RE.match(basename)
+            if not matcher or normalize_project_name(matcher.group('name')) != project_name or \
+                    matcher.group('version') != version.replace('-', '_'):
+                continue
+            # compressed tag sets, like `py2.py3-none-any`
+            tags = [(x, y, z) for x in matcher.group('python').split('.') for y in matcher.group('abi').split('.')
+                    for z in matcher.group('platform').split('.')]
+            priority = min([priorities[x] for x in tags if x in priorities] or [None], key=lambda x: (x is None, x))
+            if priority is not None and (best_priority is None or priority < best_priority):
+                best_priority, best_filename = priority, os.path.join(directory, basename)
+    return best_filename
+
+
+def install_wheel(filename, root, python_major=None):
+    """ Install a wheel into a staging root, with the Debian layout, without running any code.
+    Scripts of `console_scripts` and `gui_scripts` entry points are created in `/usr/bin`.
+
+    :param filename: path of the `.whl` file
+    :type filename: :class:`str`
+    :param root: staging root
+    :type root: :class:`str`
+    """
+    if python_major is None:
+        python_major = sys.version_info[0]
+    executable = '/usr/bin/python' if python_major == 2 else '/usr/bin/python3'
+    lib_dir = root + get_python_lib_dir(python_major)
+    scripts_dir = root + '/usr/bin'
+    dist_name = os.path.basename(filename).split('-')[0]
+    scheme_dirs = {'purelib': lib_dir, 'platlib': lib_dir, 'scripts': scripts_dir, 'data': root + '/usr',
+                   'headers': '%s/usr/include/python%d/%s' % (root, python_major, dist_name)}
+    entry_points = None
+    with zipfile.ZipFile(filename) as zip_file:
+        for info in zip_file.infolist():
+            if info.filename.endswith('/'):
+                continue
+            parts = info.filename.split('/')
+            if parts[0].endswith('.data') and len(parts) > 2 and parts[1] in scheme_dirs:
+                base_dir, path = scheme_dirs[parts[1]], '/'.join(parts[2:])
+            else:
+                base_dir, path = lib_dir, info.filename
+            destination = os.path.normpath(os.path.join(base_dir, path))
+            if not destination.startswith(base_dir + os.path.sep):
+                raise ValueError('invalid path in %s: %s' % (filename, info.filename))
+            if not os.path.isdir(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            content = zip_file.read(info)
+            mode = (info.external_attr >> 16) & 0o777
+            if base_dir == scripts_dir:
+                mode = 0o755
+                # `#!python` and `#!pythonw` must be replaced by the interpreter
+                matcher = re.match(br'^#!pythonw?(?=\s)', content)
+                if matcher:
+                    content = b'#!' + executable.encode('utf-8') + content[matcher.end():]
+            elif len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'entry_points.txt':
+                entry_points = content.decode('utf-8')
+            with open(destination, 'wb') as fd:
+                fd.write(content)
+            os.chmod(destination, 0o755 if mode & 0o111 else 0o644)
+    section = None
+    for line in (entry_points or '').splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            section = line[1:-1].strip()
+            continue
+        name, sep, value = line.partition('=')
+        if section not in ('console_scripts', 'gui_scripts') or not sep:
+            continue
+        module, sep, attribute = value.partition('[')[0].strip().partition(':')
+        if not sep:
+            raise ValueError('invalid entry point in %s: %s' % (filename, line))
+        script = os.path.join(scripts_dir, name.strip())
+        if not os.path.isdir(scripts_dir):
+            os.makedirs(scripts_dir)
+        with codecs.open(script, 'w', encoding='utf-8') as fd:
+            fd.write(ENTRY_POINT_SCRIPT % {'executable': executable, 'module': module.strip(),
+                                           'name': attribute.strip().split('.')[0], 'attribute': attribute.strip()})
+        os.chmod(script, 0o755)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Select a consistent set of packages from a :class:`debtools.index.PackageIndex`
+
+"""
+from __future__ import unicode_literals
+
+from collections import deque
+
+from debtools.utils import Relation, check_version_constraint, parse_relationships
+from debtools.versions import get_version, VersionRange
+
+__author__ = 'Matthieu Gallet'
+
+
+class ResolutionError(ValueError):
+    """Raised when some dependencies cannot be satisfied"""
+    pass
+
+
+def format_relation(alternatives):
+    """ Return a relation as written in control files
+
+    >>> format_relation((Relation('debconf', None, ('>=', '0.5'), (), ()), Relation('debconf-2.0', None, None, (), ())))
+    'debconf (>= 0.5) | debconf-2.0'
+    """
+    return ' | '.join('%s (%s %s)' % (x.name, x.constraint[0], x.constraint[1]) if x.constraint else x.name
+                      for x in alternatives)
+
+
+def get_relations(control_data):
+    """Return the parsed `Pre-Depends` and `Depends` of a package (a tuple of tuples of alternatives)"""
+    return parse_relationships(control_data.get('Pre-Depends', '')) + \
+        parse_relationships(control_data.get('Depends', ''))
+
+
+class Resolver(object):
+    """ Select a package for each dependency, taking alternatives (`a | b`) and virtual packages (`Provides`)
+    into account.
+
+    Dependencies are processed breadth-first. When several packages can satisfy a dependency, the installed (or
+    ignored) versions are preferred, then the other versions of installed packages, then the alternatives in their
+    order (real packages before virtual ones), then the highest versions. A newer version than the installed or ignored
+    one is selected when it is required (an upgrade).
+    When a dependency cannot be satisfied anymore, the last choice is reverted and the next candidate is tried.
+
+    Sub-results are memoized: candidates of each relation, and whether a package can be installed at all
+    (if one of its dependencies, or all the candidates of one of them recursively, is missing from the index,
+    it is never tried).
+
+    >>> from debtools.index import PackageIndex
+    >>> index = PackageIndex()
+    >>> for stanza in ({'Package': 'a', 'Version': '1', 'Depends': 'b | c, awk'}, {'Package': 'b', 'Version': '1',
+    ...                'Depends': 'missing'}, {'Package': 'c', 'Version': '1'},
+    ...                {'Package': 'mawk', 'Version': '1', 'Provides': 'awk'}):
+    ...     index.add(stanza)
+    >>> sorted(Resolver(index).resolve(['a']))
+    ['a', 'c', 'mawk']
+    """
+    max_backtracks = 10000
+    # deeper dependencies are assumed to be installable by :meth:`is_viable`
+    max_viability_depth = 64
+
+    def __init__(self, index, installed=None, ignored=None):
+        """
+        :param index: available packages
+        :type index: :class:`debtools.index.PackageIndex`
+        :param installed: {package name: version} of installed packages, preferred when there is a choice
+        :type installed: :class:`dict`
+        :param ignored: {package name: version} of packages that are considered as already available: they satisfy
+            dependencies and are not selected (:class:`debtools.utils.InstalledPackages` also provides virtual packages)
+        :type ignored: :class:`dict`
+        """
+        self.index = index
+        self.installed = installed or {}
+        self.ignored = ignored or {}
+        # {package name: fields} of selected packages, in selection order
+        self.selected = {}
+        # {virtual package name: [(package name, provided version or None), ...]} for selected packages
+        self.provided = {}
+        self.backtracks = 0
+        self._trail = []
+        self._candidates = {}
+        self._viable = {}
+
+    @staticmethod
+    def __check(relation, version):
+        return relation.constraint is None or \
+            check_version_constraint(get_version(version), relation.constraint[0], get_version(relation.constraint[1]))
+
+    def get_preference(self, control_data):
+        """ Return the rank of a candidate, the lowest being preferred: 0 for the installed or ignored version of
+        a package, 1 for another version of an installed or ignored package, 2 for other packages
+
+        :rtype: :class:`int`
+        """
+        preference = 2
+        for packages in (self.installed, self.ignored):
+            version = packages.get(control_data['Package'])
+            if version is None:
+                continue
+            elif get_version(version).key == get_version(control_data['Version']).key:
+                return 0
+            preference = 1
+        return preference
+
+    def get_satisfier(self, alternatives):
+        """ Return the package that satisfies a relation among selected and ignored packages
+
+        :param alternatives: tuple of :class:`debtools.utils.Relation`
+        :return: `(package name, matching relation)`, or `None` if the relation is not satisfied
+        :rtype: :class:`tuple`
+        """
+        for relations, provides in ((self.selected, self.provided),
+                                    (self.ignored, getattr(self.ignored, 'provides', {}))):
+            for relation in alternatives:
+                if relation.name in relations:
+                    value = relations[relation.name]
+                    if self.__check(relation, value['Version'] if isinstance(value, dict) else value):
+                        return relation.name, relation
+                for provider, version in provides.get(relation.name, []):
+                    if relation.constraint is None or (version is not None and self.__check(relation, version)):
+                        return provider, relation
+        return None
+
+    def candidates(self, alternatives):
+        """ Return the packages of the index that can satisfy a relation, by order of preference
+
+        :param alternatives: tuple of :class:`debtools.utils.Relation`
+        :return: list of package fields
+        :rtype: :class:`list`
+        """
+        result = self._candidates.get(alternatives)
+        if result is not None:
+            return result
+        result = []
+        keys = set()
+        for relation in alternatives:
+            stanzas = [x for x in self.index.packages.get(relation.name, []) if self.__check(relation, x['Version'])]
+            for provider in self.index.get_providers(relation.name):
+                # each version of the provider may provide a different version of the virtual package
+                stanzas += [x for x in self.index.packages.get(provider, [])
+                            if any(self.__provides(y, relation) for z in parse_relationships(x.get('Provides', ''))
+                                   for y in z)]
+            for stanza in stanzas:
+                key = (stanza['Package'], stanza['Version'], stanza.get('Architecture'))
+                if key not in keys:
+                    keys.add(key)
+                    result.append(stanza)
+        # stable sort: the order of alternatives is kept
+        result.sort(key=self.get_preference)
+        self._candidates[alternatives] = result
+        return result
+
+    def __provides(self, provided, relation):
+        """Return `True` if a `Provides` relation satisfies a dependency on a virtual package"""
+        if provided.name != relation.name:
+            return False
+        return relation.constraint is None or \
+            (provided.constraint is not None and self.__check(relation, provided.constraint[1]))
+
+    def is_viable(self, control_data, depth=0):
+        """ Return `False` if a package cannot be installed, whatever the other selected packages:
+        one of its dependencies has no viable candidate in the index.
+        """
+        key = (control_data['Package'], control_data['Version'])
+        viable = self._viable.get(key)
+        if viable is None:
+            if depth >= self.max_viability_depth:
+                return True
+            # packages in a dependency cycle are assumed to be viable
+            self._viable[key] = True
+            viable = all(self.__is_ignored(x) or any(self.is_viable(y, depth + 1) for y in self.candidates(x))
+                         for x in get_relations(control_data))
+            self._viable[key] = viable
+        return viable
+
+    def __is_ignored(self, alternatives):
+        for relation in alternatives:
+            if relation.name in self.ignored and self.__check(relation, self.ignored[relation.name]):
+                return True
+            for provider, version in getattr(self.ignored, 'provides', {}).get(relation.name, []):
+                if relation.constraint is None or (version is not None and self.__check(relation, version)):
+                    return True
+        return False
+
+    def __select(self, control_data, queue):
+        package_name = control_data['Package']
+        self.selected[package_name] = control_data
+        self._trail.append(package_name)
+        for alternatives in parse_relationships(control_data.get('Provides', '')):
+            for relation in alternatives:
+                self.provided.setdefault(relation.name, []).append(
+                    (package_name, relation.constraint[1] if relation.constraint else None))
+        queue.extend(get_relations(control_data))
+
+    def __undo(self, trail_length):
+        while len(self._trail) > trail_length:
+            package_name = self._trail.pop()
+            control_data = self.selected.pop(package_name)
+            for alternatives in parse_relationships(control_data.get('Provides', '')):
+                for relation in alternatives:
+                    providers = self.provided[relation.name]
+                    providers.pop(max(i for (i, x) in enumerate(providers) if x[0] == package_name))
+                    if not providers:
+                        del self.provided[relation.name]
+
+    def resolve(self, roots):
+        """ Select packages satisfying all dependencies of `roots`, recursively
+
+        :param roots: package names, or control data of packages that must be selected (like local .deb files)
+        :type roots: :class:`list`
+        :return: {package name: fields} of selected packages
+        :rtype: :class:`dict`
+        :raise ResolutionError: if dependencies cannot be satisfied
+        """
+        queue = deque()
+        for root in roots:
+            if isinstance(root, dict):
+                if root['Package'] not in self.selected:
+                    self.__select(root, queue)
+            else:
+                queue.append((Relation(root, None, None, (), ()), ))
+        # each choice point is (length of the trail, queue, relation, remaining candidates)
+        choice_points = []
+        while queue:
+            alternatives = queue.popleft()
+            if self.get_satisfier(alternatives) is not None:
+                continue
+            candidates = [x for x in self.candidates(alternatives)
+                          if x['Package'] not in self.selected and self.is_viable(x)]
+            while not candidates:
+                if not choice_points:
+                    raise ResolutionError('Unable to satisfy %s' % format_relation(alternatives))
+                self.backtracks += 1
+                if self.backtracks > self.max_backtracks:
+                    raise ResolutionError('Unable to satisfy %s: too many backtracks' %
+                                          format_relation(alternatives))
+                trail_length, queue, alternatives, candidates = choice_points.pop()
+                self.__undo(trail_length)
+                queue = deque(queue)
+            if len(candidates) > 1:
+                choice_points.append((len(self._trail), list(queue), alternatives, candidates[1:]))
+            self.__select(candidates[0], queue)
+        return self.selected
+
+    def get_dependencies(self, control_data):
+        """ Return the dependencies of a package, as returned by :func:`debtools.utils.get_dependencies`,
+        each relation being replaced by the package that satisfies it (the best candidate if it is not resolved).
+
+        :rtype: :class:`dict`
+        """
+        deps = {}
+        for alternatives in get_relations(control_data):
+            satisfier = self.get_satisfier(alternatives)
+            if satisfier is None:
+                candidates = self.candidates(alternatives)
+                relation = alternatives[0]
+                package_name = candidates[0]['Package'] if candidates else relation.name
+                for relation in alternatives:
+                    if relation.name == package_name:
+                        break
+            else:
+                package_name, relation = satisfier
+            version_range = deps.setdefault(package_name, VersionRange())
+            # the constraint of a virtual package does not apply to the version of its provider
+            if relation.constraint is not None and relation.name == package_name:
+                version_range.add(*relation.constraint)
+        return deps
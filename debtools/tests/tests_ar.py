@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest import TestCase
+
+from debtools.ar import ArFile
+
+__author__ = 'Matthieu Gallet'
+
+
+def build_ar(members, timestamp=0):
+    """Build the content of an `ar` archive from a list of (name, data)"""
+    content = ArFile.GLOBAL_HEADER
+    for name, data in members:
+        header = '%-16s%-12d%-6d%-6d%-8s%-10d`\n' % (name, timestamp, 0, 0, '100644', len(data))
+        content += header.encode('utf-8') + data
+        if len(data) % 2:
+            content += b'\n'
+    return content
+
+
+class TestArFile(TestCase):
+    members = [('debian-binary', b'2.0\n'), ('control.tar.gz', b'c' * 101), ('data.tar.xz', b'd' * 64)]
+
+    def get_ar_file(self):
+        return ArFile(fileobj=io.BytesIO(build_ar(self.members)))
+
+    def test_getnames(self):
+        ar_file = self.get_ar_file()
+        self.assertEqual(['debian-binary', 'control.tar.gz', 'data.tar.xz'], ar_file.getnames())
+        self.assertEqual(['debian-binary', 'control.tar.gz', 'data.tar.xz'], ar_file.getnames())
+
+    def test_lazy_getmember(self):
+        ar_file = self.get_ar_file()
+        member = ar_file.getmember('control.tar.gz')
+        self.assertEqual(101, member.size)
+        self.assertEqual(8 + 60 + 4 + 60, member.data_offset)
+        self.assertEqual(['debian-binary', 'control.tar.gz', 'data.tar.xz'], [x.name for x in ar_file])
+        self.assertIsNone(ar_file.getmember('missing'))
+
+    def test_extractfile(self):
+        ar_file = self.get_ar_file()
+        data_file = ar_file.extractfile('data.tar.xz')
+        control_file = ar_file.extractfile('control.tar.gz')
+        self.assertEqual(b'd' * 10, data_file.read(10))
+        self.assertEqual(b'c' * 101, control_file.read())
+        self.assertEqual(b'd' * 54, data_file.read())
+
+
+class TestMmapArFile(TestCase):
+
+    def setUp(self):
+        tar_content = io.BytesIO()
+        with tarfile.open(fileobj=tar_content, mode='w:gz') as tar_file:
+            info = tarfile.TarInfo('./control')
+            info.size = 13
+            tar_file.addfile(info, io.BytesIO(b'Package: foo\n'))
+        fd, self.filename = tempfile.mkstemp(suffix='.deb')
+        with os.fdopen(fd, 'wb') as fileobj:
+            fileobj.write(build_ar([('debian-binary', b'2.0\n'), ('control.tar.gz', tar_content.getvalue())]))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_mmap_members(self):
+        ar_file = ArFile(self.filename, use_mmap=True)
+        self.assertEqual(b'2.0\n', ar_file.getbuffer('debian-binary').tobytes())
+        control_file = ar_file.extractfile('control.tar.gz')
+        with tarfile.open(fileobj=control_file, mode='r:*') as tar_file:
+            self.assertEqual(b'Package: foo\n', tar_file.extractfile('./control').read())
+        ar_file.close()
+
+
+class TestArFileWriter(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_filename = os.path.join(self.directory, 'data.tar.xz')
+        with open(self.data_filename, 'wb') as fd:
+            fd.write(b'd' * 3001)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        filename = os.path.join(self.directory, 'test.deb')
+        with ArFile(filename, mode='w', reproducible=True, mtime=42) as ar_file:
+            ar_file.addfile(ar_file.getarinfo('debian-binary', fileobj=io.BytesIO(b'2.0\n')), io.BytesIO(b'2.0\n'))
+            ar_file.add(self.data_filename)
+        with open(filename, 'rb') as fd:
+            self.assertEqual(build_ar([('debian-binary', b'2.0\n'), ('data.tar.xz', b'd' * 3001)], timestamp=42),
+                             fd.read())
+        ar_file = ArFile(filename)
+        member = ar_file.getmember('data.tar.xz')
+        self.assertEqual((3001, 42, 0, 0, 0o100644),
+                         (member.size, member.timestamp, member.owner_id, member.group_id, member.file_mode))
+        self.assertEqual(b'd' * 3001, ar_file.extractfile(member).read())
+        ar_file.close()
+
+    def test_repack(self):
+        filename = os.path.join(self.directory, 'test.deb')
+        with ArFile(filename, mode='w') as ar_file:
+            ar_file.addfile(ar_file.getarinfo('debian-binary', fileobj=io.BytesIO(b'2.0\n')), io.BytesIO(b'2.0\n'))
+            ar_file.add(self.data_filename)
+        repacked = os.path.join(self.directory, 'repacked.deb')
+        for use_mmap in (False, True):
+            with ArFile(filename, use_mmap=use_mmap) as src_file, \
+                    ArFile(repacked, mode='w', reproducible=True, mtime=42) as dst_file:
+                for member in src_file.getmembers():
+                    dst_file.addfile(member, src_file.extractfile(member))
+            with open(repacked, 'rb') as fd:
+                self.assertEqual(build_ar([('debian-binary', b'2.0\n'), ('data.tar.xz', b'd' * 3001)], timestamp=42),
+                                 fd.read())
+
+    def test_non_ascii_name(self):
+        filename = os.path.join(self.directory, 'test.ar')
+        with ArFile(filename, mode='w') as ar_file:
+            ar_file.addfile(ar_file.getarinfo('\xe9t\xe9.txt', fileobj=io.BytesIO(b'abc')), io.BytesIO(b'abc'))
+        with open(filename, 'rb') as fd:
+            self.assertEqual(b'!<arch>\n' + '\xe9t\xe9.txt'.encode('utf-8') + b' ' * 7, fd.read()[:24])
+        with ArFile(filename) as ar_file:
+            self.assertEqual(['\xe9t\xe9.txt'], ar_file.getnames())
+            self.assertEqual(b'abc', ar_file.extractfile('\xe9t\xe9.txt').read())
+
+    def test_parallel_extractall(self):
+        filename = os.path.join(self.directory, 'test.deb')
+        with ArFile(filename, mode='w') as ar_file:
+            ar_file.addfile(ar_file.getarinfo('debian-binary', fileobj=io.BytesIO(b'2.0\n')), io.BytesIO(b'2.0\n'))
+            ar_file.add(self.data_filename)
+        destination = os.path.join(self.directory, 'extracted')
+        os.mkdir(destination)
+        with ArFile(filename) as ar_file:
+            ar_file.extractall(destination, workers=2)
+        for name, data in (('debian-binary', b'2.0\n'), ('data.tar.xz', b'd' * 3001)):
+            with open(os.path.join(destination, name), 'rb') as fd:
+                self.assertEqual(data, fd.read())
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from debtools.cache import BuildCache, ControlDataCache, SourceCache
+from debtools.tests.tests_utils import build_test_deb
+
+__author__ = 'Matthieu Gallet'
+
+
+class TestControlDataCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ControlDataCache(filename=os.path.join(self.directory, 'cache.sqlite3'), max_entries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_control_data(self):
+        filename = build_test_deb(self.directory, 'Package: foo\nDepends: bar (>= 1.0)\n')
+        self.assertIsNone(self.cache.get(filename))
+        control_data, deps = self.cache.get_control_data(filename)
+        self.assertEqual({'Package': 'foo', 'Depends': 'bar (>= 1.0)'}, control_data)
+        self.assertEqual((control_data, deps), self.cache.get(filename))
+        self.assertEqual(['bar'], list(deps))
+        # the file is modified: the cached entry is ignored
+        build_test_deb(self.directory, 'Package: foo2\n')
+        os.utime(filename, (0, 0))
+        self.assertIsNone(self.cache.get(filename))
+        self.assertEqual('foo2', self.cache.get_control_data(filename)[0]['Package'])
+
+    def test_eviction(self):
+        filenames = []
+        for compression in ('gz', 'xz', 'bz2'):
+            filename = build_test_deb(self.directory, 'Package: foo\n', compression=compression)
+            self.cache.get_control_data(filename)
+            filenames.append(filename)
+        self.assertIsNone(self.cache.get(filenames[0]))
+        self.assertIsNotNone(self.cache.get(filenames[2]))
+
+
+class TestBuildCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = BuildCache(directory=os.path.join(self.directory, 'cache'), max_size=2500)
+        self.destination = os.path.join(self.directory, 'deb')
+        os.mkdir(self.destination)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def build(self, name):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as fd:
+            fd.write(b'0' * 1000)
+        return filename
+
+    def test_build_cache(self):
+        key = BuildCache.get_key('foo', '1.0', {'depends': 'bar'}, 3)
+        self.assertNotEqual(key, BuildCache.get_key('foo', '1.0', {'depends': 'baz'}, 3))
+        self.assertIsNone(self.cache.get(key, self.destination))
+        self.cache.set(key, self.build('python3-foo_1.0-1_all.deb'))
+        filename = self.cache.get(key, self.destination)
+        self.assertEqual(os.path.join(self.destination, 'python3-foo_1.0-1_all.deb'), filename)
+        self.assertEqual(1000, os.path.getsize(filename))
+
+    def test_rewrite_destination(self):
+        key = BuildCache.get_key('foo', '1.0', {'depends': 'bar'}, 3)
+        filename = self.build('python3-foo_1.0-1_all.deb')
+        self.cache.set(key, filename)
+        # a new build with another key rewrites the file in place
+        with open(filename, 'wb') as fd:
+            fd.write(b'1' * 500)
+        filename = self.cache.get(key, self.destination)
+        with open(filename, 'r+b') as fd:
+            fd.write(b'2' * 500)
+        filename = self.cache.get(key, self.directory)
+        with open(filename, 'rb') as fd:
+            self.assertEqual(b'0' * 1000, fd.read())
+
+    def test_eviction(self):
+        keys = [BuildCache.get_key('foo', x) for x in ('1', '2', '3')]
+        self.cache.set(keys[0], self.build('foo_1_all.deb'))
+        self.cache.set(keys[1], self.build('foo_2_all.deb'))
+        # keys[0] is now more recently used than keys[1]
+        self.assertIsNotNone(self.cache.get(keys[0], self.destination))
+        self.cache.set(keys[2], self.build('foo_3_all.deb'))
+        self.assertIsNone(self.cache.get(keys[1], self.destination))
+        self.assertIsNotNone(self.cache.get(keys[0], self.destination))
+        self.assertIsNotNone(self.cache.get(keys[2], self.destination))
+
+
+class TestSourceCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SourceCache(directory=os.path.join(self.directory, 'cache'))
+        self.seed_dir = os.path.join(self.directory, 'seed')
+        self.destination = os.path.join(self.directory, 'work')
+        for name in (self.seed_dir, self.destination):
+            os.mkdir(name)
+        for basename, content in (('Django-1.8.3.tar.gz', b'django'), ('python_dateutil-2.4.2.tar.gz', b'dateutil'),
+                                  ('README.txt', b'readme')):
+            with open(os.path.join(self.seed_dir, basename), 'wb') as fd:
+                fd.write(content)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_seed(self):
+        self.assertEqual(2, self.cache.seed(self.seed_dir))
+        filename = self.cache.get('python-dateutil', '2.4.2', self.destination)
+        self.assertEqual(os.path.join(self.destination, 'python_dateutil-2.4.2.tar.gz'), filename)
+        with open(filename, 'rb') as fd:
+            self.assertEqual(b'dateutil', fd.read())
+        self.assertIsNone(self.cache.get('django', '1.8.4', self.destination))
+
+    def test_corrupted(self):
+        sha256 = self.cache.add(os.path.join(self.seed_dir, 'Django-1.8.3.tar.gz'))
+        with open(self.cache.get_path(sha256, 'Django-1.8.3.tar.gz'), 'ab') as fd:
+            fd.write(b'corrupted')
+        self.assertIsNone(self.cache.get('Django', '1.8.3', self.destination))
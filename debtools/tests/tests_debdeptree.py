@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from debtools.debdeptree import DepTree
+from debtools.graph import GraphStore
+from debtools.index import PackageIndex
+from debtools.tests.tests_utils import build_test_deb
+
+__author__ = 'Matthieu Gallet'
+
+
+class LocalDepTree(DepTree):
+    """Copy packages from a local directory instead of calling `apt-get download`"""
+
+    def __init__(self, repository, **kwargs):
+        super(LocalDepTree, self).__init__(**kwargs)
+        self.repository = repository
+        self.downloads = []
+
+    def apt_get_download(self, package_names):
+        self.downloads.append(sorted(package_names))
+        for package_name in package_names:
+            shutil.copy(os.path.join(self.repository, '%s_1.0_all.deb' % package_name), '.')
+
+
+class TestDepTree(TestCase):
+    packages = {'a': 'b (>= 1.0), c', 'b': 'd', 'c': 'd (<< 2.0), e | f', 'd': None}
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.repository = tempfile.mkdtemp()
+        self.directory = tempfile.mkdtemp()
+        for package_name, depends in self.packages.items():
+            control = 'Package: %s\nVersion: 1.0\n' % package_name
+            if depends:
+                control += 'Depends: %s\n' % depends
+            filename = build_test_deb(self.repository, control)
+            os.rename(filename, os.path.join(self.repository, '%s_1.0_all.deb' % package_name))
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.repository)
+        shutil.rmtree(self.directory)
+
+    def test_recursive(self):
+        dep_tree = LocalDepTree(self.repository, recursive=True)
+        dep_tree.add('a')
+        self.assertEqual([['a'], ['b', 'c'], ['d']], dep_tree.downloads)
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(dep_tree.dependencies_by_package))
+        self.assertEqual('<< 2.0', str(dep_tree.dependencies_by_package['c']['d']))
+
+    def test_ignored(self):
+        dep_tree = LocalDepTree(self.repository, recursive=True, ignored_packages={'b': '1.2', 'd': '2.0'})
+        dep_tree.add('a')
+        self.assertEqual([['a'], ['c'], ['d']], dep_tree.downloads)
+
+    def test_find_package(self):
+        for filename in ('a_0.9_all.deb', 'a_1.0_all.deb', 'a_1%3a0.1_all.deb'):
+            shutil.copy(os.path.join(self.repository, 'a_1.0_all.deb'), filename)
+        dep_tree = LocalDepTree(self.repository)
+        self.assertEqual(os.path.join('.', 'a_1%3a0.1_all.deb'), dep_tree.find_package('a'))
+        self.assertIsNone(dep_tree.find_package('b'))
+        dep_tree.add('b')
+        self.assertEqual([['b']], dep_tree.downloads)
+        self.assertEqual(os.path.join('.', 'b_1.0_all.deb'), dep_tree.find_package('b'))
+
+    def test_download(self):
+        dep_tree = LocalDepTree(self.repository)
+        # the downloaded file is misleadingly named
+        dep_tree.apt_get_download = lambda x: shutil.copy(os.path.join(self.repository, 'b_1.0_all.deb'), 'z_9_all.deb')
+        self.assertEqual([os.path.join('.', 'z_9_all.deb')], dep_tree.download(['b']))
+        self.assertIsNone(dep_tree.find_package('z'))
+
+    def test_graph_store(self):
+        graph_filename = os.path.join(self.directory, 'graph.json')
+        dep_tree = LocalDepTree(self.repository, recursive=True, graph_store=GraphStore(graph_filename))
+        dep_tree.add('a')
+        dep_tree.save_graph()
+        # replace c by a new file (tmp.deb holds the previous inode, so c gets a new one)
+        os.remove('c_1.0_all.deb')
+        shutil.copy(os.path.join(self.repository, 'd_1.0_all.deb'), 'tmp.deb')
+        shutil.copy(os.path.join(self.repository, 'c_1.0_all.deb'), 'c_1.0_all.deb')
+        os.remove('tmp.deb')
+        graph_store = GraphStore(graph_filename)
+        self.assertEqual(4, graph_store.load())
+        dep_tree = LocalDepTree(self.repository, recursive=True, graph_store=graph_store)
+        dep_tree.add('a')
+        self.assertEqual([], dep_tree.downloads)
+        # only the modified file has been read
+        self.assertEqual([os.path.join('.', 'c_1.0_all.deb')], list(dep_tree.control_data_by_filename))
+        self.assertEqual('>= 1.0', str(dep_tree.dependencies_by_package['a']['b']))
+
+
+class TestIndexDepTree(TestCase):
+    stanzas = [{'Package': 'a', 'Version': '1.0', 'Depends': 'b (<< 2.0), awk, e | f'},
+               {'Package': 'b', 'Version': '1.5', 'Depends': 'c'},
+               {'Package': 'b', 'Version': '2.1', 'Depends': 'd'},
+               {'Package': 'c', 'Version': '1.0'},
+               {'Package': 'e', 'Version': '1.0', 'Depends': 'g (>= 2.0)'},
+               {'Package': 'f', 'Version': '1.0', 'Depends': 'g (>= 1.0)'},
+               {'Package': 'g', 'Version': '1.0'},
+               {'Package': 'mawk', 'Version': '1.3', 'Provides': 'awk'},
+               {'Package': 'original-awk', 'Version': '1.0', 'Provides': 'awk'}]
+
+    def test_resolve(self):
+        index = PackageIndex()
+        for stanza in self.stanzas:
+            index.add(stanza)
+        dep_tree = DepTree(recursive=True, index=index)
+        dep_tree.add('a')
+        # e cannot be installed, awk is provided by mawk
+        self.assertEqual(['a', 'b', 'c', 'f', 'g', 'mawk'], sorted(dep_tree.dependencies_by_package))
+        self.assertEqual('1.5', dep_tree.selected_packages['b']['Version'])
+        self.assertEqual(['b', 'f', 'mawk'], sorted(dep_tree.dependencies_by_package['a']))
+
+    def test_installed(self):
+        index = PackageIndex()
+        for stanza in self.stanzas:
+            index.add(stanza)
+        dep_tree = DepTree(recursive=True, index=index, local_packages={'original-awk': '1.0'},
+                           ignored_packages={'c': '1.0'})
+        dep_tree.add('a')
+        self.assertEqual(['a', 'b', 'f', 'g', 'original-awk'], sorted(dep_tree.dependencies_by_package))
+        self.assertRaises(ValueError, dep_tree.add, 'unknown')
+
+    def test_graph_store(self):
+        index = PackageIndex()
+        for stanza in self.stanzas:
+            index.add(stanza)
+        directory = tempfile.mkdtemp()
+        try:
+            graph_filename = os.path.join(directory, 'graph.json')
+            dep_tree = DepTree(recursive=True, index=index, graph_store=GraphStore(graph_filename))
+            dep_tree.add('a')
+            dep_tree.save_graph()
+            graph_store = GraphStore(graph_filename)
+            self.assertEqual(6, graph_store.load())
+            dep_tree = DepTree(recursive=True, index=index, graph_store=graph_store)
+            # all index entries are unchanged: the resolver is not required
+            with mock.patch('debtools.debdeptree.Resolver', side_effect=AssertionError):
+                dep_tree.add('a')
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(['a', 'b', 'c', 'f', 'g', 'mawk'], sorted(dep_tree.dependencies_by_package))
+        self.assertEqual('1.5', dep_tree.selected_packages['b']['Version'])
+        self.assertEqual('<< 2.0', str(dep_tree.dependencies_by_package['a']['b']))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import functools
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+from debtools.debdeptree import DepTree
+from debtools.download import AptGetDownloader, MirrorDownloader
+from debtools.index import DirectoryIndex
+from debtools.tests.tests_utils import build_test_deb
+
+__author__ = 'Matthieu Gallet'
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class TestMirrorDownloader(TestCase):
+    packages = {'a': 'b (>= 1.0), c', 'b': 'd', 'c': 'd (<< 2.0)', 'd': None}
+
+    def setUp(self):
+        self.mirror = tempfile.mkdtemp()
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.mirror, 'pool'))
+        stanzas = []
+        for package_name, depends in sorted(self.packages.items()):
+            control = 'Package: %s\nVersion: 1.0\n' % package_name
+            if depends:
+                control += 'Depends: %s\n' % depends
+            filename = os.path.join('pool', '%s_1.0_all.deb' % package_name)
+            os.rename(build_test_deb(self.mirror, control), os.path.join(self.mirror, filename))
+            with open(os.path.join(self.mirror, filename), 'rb') as fd:
+                content = fd.read()
+            stanzas.append('%sFilename: %s\nSize: %d\nSHA256: %s\n' %
+                           (control, filename, len(content), hashlib.sha256(content).hexdigest()))
+        # an older version, that must not be selected
+        stanzas.append('Package: d\nVersion: 0.9\nFilename: pool/missing.deb\n')
+        with gzip.open(os.path.join(self.mirror, 'Packages.gz'), 'wb') as fd:
+            fd.write('\n'.join(stanzas).encode('utf-8'))
+
+    def tearDown(self):
+        shutil.rmtree(self.mirror)
+        shutil.rmtree(self.directory)
+
+    def test_file_url(self):
+        downloader = MirrorDownloader('file://' + self.mirror, directory=self.directory)
+        filename = downloader.download('d')
+        self.assertEqual(os.path.join(self.directory, 'd_1.0_all.deb'), filename)
+        self.assertTrue(os.path.isfile(filename))
+        self.assertRaises(ValueError, downloader.download, 'unknown')
+        self.assertEqual(['d_1.0_all.deb'], os.listdir(self.directory))
+
+    def test_http_dep_tree(self):
+        handler = functools.partial(QuietHandler, directory=self.mirror)
+        server = HTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            downloader = MirrorDownloader('http://127.0.0.1:%d' % server.server_address[1])
+            dep_tree = DepTree(recursive=True, downloader=downloader, jobs=3)
+            dep_tree.add('a')
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(dep_tree.dependencies_by_package))
+        self.assertEqual(['a_1.0_all.deb', 'b_1.0_all.deb', 'c_1.0_all.deb', 'd_1.0_all.deb'],
+                         sorted(os.listdir(self.directory)))
+
+
+class TestAptGetDownloader(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bin_dir = tempfile.mkdtemp()
+        # fake apt-get: creates `package_1.0_all.deb` in the current dir
+        apt_get = os.path.join(self.bin_dir, 'apt-get')
+        with open(apt_get, 'w') as fd:
+            fd.write('#!/bin/sh\necho deb > "${2%%=*}_1.0_all.deb"\n')
+        os.chmod(apt_get, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.bin_dir)
+
+    def test_download(self):
+        # a file that is not named like apt-get does must not be read again
+        with open(os.path.join(self.directory, 'other.deb'), 'w') as fd:
+            fd.write('invalid')
+        read_files = []
+        directory_index = DirectoryIndex(self.directory, get_control_data=lambda x: read_files.append(x) or {})
+        directory_index.refresh()
+        downloader = AptGetDownloader(self.directory, directory_index=directory_index)
+        with mock.patch.dict(os.environ, {'PATH': self.bin_dir + os.pathsep + os.environ['PATH']}):
+            for package_name in ('a', 'b', 'a'):
+                downloader.download(package_name)
+        self.assertEqual([os.path.join(self.directory, 'other.deb')], read_files)
+        self.assertEqual(os.path.join(self.directory, 'b_1.0_all.deb'), directory_index.get('b'))
+        self.assertEqual(['a_1.0_all.deb', 'b_1.0_all.deb', 'other.deb'], sorted(os.listdir(self.directory)))
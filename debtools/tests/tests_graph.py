@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from debtools.graph import DependencyGraph, GraphStore
+from debtools.versions import VersionRange
+
+__author__ = 'Matthieu Gallet'
+
+
+class TestDependencyGraph(TestCase):
+    # libc6 and libgcc1 depend on each other, like Pre-Depends loops of real archives
+    dependencies = {'bash': {'libc6': [('>=', '2.15')], 'base-files': []},
+                    'libc6': {'libgcc1': []},
+                    'libgcc1': {'libc6': [('>=', '2.2.5')], 'gcc-base': [('=', '4.7.2-5')]},
+                    'gcc-base': {}}
+
+    def get_graph(self):
+        return DependencyGraph.from_dependencies({x: {z: VersionRange(t) for (z, t) in y.items()}
+                                                  for (x, y) in self.dependencies.items()})
+
+    def test_queries(self):
+        graph = self.get_graph()
+        self.assertEqual(5, len(graph))
+        self.assertEqual(['bash', 'libgcc1'], graph.reverse_dependencies('libc6'))
+        self.assertEqual({'gcc-base', 'libc6', 'libgcc1'}, graph.closure(['libc6']))
+        self.assertEqual({'bash', 'gcc-base', 'libc6', 'libgcc1'}, graph.closure(['gcc-base'], reverse=True))
+        self.assertEqual([['libc6', 'libgcc1']], graph.cycles())
+        order = graph.topological_order()
+        self.assertEqual('bash', order[-1])
+        self.assertLess(order.index('gcc-base'), order.index('libgcc1'))
+        # the empty constraint is stored once
+        self.assertEqual(4, len(graph.constraints))
+
+    def test_output(self):
+        graph = self.get_graph()
+        dot = list(graph.iter_dot())
+        self.assertEqual('digraph "dependencies" {', dot[0])
+        self.assertIn('  "base-files" [style=dashed];', dot)
+        self.assertIn('  "bash" -> "libc6" [label=">= 2.15"];', dot)
+        documents = [json.loads(x) for x in graph.iter_jsonl()]
+        self.assertEqual({'package': 'libgcc1', 'resolved': True, 'depends': {'libc6': '>= 2.2.5',
+                                                                                'gcc-base': '= 4.7.2-5'}},
+                         [x for x in documents if x['package'] == 'libgcc1'][0])
+
+
+class TestGraphStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        filename = os.path.join(self.directory, 'graph.json')
+        store = GraphStore(filename)
+        self.assertEqual(0, store.load())
+        store.update({'a': {'b': VersionRange([('>=', '1.0')]), 'c': VersionRange()}},
+                     {'a': ['index', 'a', '1.0', 'sha']})
+        store.save()
+        store = GraphStore(filename)
+        self.assertEqual(1, store.load())
+        package_name, dependencies = store.lookup(['index', 'a', '1.0', 'sha'])
+        self.assertEqual('a', package_name)
+        self.assertEqual({'b': '>= 1.0', 'c': ''}, {x: str(y) for (x, y) in dependencies.items()})
+        self.assertIsNone(store.lookup(['index', 'a', '1.1', 'sha']))
+
+    def test_invalid_files(self):
+        filename = os.path.join(self.directory, 'graph.json')
+        # truncated content, missing packages, invalid types
+        for content in ('{"version": %d}',
+                        '{"version": %d, "packages": [], "constraints": [], "offsets": [0], "targets": [], '
+                        '"edge_constraints": [], "sources": [["index", "a", "1.0", "sha"]]}',
+                        '{"version": %d, "packages": 1, "constraints": [], "offsets": [], "targets": [], '
+                        '"edge_constraints": [], "sources": [1]}'):
+            with open(filename, 'w') as fd:
+                fd.write(content % GraphStore.FORMAT_VERSION)
+            self.assertEqual(0, GraphStore(filename).load())
+        # the temporary file is removed when the graph cannot be written
+        store = GraphStore(filename)
+        store.update({'a': {}}, {'a': ['index', 'a', '1.0', 'sha']})
+        with mock.patch('debtools.graph.os.rename', side_effect=OSError):
+            self.assertRaises(OSError, store.save)
+        self.assertEqual(['graph.json'], os.listdir(self.directory))
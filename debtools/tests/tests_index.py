@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+from unittest import TestCase
+
+from debtools.index import PackageIndex
+
+__author__ = 'Matthieu Gallet'
+
+
+class TestPackageIndex(TestCase):
+    packages = b"""Package: a
+Version: 1.0
+Architecture: amd64
+
+Package: a
+Version: 1.0
+Architecture: amd64
+Filename: pool/other/a_1.0_amd64.deb
+
+Package: a
+Version: 1.0
+Architecture: i386
+
+Package: b
+Version: x:1.0
+
+Package: c
+Version: 2.0
+Architecture: all
+"""
+
+    def test_load(self):
+        index = PackageIndex()
+        index.load_fileobj(io.BytesIO(self.packages))
+        # the same version is kept for each architecture, the first loaded stanza being kept
+        self.assertEqual([('1.0', 'amd64', None), ('1.0', 'i386', None)],
+                         [(x['Version'], x['Architecture'], x.get('Filename')) for x in index.packages['a']])
+        # invalid stanzas are skipped without stopping the load
+        self.assertNotIn('b', index)
+        self.assertEqual('2.0', index.get('c')['Version'])
+        index = PackageIndex(architectures=['i386'])
+        index.load_fileobj(io.BytesIO(self.packages))
+        self.assertEqual(['i386'], [x['Architecture'] for x in index.packages['a']])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import codecs
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import TestCase
+
+from debtools.pydeb import build_python_deb, find_wheel, install_to_root, install_wheel, is_pure_python, \
+    parse_requirement
+from debtools.utils import get_control_members
+
+__author__ = 'Matthieu Gallet'
+
+SETUP_PY = """from setuptools import setup
+setup(name='Foo_Bar', version='1.2', packages=['foo'], description='Foo summary', author='A B', author_email='a@b.c',
+      install_requires=['six>=1.4', 'Django (>=1.8,<1.9)', 'mock; python_version < "3"'],
+      extras_require={'tests': ['pytest']})
+"""
+
+
+class TestPythonDeb(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.directory, 'Foo_Bar-1.2')
+        os.makedirs(os.path.join(self.source_dir, 'foo'))
+        for name, content in (('setup.py', SETUP_PY), ('foo/__init__.py', '')):
+            with codecs.open(os.path.join(self.source_dir, name), 'w', encoding='utf-8') as fd:
+                fd.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_requirement(self):
+        self.assertEqual('python3-six', parse_requirement('six', 3))
+        self.assertEqual('python-zope.interface (>= 4.0), python-zope.interface (<< 4.0+)',
+                         parse_requirement('zope.interface[tests] (==4.0)', 2))
+        self.assertEqual('python3-django (>= 1.8), python3-django (<< 2)', parse_requirement('django~=1.8', 3))
+        self.assertEqual('python3-foo (>= 1.0+), python3-foo (<< 2.0+)', parse_requirement('foo>1.0,<=2.0', 3))
+
+    def test_build(self):
+        root = os.path.join(self.directory, 'root')
+        with io.open(os.path.join(self.directory, 'log'), 'w') as output:
+            install_to_root(self.source_dir, root, output=output, python_major=3)
+        self.assertTrue(is_pure_python(root))
+        filename = build_python_deb(root, self.directory, options={'depends3': 'libfoo', 'section': 'misc'},
+                                    python_major=3)
+        self.assertEqual(os.path.join(self.directory, 'python3-foo-bar_1.2-1_all.deb'), filename)
+        members = get_control_members(filename, names=('control', 'md5sums'))
+        control = members['control']
+        self.assertEqual('1.2-1', control['Version'])
+        self.assertEqual('misc', control['Section'])
+        self.assertEqual('A B <a@b.c>', control['Maintainer'])
+        self.assertEqual({'python3', 'python3-django (<< 1.9)', 'python3-django (>= 1.8)', 'python3-six (>= 1.4)',
+                          'libfoo'}, set(control['Depends'].split(', ')))
+        self.assertIn(b'  usr/lib/python3/dist-packages/foo/__init__.py\n', members['md5sums'])
+
+
+class TestWheel(TestCase):
+    members = (('foo/__init__.py', 'def main():\n    pass\n'),
+               ('Foo_Bar-1.2.data/scripts/foo-script', '#!python\nprint(1)\n'),
+               ('Foo_Bar-1.2.data/scripts/foo-gui', '#!pythonw\nprint(2)\n'),
+               ('Foo_Bar-1.2.dist-info/METADATA', 'Metadata-Version: 2.1\nName: Foo_Bar\nVersion: 1.2\n'
+                                                  'Summary: Foo summary\nRequires-Dist: six (>=1.4)\n'
+                                                  'Requires-Dist: pytest ; extra == "tests"\n\nLong text\n'),
+               ('Foo_Bar-1.2.dist-info/entry_points.txt', '[console_scripts]\nfoo = foo:main\n'))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wheelhouse = os.path.join(self.directory, 'wheelhouse')
+        os.mkdir(self.wheelhouse)
+        for basename in ('Foo_Bar-1.2-py2.py3-none-any.whl', 'Foo_Bar-1.2-cp27-cp27mu-linux_armv7l.whl',
+                         'foo_bar-1.3-py3-none-any.whl'):
+            with zipfile.ZipFile(os.path.join(self.wheelhouse, basename), 'w') as zip_file:
+                for name, content in self.members:
+                    zip_file.writestr(name, content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_wheel(self):
+        self.assertEqual(os.path.join(self.wheelhouse, 'Foo_Bar-1.2-cp27-cp27mu-linux_armv7l.whl'),
+                         find_wheel([self.wheelhouse], 'foo-bar', '1.2', [('cp27', 'cp27mu', 'linux_armv7l'),
+                                                                          ('py2', 'none', 'any')]))
+        self.assertEqual(os.path.join(self.wheelhouse, 'Foo_Bar-1.2-py2.py3-none-any.whl'),
+                         find_wheel([self.wheelhouse], 'foo-bar', '1.2', [('py3', 'none', 'any')]))
+        self.assertIsNone(find_wheel([self.wheelhouse], 'foo-bar', '1.4', [('py3', 'none', 'any')]))
+
+    def test_build(self):
+        root = os.path.join(self.directory, 'root')
+        install_wheel(os.path.join(self.wheelhouse, 'Foo_Bar-1.2-py2.py3-none-any.whl'), root, python_major=3)
+        self.assertTrue(is_pure_python(root))
+        with open(os.path.join(root, 'usr', 'bin', 'foo-script'), 'rb') as fd:
+            self.assertEqual(b'#!/usr/bin/python3\nprint(1)\n', fd.read())
+        with open(os.path.join(root, 'usr', 'bin', 'foo-gui'), 'rb') as fd:
+            self.assertEqual(b'#!/usr/bin/python3\nprint(2)\n', fd.read())
+        with open(os.path.join(root, 'usr', 'bin', 'foo'), 'rb') as fd:
+            self.assertIn(b'from foo import main\n', fd.read())
+        filename = build_python_deb(root, self.directory, python_major=3, architecture='amd64',
+                                    depends=['python3 (>= 3.6~)', 'python3 (<< 3.7)'])
+        control = get_control_members(filename, names=('control', ))['control']
+        self.assertEqual('python3-foo-bar', control['Package'])
+        self.assertEqual('amd64', control['Architecture'])
+        self.assertEqual('python3, python3 (>= 3.6~), python3 (<< 3.7), python3-six (>= 1.4)', control['Depends'])
+        self.assertEqual('Foo summary\nLong text', control['Description'])
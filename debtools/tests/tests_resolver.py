@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from unittest import TestCase
+
+from debtools.index import PackageIndex
+from debtools.resolver import Resolver, ResolutionError
+from debtools.utils import parse_relationships
+
+__author__ = 'Matthieu Gallet'
+
+
+class TestResolver(TestCase):
+    stanzas = [{'Package': 'x', 'Version': '1', 'Depends': 'p | q, r'},
+               {'Package': 'p', 'Version': '1', 'Depends': 's (>= 2)'},
+               {'Package': 'q', 'Version': '1', 'Depends': 'mail-transport-agent (>= 4)'},
+               {'Package': 'r', 'Version': '1', 'Pre-Depends': 's (<< 2)'},
+               {'Package': 's', 'Version': '1'},
+               {'Package': 's', 'Version': '2'},
+               {'Package': 'exim4', 'Version': '4.90', 'Provides': 'mail-transport-agent (= 4.90)'},
+               {'Package': 'postfix', 'Version': '3.3', 'Provides': 'mail-transport-agent'}]
+
+    def get_index(self):
+        index = PackageIndex()
+        for stanza in self.stanzas:
+            index.add(stanza)
+        return index
+
+    def test_backtrack(self):
+        resolver = Resolver(self.get_index())
+        selected = resolver.resolve(['x'])
+        # p requires s 2 but r requires s 1: q is selected instead of p
+        self.assertEqual(['exim4', 'q', 'r', 's', 'x'], sorted(selected))
+        self.assertEqual('1', selected['s']['Version'])
+        self.assertEqual(1, resolver.backtracks)
+        # postfix does not provide a version of mail-transport-agent
+        self.assertEqual({'exim4': ''}, {x: str(y) for (x, y) in resolver.get_dependencies(selected['q']).items()})
+        self.assertEqual({'q': '', 'r': ''}, {x: str(y) for (x, y) in resolver.get_dependencies(selected['x']).items()})
+
+    def test_ignored(self):
+        resolver = Resolver(self.get_index(), ignored={'s': '1'})
+        # the dependency of r is satisfied by the ignored package, s 2 is selected as an upgrade for p
+        selected = resolver.resolve(['x'])
+        self.assertEqual(['p', 'r', 's', 'x'], sorted(selected))
+        self.assertEqual('2', selected['s']['Version'])
+        selected = Resolver(self.get_index(), ignored={'s': '1'}).resolve(['p'])
+        self.assertEqual(['p', 's'], sorted(selected))
+        self.assertEqual('2', selected['s']['Version'])
+
+    def test_installed(self):
+        index = self.get_index()
+        index.add({'Package': 'z', 'Version': '1', 'Depends': 's'})
+        # the installed version is preferred to the highest one
+        self.assertEqual('1', Resolver(index, installed={'s': '1'}).resolve(['z'])['s']['Version'])
+        self.assertEqual('2', Resolver(index).resolve(['z'])['s']['Version'])
+        # s 2 is required by p: the installed version is upgraded
+        self.assertEqual('2', Resolver(index, installed={'s': '1'}).resolve(['p'])['s']['Version'])
+
+    def test_provides(self):
+        index = self.get_index()
+        index.add({'Package': 'exim4', 'Version': '4.80', 'Provides': 'mail-transport-agent (= 3.0)'})
+        index.add({'Package': 'y', 'Version': '1', 'Depends': 'mail-transport-agent (>= 4)'})
+        # exim4 4.80 does not provide the required version
+        self.assertEqual(['4.90'], [x['Version'] for x in Resolver(index).candidates(
+            parse_relationships('mail-transport-agent (>= 4)')[0])])
+        # the installed exim4 4.80 is upgraded
+        self.assertEqual('4.90', Resolver(index, installed={'exim4': '4.80'}).resolve(['y'])['exim4']['Version'])
+
+    def test_unsatisfiable(self):
+        self.assertRaises(ResolutionError, Resolver(self.get_index()).resolve, ['r', 'p'])
+        self.assertRaises(ResolutionError, Resolver(self.get_index()).resolve, ['unknown'])
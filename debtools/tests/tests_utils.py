@@ -1,12 +1,50 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import gc
+import io
+import os
+import shutil
+import tarfile
+import tempfile
 from unittest import TestCase
+import warnings
 import pkg_resources
-from debtools.utils import get_control_data
+try:
+    import lzma
+except ImportError:
+    from backports import lzma
+
+from debtools.utils import get_control_data, get_control_data_many, get_control_members, build_deb, iter_deb822_file, \
+    parse_dpkg_status, parse_relationships, parse_deps, Relation
 
 __author__ = 'Matthieu Gallet'
 
 
+def build_test_deb(directory, control, compression='gz', extra_members=None):
+    """Create a minimal `.deb` file in `directory` and return its path
+
+    :param control: content of the `control` file
+    :param compression: compression of the control archive ('gz', 'xz', 'bz2' or '' for no compression)
+    :param extra_members: dict {name: content} of other files to add to the control archive
+    """
+    members = [('./control', control)] + sorted((extra_members or {}).items())
+    control_tar = os.path.join(directory, 'control.tar' + ('.' + compression if compression else ''))
+    with tarfile.open(control_tar, mode='w:' + compression) as tar_file:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            content = content.encode('utf-8')
+            info.size = len(content)
+            tar_file.addfile(info, io.BytesIO(content))
+    data_tar = os.path.join(directory, 'data.tar.gz')
+    with tarfile.open(data_tar, mode='w:gz'):
+        pass
+    filename = os.path.join(directory, 'test_%s.deb' % compression)
+    build_deb(filename, control_tar, data_tar, reproducible=True)
+    os.remove(control_tar)
+    os.remove(data_tar)
+    return filename
+
+
 class TestGetControlData(TestCase):
 
     @property
@@ -30,3 +68,133 @@ class TestGetControlData(TestCase):
             },
             data
         )
+
+
+class TestCompressedControlData(TestCase):
+    control = 'Package: foo\nVersion: 1.0-1\nDescription: test\n long\n description\n'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compressions(self):
+        for compression in ('gz', 'xz', 'bz2', ''):
+            filename = build_test_deb(self.directory, self.control, compression=compression)
+            self.assertEqual({'Package': 'foo', 'Version': '1.0-1', 'Description': 'test\nlong\ndescription'},
+                             get_control_data(filename))
+
+    def test_control_members(self):
+        filename = build_test_deb(self.directory, self.control, compression='xz',
+                                  extra_members={'./md5sums': 'abcd  usr/bin/foo\n', './postinst': '#!/bin/sh\n'})
+        members = get_control_members(filename, names=('control', 'md5sums', 'postinst', 'conffiles'))
+        self.assertEqual({'control', 'md5sums', 'postinst'}, set(members))
+        self.assertEqual('foo', members['control']['Package'])
+        self.assertEqual(b'abcd  usr/bin/foo\n', members['md5sums'])
+        self.assertEqual({'control', 'md5sums', 'postinst'}, set(get_control_members(filename, names=None)))
+
+    def test_invalid_files(self):
+        filenames = []
+        for index, (name, content) in enumerate((('control.tar.gz', b'\x1f\x8bgarbage'),
+                                                  ('control.tar.xz', b'\xfd7zXZ\x00garbage'),
+                                                  ('control.tar', b'garbage' * 100), ('other', b''))):
+            control_tar, data_tar = os.path.join(self.directory, name), os.path.join(self.directory, 'data.tar')
+            for filename, data in ((control_tar, content), (data_tar, b'')):
+                with open(filename, 'wb') as fd:
+                    fd.write(data)
+            filenames.append(os.path.join(self.directory, '%d.deb' % index))
+            if name == 'other':
+                with open(filenames[-1], 'wb') as fd:
+                    fd.write(b'not an archive')
+            else:
+                build_deb(filenames[-1], control_tar, data_tar)
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always', ResourceWarning)
+            for filename in filenames:
+                self.assertRaises(Exception, get_control_members, filename)
+            gc.collect()
+        # all files and maps are closed, even on errors
+        self.assertEqual([], [x for x in caught_warnings if issubclass(x.category, ResourceWarning)])
+
+    def test_control_data_many(self):
+        filenames = []
+        for index in range(6):
+            filename = os.path.join(self.directory, 'package_%d.deb' % index)
+            os.rename(build_test_deb(self.directory, 'Package: p%d\nVersion: 1.0\n' % index), filename)
+            filenames.append(filename)
+        invalid_filename = os.path.join(self.directory, 'invalid.deb')
+        with open(invalid_filename, 'wb') as fd:
+            fd.write(b'not an archive')
+        filenames.insert(3, invalid_filename)
+        for workers in (1, 3):
+            results = list(get_control_data_many(filenames, workers=workers))
+            self.assertEqual(filenames, [x[0] for x in results])
+            self.assertEqual(['p0', 'p1', 'p2', None, 'p3', 'p4', 'p5'],
+                             [x[1]['Package'] if x[1] else None for x in results])
+            self.assertEqual([invalid_filename], [x[0] for x in results if x[2] is not None])
+        # unordered results
+        results = list(get_control_data_many(filenames, workers=3, ordered=False))
+        self.assertEqual(sorted(filenames), sorted(x[0] for x in results))
+        self.assertEqual([invalid_filename], [x[0] for x in results if x[2] is not None])
+
+
+class TestDeb822(TestCase):
+    content = ('Package: foo\nVersion: 1.0-1\nDescription: test\n long\n .\n description\n\n'
+               'Package: bar\nVersion: 2.0\nDepends: foo\n')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_iter_deb822_file(self):
+        for filename, open_function in (('Packages', open), ('Packages.xz', lzma.open)):
+            filename = os.path.join(self.directory, filename)
+            with open_function(filename, 'wb') as fd:
+                fd.write(self.content.encode('utf-8'))
+            self.assertEqual([{'Package': 'foo', 'Version': '1.0-1', 'Description': 'test\nlong\n.\ndescription'},
+                              {'Package': 'bar', 'Version': '2.0', 'Depends': 'foo'}],
+                             list(iter_deb822_file(filename)))
+            self.assertEqual([{'Package': 'foo'}, {'Package': 'bar', 'Depends': 'foo'}],
+                             list(iter_deb822_file(filename, fields=('Package', 'Depends'))))
+
+    def test_parse_dpkg_status(self):
+        status = io.StringIO('Package: libc6\nStatus: install ok installed\nArchitecture: amd64\nVersion: 2.36-9\n\n'
+                             'Package: removed\nStatus: deinstall ok config-files\nVersion: 1.0\n\n'
+                             'Package: debconf\nStatus: install ok installed\nArchitecture: all\nVersion: 1.5.82\n'
+                             'Provides: debconf-2.0, debconf-tiny (= 1.5)\n')
+        installed_packages = parse_dpkg_status(status)
+        self.assertEqual(['debconf', 'libc6'], sorted(installed_packages))
+        self.assertEqual('2.36-9', str(installed_packages['libc6']))
+        self.assertEqual('amd64', installed_packages.architectures['libc6'])
+        self.assertEqual([('debconf', None)], installed_packages.provides['debconf-2.0'])
+        self.assertEqual('1.5', str(installed_packages.provides['debconf-tiny'][0][1]))
+
+
+class TestRelationships(TestCase):
+
+    def test_parse_relationships(self):
+        relations = parse_relationships('python3:any (>= 3.5~), foo [amd64 !i386] <!nocheck> <stage1 cross>, '
+                                        'bar (<= 1.0) | baz')
+        self.assertEqual(3, len(relations))
+        self.assertEqual((Relation('python3', 'any', ('>=', '3.5~'), (), ()), ), relations[0])
+        self.assertEqual((Relation('foo', None, None, ('amd64', '!i386'), (('!nocheck', ), ('stage1', 'cross'))), ),
+                         relations[1])
+        self.assertEqual(['bar', 'baz'], [x.name for x in relations[2]])
+        self.assertIs(relations, parse_relationships('python3:any (>= 3.5~), foo [amd64 !i386] <!nocheck> '
+                                                     '<stage1 cross>, bar (<= 1.0) | baz'))
+        # invalid alternatives are skipped, without stopping the parsing of the whole field
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            relations = parse_relationships('foo (>= ), ${misc:Depends}, bar | baz (= x:1), qux')
+        self.assertEqual([['bar'], ['qux']], [[x.name for x in y] for y in relations])
+        self.assertEqual(3, len(caught_warnings))
+
+    def test_parse_deps(self):
+        dep_string = 'python (>= 2.7), python (<< 2.8), libc6:any, debconf (>= 0.5) | debconf-2.0'
+        self.assertEqual(['python', 'libc6'], list(parse_deps(dep_string)))
+        self.assertEqual('>= 2.7, << 2.8', str(parse_deps(dep_string)['python']))
+        self.assertEqual(['python', 'libc6', 'debconf-2.0'],
+                         list(parse_deps(dep_string, local_packages={'debconf-2.0': '1.0'})))
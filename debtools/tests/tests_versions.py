@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from unittest import TestCase
+
+from debtools.versions import DebianVersion, get_version, sort_versions, VersionRange
+
+__author__ = 'Matthieu Gallet'
+
+
+class TestDebianVersion(TestCase):
+
+    def test_dpkg_ordering(self):
+        ordered_versions = ['1.0~~', '1.0~rc1', '1.0', '1.0-1~bpo1', '1.0-1', '1.0-1.1', '1.0a', '1.0+dfsg',
+                            '1.0.1', '1.2', '1.10', '2.13-38+deb7u8', '1:0.1']
+        for index, version in enumerate(ordered_versions):
+            for other_version in ordered_versions[index + 1:]:
+                self.assertLess(DebianVersion(version), DebianVersion(other_version))
+                self.assertGreater(DebianVersion(other_version), DebianVersion(version))
+        self.assertEqual(ordered_versions, sort_versions(reversed(ordered_versions)))
+
+    def test_equivalent_versions(self):
+        self.assertEqual(DebianVersion('1.0'), DebianVersion('0:1.0'))
+        self.assertEqual(DebianVersion('1.0'), DebianVersion('1.00'))
+        self.assertEqual(DebianVersion('1.0-0'), '1.0')
+        self.assertEqual(hash(DebianVersion('1.0')), hash(DebianVersion('0:1.0')))
+
+    def test_parts(self):
+        version = DebianVersion('2:1.0-2-1ubuntu1')
+        self.assertEqual((2, '1.0-2', '1ubuntu1'), (version.epoch, version.upstream, version.revision))
+        self.assertRaises(ValueError, DebianVersion, 'a:1.0')
+
+    def test_get_version(self):
+        self.assertIs(get_version('3.0-1'), get_version('3.0-1'))
+        version = DebianVersion('3.0-1')
+        self.assertIs(version, get_version(version))
+
+    def test_invalid_comparisons(self):
+        version = DebianVersion('1.0')
+        for other in ('', 'a:1.0', None):
+            self.assertFalse(version == other)
+            self.assertTrue(version != other)
+        self.assertRaises(TypeError, lambda: version < '')
+        self.assertRaises(TypeError, lambda: version >= None)
+        self.assertTrue(version < '1.0-1')
+
+
+class TestVersionRange(TestCase):
+
+    def test_interval(self):
+        version_range = VersionRange([('>=', '2.7'), ('<<', '2.8')])
+        self.assertEqual(['2.7', '2.7.12'], version_range.filter(['2.6', '2.7', '2.7.12', '2.8', '3.5']))
+        self.assertEqual('2.7.12', version_range.best(['2.6', '2.7', '2.7.12', '2.8']))
+        self.assertFalse(version_range.is_empty())
+        self.assertTrue(VersionRange([('>>', '2.8'), ('<<', '2.8')]).is_empty())
+
+    def test_operators(self):
+        for op, satisfied in (('<<', [1]), ('<=', [1, 2]), ('=', [2]), ('>=', [2, 3]), ('>>', [3]),
+                              ('!=', [1, 3])):
+            version_range = VersionRange([(op, '2.0')])
+            self.assertEqual(['%s.0' % x for x in satisfied], version_range.filter(['1.0', '2.0', '3.0']))
+        self.assertTrue(VersionRange().satisfied_by('1.0'))
+        self.assertRaises(ValueError, VersionRange, [('~=', '1.0')])
@@ -1,19 +1,51 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-from distutils.version import LooseVersion
+import bz2
+import codecs
+from collections import namedtuple
+from contextlib import closing
+from functools import lru_cache
+import gzip
 import io
+import os
 import re
 import tarfile
+import time
+import warnings
 
 try:
     import lzma
 except ImportError:
     from backports import lzma
 
-from debtools.ar import ArFile
+try:
+    # Python 3.14+
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+from debtools.ar import ArFile, ArInfo
+from debtools.versions import get_version, VersionRange
 
 __author__ = 'Matthieu Gallet'
 
+DPKG_STATUS_FILE = '/var/lib/dpkg/status'
+DPKG_LINE_RE = re.compile(r'^ii\s+([^\s]+)\s+([^\s]+)\s+([^\s]+)\s+.*$')
+RELATION_RE = re.compile(r'''^(?P<name>[a-zA-Z0-9][a-zA-Z0-9+.\-]*)
+                             (?::(?P<arch_qualifier>[a-zA-Z0-9][a-zA-Z0-9\-]*))?\s*
+                             (?:\(\s*(?P<op><<|<=|=|>=|>>|<|>)\s*(?P<version>[a-zA-Z0-9][^\s)]*)\s*\))?\s*
+                             (?:\[(?P<architectures>[^\]]*)\])?\s*
+                             (?P<profiles>(?:<[^>]*>\s*)*)$''', re.VERBOSE)
+
+# a single package in a relationship field, like `python3:any (>= 3.5) [amd64] <!nocheck>`:
+#  * `constraint` is `None` or `(operator, DebianVersion)`,
+#  * `architectures` is a tuple of architectures (like 'amd64' or '!i386'),
+#  * `profiles` is a tuple of restriction formulas, each one being a tuple of terms (like 'nocheck' or '!stage1').
+Relation = namedtuple('Relation', ['name', 'arch_qualifier', 'constraint', 'architectures', 'profiles'])
+
 
 def parse_control_data(control_data, continue_line=' ', split=': ', skip_after_blank=False):
     """ Parse a debian control file
@@ -31,37 +63,143 @@ def parse_control_data(control_data, continue_line=' ', split=': ', skip_after_b
     """
     offset = len(continue_line)
     result_data = {}
-    key, value = None, None
-    description = ''
+    key, value_lines = None, None
+    description_lines = []
     add_to_description = False
     for line in control_data.splitlines():
         if not line.split() and skip_after_blank:
             add_to_description = True
         if add_to_description:
-            description += "\n"
-            description += line
+            description_lines.append(line)
             continue
         if not line or line[0:offset] == continue_line:
             if key is not None:
-                value += "\n"
-                value += line[offset:]
+                value_lines.append(line[offset:])
         else:
             if key is not None:
-                result_data[key] = value
+                result_data[key] = '\n'.join(value_lines)
             key, value = line.split(split, 1)
-            value = value.lstrip()
+            value_lines = [value.lstrip()]
     if key is not None:
-        result_data[key] = value
+        result_data[key] = '\n'.join(value_lines)
     if add_to_description:
-        result_data['description'] = description
+        result_data['description'] = '\n' + '\n'.join(description_lines)
     return result_data
 
 
+def iter_deb822(fileobj, fields=None):
+    """ Parse a multi-stanza deb822 file (like `Packages` indexes or `/var/lib/dpkg/status`), line by line.
+    Only one stanza is kept in memory.
+
+    >>> list(iter_deb822(io.StringIO("Package: a\\nVersion: 1\\n\\nPackage: b\\nVersion: 2\\n"), fields=('Package', )))
+    [{'Package': 'a'}, {'Package': 'b'}]
+
+    :param fileobj: file object, in text or binary (UTF-8) mode
+    :param fields: if not `None`, only these fields are returned (other ones are skipped without being built)
+    :type fields: :class:`tuple`
+    :return: iterator on dicts, one per stanza
+    :rtype: :class:`generator`
+    """
+    wanted_fields = set(fields) if fields is not None else None
+    stanza = {}
+    key, value_lines = None, None
+    for line in fileobj:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.rstrip('\r\n')
+        if not line or line.isspace():
+            # end of stanza
+            if value_lines is not None:
+                stanza[key] = '\n'.join(value_lines)
+            key, value_lines = None, None
+            if stanza:
+                yield stanza
+                stanza = {}
+            continue
+        first_char = line[0]
+        if first_char == ' ' or first_char == '\t':
+            if value_lines is not None:
+                value_lines.append(line[1:])
+            continue
+        elif first_char == '#':
+            continue
+        if value_lines is not None:
+            stanza[key] = '\n'.join(value_lines)
+        key, __, value = line.partition(':')
+        value_lines = [value.strip()] if wanted_fields is None or key in wanted_fields else None
+    if value_lines is not None:
+        stanza[key] = '\n'.join(value_lines)
+    if stanza:
+        yield stanza
+
+
+def iter_deb822_file(filename, fields=None):
+    """ Parse a multi-stanza deb822 file, that can be compressed (like `Packages.xz` or `Packages.gz`).
+    See :func:`iter_deb822`.
+
+    :param filename: path of the file
+    :type filename: :class:`str`
+    :param fields: if not `None`, only these fields are returned
+    :type fields: :class:`tuple`
+    :rtype: :class:`generator`
+    """
+    with open(filename, 'rb') as fileobj:
+        uncompressed_file = open_decompressed(fileobj, name=filename)
+        try:
+            for stanza in iter_deb822(uncompressed_file, fields=fields):
+                yield stanza
+        finally:
+            uncompressed_file.close()
+
+
+@lru_cache(maxsize=65536)
+def parse_relationships(dep_string):
+    """ Parse a relationship field (`Depends`, `Pre-Depends`, `Build-Depends`, ...) in a single pass.
+    Results are cached, since the same fields are repeated in many packages.
+    Invalid alternatives (like an unexpanded `${misc:Depends}`) are skipped with a warning.
+
+    >>> parse_relationships("libc6 (>= 2.7), debconf (>= 0.5) | debconf-2.0")[1]
+    (Relation(name='debconf', arch_qualifier=None, constraint=('>=', DebianVersion('0.5')), architectures=(), \
+profiles=()), Relation(name='debconf-2.0', arch_qualifier=None, constraint=None, architectures=(), profiles=()))
+
+    :param dep_string: value of the field
+    :type dep_string: :class:`str`
+    :return: tuple of relations; each relation is a tuple of alternatives (:class:`Relation`)
+    :rtype: :class:`tuple`
+    """
+    relations = []
+    for relation_str in dep_string.split(','):
+        relation_str = relation_str.strip()
+        if not relation_str:
+            continue
+        alternatives = []
+        for alternative_str in relation_str.split('|'):
+            matcher = RELATION_RE.match(alternative_str.strip())
+            constraint = None
+            try:
+                if not matcher:
+                    raise ValueError('invalid relationship %r' % alternative_str.strip())
+                if matcher.group('op'):
+                    constraint = (matcher.group('op'), get_version(matcher.group('version')))
+            except ValueError as e:
+                warnings.warn('%s: ignored' % e)
+                continue
+            architectures = tuple((matcher.group('architectures') or '').split())
+            profiles = tuple(tuple(x.split()) for x in re.findall(r'<([^>]*)>', matcher.group('profiles')))
+            alternatives.append(Relation(matcher.group('name'), matcher.group('arch_qualifier'), constraint,
+                                         architectures, profiles))
+        if alternatives:
+            relations.append(tuple(alternatives))
+    return tuple(relations)
+
+
 def parse_deps(dep_string, local_packages=None):
-    """Parse the dependencies of a `.deb` package and return a dict, whose keys are packages names and values are a list of version constraints
+    """Parse the dependencies of a `.deb` package and return a dict, whose keys are packages names and values are
+    a list of version constraints
 
-     >>> parse_deps("python (>= 2.7), python (<< 2.8), python-stdeb, python-backports.lzma")
-     {u'python': [(u'>=', LooseVersion ('2.7')), (u'<<', LooseVersion ('2.8'))], u'python-stdeb': [], u'python-backports.lzma': []}
+     >>> deps = parse_deps("python (>= 2.7), python (<< 2.8), python-stdeb, python-backports.lzma")
+     >>> sorted(deps), deps['python'], deps['python-stdeb']
+     (['python', 'python-backports.lzma', 'python-stdeb'], VersionRange('>= 2.7, << 2.8'), VersionRange(''))
 
     Choices between two packages are ignored.
 
@@ -73,33 +211,43 @@ def parse_deps(dep_string, local_packages=None):
     :rtype: :class:`dict`
     """
     deps = {}
-    for dep_info in dep_string.split(','):
-        dep_info = dep_info.strip()
-        if '|' in dep_info and local_packages is None:
+    for alternatives in parse_relationships(dep_string):
+        if len(alternatives) > 1 and local_packages is None:
             continue
-        elif '|' in dep_info:
-            for sub_dep_info in dep_info.split('|'):
-                sub_dep_info, __, __ = sub_dep_info.partition('(')
-                if sub_dep_info.strip() in local_packages:
-                    dep_info = sub_dep_info.strip()
+        elif len(alternatives) > 1:
+            for relation in alternatives:
+                if relation.name in local_packages:
                     break
             else:
                 continue
-        matcher = re.match('^(.*)\s+\((>=|<<|>>|==|>=|=)\s+(.*)\)$', dep_info)
-        if matcher:
-            package_name = matcher.group(1)
-            constraint_type = matcher.group(2)
-            contraint_value = matcher.group(3)
-            deps.setdefault(package_name, []).append((constraint_type, LooseVersion(contraint_value)))
         else:
-            deps.setdefault(dep_info, [])
+            relation = alternatives[0]
+        version_range = deps.setdefault(relation.name, VersionRange())
+        if relation.constraint is not None:
+            version_range.add(*relation.constraint)
+    return deps
+
+
+def get_dependencies(control_data, local_packages=None):
+    """Return the merged `Depends` and `Pre-Depends` of a package, as returned by :func:`parse_deps`
+
+    :param control_data: control data of the package
+    :type control_data: :class:`dict`
+    :param local_packages: dict of [package_name, package_version], used when there is a choice between packages
+    :type local_packages: :class:`dict`
+    :rtype: :class:`dict`
+    """
+    deps = {}
+    for key in ('Depends', 'Pre-Depends'):
+        if key in control_data:
+            deps.update(parse_deps(control_data[key], local_packages=local_packages))
     return deps
 
 
 def parse_dpkg(dpkg_string):
     """
     >>> parse_dpkg("ii  xfonts-utils     1:7.7~1   amd64  X Window System font utility programs")
-    {u'xfonts-utils': LooseVersion ('1:7.7~1')}
+    {'xfonts-utils': DebianVersion('1:7.7~1')}
 
     :param dpkg_string:
     :type dpkg_string: :class:`str`
@@ -108,24 +256,80 @@ def parse_dpkg(dpkg_string):
     """
     installed_packages = {}
     for line in dpkg_string.splitlines():
-        matcher = re.match('^ii\s+([^\s]+)\s+([^\s]+)\s+([^\s]+)\s+.*$', line)
+        matcher = DPKG_LINE_RE.match(line)
         if not matcher:
             continue
 
         package_name, __, __ = matcher.group(1).partition(':')
         package_version = matcher.group(2)
-        installed_packages[package_name] = LooseVersion(package_version)
+        installed_packages[package_name] = get_version(package_version)
     return installed_packages
 
 
+class InstalledPackages(dict):
+    """ dict of [package_name, package_version] of installed packages, as returned by :func:`parse_dpkg`.
+    Also keeps the architecture of each package and the virtual packages they provide.
+    """
+    def __init__(self, *args, **kwargs):
+        super(InstalledPackages, self).__init__(*args, **kwargs)
+        # {package_name: architecture}
+        self.architectures = {}
+        # {virtual package name: [(package_name, provided version or None), ...]}
+        self.provides = {}
+
+
+def parse_dpkg_status(fileobj):
+    """ Read the installed packages from the dpkg status database (usually `/var/lib/dpkg/status`)
+
+    :param fileobj: file object on the status database (or a copy of it)
+    :return: dict of [package_name, package_version]
+    :rtype: :class:`InstalledPackages`
+    """
+    installed_packages = InstalledPackages()
+    for stanza in iter_deb822(fileobj, fields=('Package', 'Status', 'Version', 'Architecture', 'Provides')):
+        # "install ok installed", "hold ok installed", but not "deinstall ok config-files"
+        if not stanza.get('Status', '').endswith(' installed') or 'Version' not in stanza:
+            continue
+        package_name = stanza['Package']
+        installed_packages[package_name] = get_version(stanza['Version'])
+        installed_packages.architectures[package_name] = stanza.get('Architecture')
+        for provided in stanza.get('Provides', '').split(','):
+            provided_name, __, provided_version = provided.partition('(')
+            provided_name = provided_name.strip()
+            if not provided_name:
+                continue
+            provided_version = provided_version.strip(' )').lstrip('=').strip()
+            installed_packages.provides.setdefault(provided_name, []).append(
+                (package_name, get_version(provided_version) if provided_version else None))
+    return installed_packages
+
+
+def read_installed_packages(filename=DPKG_STATUS_FILE):
+    """ Read installed packages from a copy of the dpkg status database or from a saved output of `dpkg -l`
+
+    :param filename: path of the file
+    :type filename: :class:`str`
+    :return: dict of [package_name, package_version]
+    :rtype: :class:`dict`
+    """
+    with codecs.open(filename, 'r', encoding='utf-8') as fd:
+        first_line = fd.readline()
+        while first_line and not first_line.strip():
+            first_line = fd.readline()
+        fd.seek(0)
+        if first_line.startswith('Package:'):
+            return parse_dpkg_status(fd)
+        return parse_dpkg(fd.read())
+
+
 def check_version_constraint(version_1, op, version_2):
     """
     :param version_1:
-    :type version_1: :class:`distutils.version.LooseVersion`
+    :type version_1: :class:`debtools.versions.DebianVersion`
     :param op:
     :type op: :class:`str`
     :param version_2:
-    :type version_2: :class:`distutils.version.LooseVersion`
+    :type version_2: :class:`debtools.versions.DebianVersion`
     :return:
     :rtype:
     """
@@ -145,7 +349,9 @@ def check_version_constraint(version_1, op, version_2):
 
 
 def get_subfile(ar_file, name_regexp='control.tar.'):
-    """Find the file whose names matches the given regexp
+    """Find the file whose names matches the given regexp.
+    Headers are read only until a matching member is found.
+
     :param ar_file:
     :type ar_file: :class:`ArFile`
     :param name_regexp:
@@ -153,12 +359,62 @@ def get_subfile(ar_file, name_regexp='control.tar.'):
     :return: the tuple (file descriptor, name)
     :rtype: :class:`tuple`
     """
-    for name in ar_file.getnames():
-        if re.match(name_regexp, name):
-            return ar_file.extractfile(name), name
+    for ar_info in ar_file:
+        if re.match(name_regexp, ar_info.name):
+            return ar_file.extractfile(ar_info), ar_info.name
     return None, None
 
 
+# magic bytes of the compression formats used by dpkg
+COMPRESSION_MAGICS = ((b'\xfd7zXZ\x00', 'xz'), (b'\x1f\x8b', 'gz'), (b'BZh', 'bz2'), (b'\x28\xb5\x2f\xfd', 'zst'))
+
+
+def detect_compression(fileobj, name=''):
+    """ Detect the compression of a file from its first bytes. The position of `fileobj` is not modified.
+    The legacy `.lzma` format has no magic, so it is only detected by its name.
+
+    :param fileobj: seekable file object
+    :param name: name of the file
+    :type name: :class:`str`
+    :return: 'xz', 'gz', 'bz2', 'zst', 'lzma' or `None` for uncompressed data
+    :rtype: :class:`str`
+    """
+    position = fileobj.tell()
+    magic = fileobj.read(6)
+    fileobj.seek(position)
+    for prefix, compression in COMPRESSION_MAGICS:
+        if magic.startswith(prefix):
+            return compression
+    if name.endswith('.lzma'):
+        return 'lzma'
+    return None
+
+
+def open_decompressed(fileobj, name=''):
+    """ Return a file object that incrementally decompresses `fileobj`.
+    Only the data that is actually read is decompressed.
+
+    :param fileobj: seekable file object
+    :param name: name of the file (only used for detecting `.lzma` files)
+    :type name: :class:`str`
+    :return: readable file object
+    """
+    compression = detect_compression(fileobj, name=name)
+    if compression == 'xz' or compression == 'lzma':
+        return lzma.LZMAFile(fileobj, mode='rb')
+    elif compression == 'gz':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    elif compression == 'bz2':
+        return bz2.BZ2File(fileobj, mode='rb')
+    elif compression == 'zst':
+        if zstd is None:
+            raise ValueError('the zstandard package is required for reading %s' % name)
+        elif hasattr(zstd, 'ZstdFile'):
+            return zstd.ZstdFile(fileobj, mode='rb')
+        return zstd.ZstdDecompressor().stream_reader(fileobj)
+    return fileobj
+
+
 def get_control_data(filename):
     """ Extract control data from a `.deb` file
     A `.deb` is an `.ar` file that contains `control.tar.XXX`, that contains a `control` file.
@@ -168,27 +424,109 @@ def get_control_data(filename):
     :return:
     :rtype: :class:`dict`
     """
-    # open the four files (.deb, .ar, control.tar.XXX, control)
-    deb_file = open(filename, mode='rb')
-    ar_file = ArFile(filename, mode='r', fileobj=deb_file)
-    control_file, control_file_name = get_subfile(ar_file, '^control\.tar\..*$')
-    mode = 'r:*'
-    if control_file_name.endswith('.xz') or control_file_name.endswith('.lzma'):
-        # special case when lzma is used from backport (Python 3.2, 2.7)
-        control_file_content = control_file.read()
-        control_file_content_uncompressed = lzma.decompress(control_file_content)
-        control_file.close()
-        control_file = io.BytesIO(control_file_content_uncompressed)
-        mode = 'r'
-    tar_file = tarfile.open(name='control', mode=mode, fileobj=control_file)
-    control_data = tar_file.extractfile('./control')
-    # we got the data!
-    control_data_value = control_data.read().decode('utf-8')
-    # ok, we close the previous file descriptors
-    control_data.close()
-    tar_file.close()
-    ar_file.close()
-    deb_file.close()
+    return get_control_members(filename, names=('control', ))['control']
+
+
+def _get_control_data_or_error(filename):
+    try:
+        return filename, get_control_data(filename), None
+    except Exception as e:
+        return filename, None, e
+
+
+def get_control_data_many(filenames, workers=None, ordered=True):
+    """ Extract control data from many `.deb` files, using a pool of processes.
+    An invalid file does not abort the whole batch: its error is returned instead of its data.
+
+    :param filenames: list of complete filepaths of `.deb` files
+    :type filenames: :class:`list`
+    :param workers: number of processes (default: number of CPUs); 1 does not use any extra process
+    :type workers: :class:`int`
+    :param ordered: yield results in the order of `filenames` (otherwise, as soon as they are available)
+    :type ordered: :class:`bool`
+    :return: iterator on tuples `(filename, control data or None, exception or None)`
+    :rtype: :class:`generator`
+    """
+    filenames = list(filenames)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(filenames) <= 1:
+        for filename in filenames:
+            yield _get_control_data_or_error(filename)
+        return
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_get_control_data_or_error, filename) for filename in filenames]
+        for future in (futures if ordered else as_completed(futures)):
+            yield future.result()
+
+
+def get_control_members(filename, names=('control', 'md5sums', 'conffiles', 'shlibs', 'triggers', 'preinst',
+                                         'postinst', 'prerm', 'postrm')):
+    """ Extract several files from the control archive of a `.deb` file, decompressing it only once.
+    The archive is read until all requested files have been found.
+
+    :param filename: complete filepath of a `.deb` file
+    :type filename: :class:`str`
+    :param names: names of the files to extract (like `'md5sums'`); `None` to extract all files
+    :type names: :class:`tuple`
+    :return: dict whose keys are the found names and values are the raw content (:class:`bytes`) of the files,
+        except for `'control'`, which is parsed by :func:`parse_control_data`. Missing files are not in this dict.
+    :rtype: :class:`dict`
+    """
+    wanted_names = set(names) if names is not None else None
+    members = {}
+    # open the five files (.deb, .ar, control.tar.XXX, its decompressed stream, control),
+    # that are all closed even if the file is invalid
+    with open(filename, mode='rb') as deb_file:
+        with ArFile(filename, mode='r', fileobj=deb_file, use_mmap=True) as ar_file:
+            control_file, control_file_name = get_subfile(ar_file, r'^control\.tar(\..*)?$')
+            if control_file is None:
+                raise ValueError('%s does not contain any control archive' % filename)
+            with closing(control_file), closing(open_decompressed(control_file, name=control_file_name)) as \
+                    uncompressed_file:
+                # stream mode: members are decompressed one after the other and we stop at the control file
+                with tarfile.open(name='control', mode='r|', fileobj=uncompressed_file) as tar_file:
+                    for tar_info in tar_file:
+                        name = tar_info.name[2:] if tar_info.name.startswith('./') else tar_info.name
+                        if not tar_info.isfile() or (wanted_names is not None and name not in wanted_names):
+                            continue
+                        # we got the data!
+                        with closing(tar_file.extractfile(tar_info)) as member_data:
+                            members[name] = member_data.read()
+                        if wanted_names is not None and len(members) == len(wanted_names):
+                            break
+    if 'control' in members:
+        members['control'] = parse_control_data(members['control'].decode('utf-8'))
+    elif wanted_names is None or 'control' in wanted_names:
+        raise ValueError('%s does not contain any control file' % filename)
     # here we are
-    parsed_data = parse_control_data(control_data_value)
-    return parsed_data
+    return members
+
+
+def build_deb(filename, control_tar, data_tar, reproducible=False, mtime=None):
+    """ Assemble a `.deb` file from existing control and data archives.
+    Archives are streamed into the `.deb` file and are never loaded in memory.
+
+    :param filename: complete filepath of the `.deb` file to create
+    :type filename: :class:`str`
+    :param control_tar: path of the control archive (its name must start by `control.tar`)
+    :type control_tar: :class:`str`
+    :param data_tar: path of the data archive (its name must start by `data.tar`)
+    :type data_tar: :class:`str`
+    :param reproducible: use fixed timestamps, uid, gid and modes for all members
+    :type reproducible: :class:`bool`
+    :param mtime: timestamp used in reproducible mode (default: `$SOURCE_DATE_EPOCH` or 0)
+    :type mtime: :class:`int`
+    """
+    for path, prefix in ((control_tar, 'control.tar'), (data_tar, 'data.tar')):
+        if not os.path.basename(path).startswith(prefix):
+            raise ValueError('%s must be a %s.* archive' % (path, prefix))
+    with ArFile(filename, mode='w', reproducible=reproducible, mtime=mtime) as ar_file:
+        debian_binary = ArInfo('debian-binary')
+        debian_binary.size = 4
+        debian_binary.timestamp = int(time.time())
+        debian_binary.file_mode = 0o100644
+        ar_file.addfile(debian_binary, io.BytesIO(b'2.0\n'))
+        ar_file.add(control_tar)
+        ar_file.add(data_tar)
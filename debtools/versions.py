@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Debian version numbers, compared like dpkg does
+
+"""
+from __future__ import unicode_literals
+
+from functools import lru_cache
+import re
+
+__author__ = 'Matthieu Gallet'
+
+_DIGITS_RE = re.compile(r'(\d+)')
+# a missing (non-digit, digit) part of a version is equivalent to ('', 0)
+_EMPTY_PART = ((0, ), 0)
+_OPERATORS = {'>=', '>>', '>', '=', '==', '<=', '<<', '<', '!=', '<>'}
+
+
+def _char_order(char):
+    """Weight of a character in a non-digit part of a version: '~' sorts before anything, even the end of the part,
+    letters sort before all other characters"""
+    if char == '~':
+        return -1
+    elif char.isalpha():
+        return ord(char)
+    return ord(char) + 256
+
+
+def _string_key(value):
+    """Return a tuple that sorts like `value` in dpkg's `verrevcmp`.
+    `value` is split into (non-digit, digit) parts, each non-digit part being terminated by 0 (the end of the part).
+    Trailing empty parts are removed, then a single empty part is appended so that keys of different lengths
+    compare like dpkg ('1.0~' < '1.0' < '1.0.1').
+    """
+    parts = _DIGITS_RE.split(value)
+    pairs = []
+    for index in range(0, len(parts), 2):
+        digits = parts[index + 1] if index + 1 < len(parts) else ''
+        pairs.append((tuple(_char_order(x) for x in parts[index]) + (0, ), int(digits) if digits else 0))
+    while pairs and pairs[-1] == _EMPTY_PART:
+        pairs.pop()
+    pairs.append(_EMPTY_PART)
+    return tuple(pairs)
+
+
+class DebianVersion(object):
+    """ A Debian version `[epoch:]upstream_version[-debian_revision]`.
+    The sort key is computed once, so comparisons are simple tuple comparisons.
+
+    >>> DebianVersion('1:1.0-1') > DebianVersion('2.0-1')
+    True
+    >>> DebianVersion('1.0~rc1') < DebianVersion('1.0')
+    True
+    >>> DebianVersion('1.0') == DebianVersion('0:1.0-0')
+    True
+    """
+    __slots__ = ('version', 'epoch', 'upstream', 'revision', 'key')
+
+    def __init__(self, version):
+        version = version.strip()
+        self.version = version
+        epoch, sep, remaining = version.partition(':')
+        if not sep:
+            epoch, remaining = '0', version
+        if not epoch.isdigit():
+            raise ValueError('invalid epoch in version %r' % version)
+        self.epoch = int(epoch)
+        upstream, sep, revision = remaining.rpartition('-')
+        if not sep:
+            upstream, revision = remaining, ''
+        if not upstream:
+            raise ValueError('invalid version %r' % version)
+        self.upstream = upstream
+        self.revision = revision
+        self.key = (self.epoch, _string_key(upstream), _string_key(revision))
+
+    def __str__(self):
+        return self.version
+
+    def __repr__(self):
+        return 'DebianVersion(%r)' % str(self.version)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    @staticmethod
+    def _get_key(other):
+        """Return the key of another version (or of a string), or `None` if this is not a valid version"""
+        if other is None:
+            return None
+        try:
+            return get_version(other).key
+        except ValueError:
+            return None
+
+    def __eq__(self, other):
+        key = self._get_key(other)
+        return key is not None and self.key == key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        key = self._get_key(other)
+        return NotImplemented if key is None else self.key < key
+
+    def __le__(self, other):
+        key = self._get_key(other)
+        return NotImplemented if key is None else self.key <= key
+
+    def __gt__(self, other):
+        key = self._get_key(other)
+        return NotImplemented if key is None else self.key > key
+
+    def __ge__(self, other):
+        key = self._get_key(other)
+        return NotImplemented if key is None else self.key >= key
+
+
+@lru_cache(maxsize=65536)
+def _get_cached_version(version):
+    return DebianVersion(version)
+
+
+def get_version(version):
+    """ Return a :class:`DebianVersion`; identical strings share the same (cached) object.
+
+    :param version: version as a string, or an existing :class:`DebianVersion`
+    :rtype: :class:`DebianVersion`
+    """
+    if isinstance(version, DebianVersion):
+        return version
+    return _get_cached_version('%s' % version)
+
+
+def sort_versions(versions, reverse=False):
+    """ Sort a list of versions (strings or :class:`DebianVersion`) using their precomputed keys.
+
+    >>> sort_versions(['1.0', '1:0.5', '1.0~rc1', '1.0-1'])
+    ['1.0~rc1', '1.0', '1.0-1', '1:0.5']
+
+    :param versions: iterable of versions
+    :param reverse: sort in descending order
+    :type reverse: :class:`bool`
+    :return: a new list, with the original objects
+    :rtype: :class:`list`
+    """
+    return sorted(versions, key=lambda x: get_version(x).key, reverse=reverse)
+
+
+class VersionRange(object):
+    """ Set of versions allowed by a list of dependency constraints, like `python (>= 2.7), python (<< 2.8)`.
+    Constraints are merged into a single interval (plus the versions excluded by `!=`), so a version is checked
+    by a couple of tuple comparisons, whatever the number of constraints.
+
+    >>> version_range = VersionRange([('>=', '2.7'), ('<<', '2.8'), ('>=', '2.7.3')])
+    >>> version_range.satisfied_by('2.7.9'), version_range.satisfied_by('2.7.1'), version_range.satisfied_by('2.8')
+    (True, False, False)
+    >>> str(version_range)
+    '>= 2.7, << 2.8, >= 2.7.3'
+    """
+    __slots__ = ('constraints', 'lower', 'lower_inclusive', 'upper', 'upper_inclusive', 'excluded')
+
+    def __init__(self, constraints=()):
+        """
+        :param constraints: list of `(operator, version)`; operators are `<<`, `<=`, `=`, `>=`, `>>`
+            (and the obsolete `<`, `>`, `==`, `!=`)
+        :type constraints: :class:`list`
+        """
+        self.constraints = []
+        # keys of the bounds of the interval (None if unbounded)
+        self.lower, self.lower_inclusive = None, True
+        self.upper, self.upper_inclusive = None, True
+        self.excluded = set()
+        for op, version in constraints:
+            self.add(op, version)
+
+    def add(self, op, version):
+        """Add a new constraint, restricting the range"""
+        if op not in _OPERATORS:
+            raise ValueError('unknown operator %s %s' % (op, version))
+        version = get_version(version)
+        key = version.key
+        self.constraints.append((op, version))
+        if op in ('>=', '>>', '>', '=', '=='):
+            inclusive = op != '>>' and op != '>'
+            if self.lower is None or key > self.lower or (key == self.lower and not inclusive):
+                self.lower, self.lower_inclusive = key, inclusive
+        if op in ('<=', '<<', '<', '=', '=='):
+            inclusive = op != '<<' and op != '<'
+            if self.upper is None or key < self.upper or (key == self.upper and not inclusive):
+                self.upper, self.upper_inclusive = key, inclusive
+        if op == '!=' or op == '<>':
+            self.excluded.add(key)
+
+    def satisfied_by(self, version):
+        """Return `True` if `version` is in this range
+
+        :param version: version as a string or :class:`DebianVersion`
+        :rtype: :class:`bool`
+        """
+        key = get_version(version).key
+        if self.lower is not None and (key < self.lower if self.lower_inclusive else key <= self.lower):
+            return False
+        if self.upper is not None and (key > self.upper if self.upper_inclusive else key >= self.upper):
+            return False
+        return key not in self.excluded
+
+    def filter(self, versions):
+        """Return the versions that are in this range, keeping their order
+
+        :param versions: iterable of versions
+        :rtype: :class:`list`
+        """
+        if not self.constraints:
+            return list(versions)
+        return [x for x in versions if self.satisfied_by(x)]
+
+    def best(self, versions):
+        """Return the highest version in this range, or `None`"""
+        candidates = self.filter(versions)
+        if not candidates:
+            return None
+        return max(candidates, key=lambda x: get_version(x).key)
+
+    def is_empty(self):
+        """Return `True` if no version can satisfy these constraints"""
+        if self.lower is None or self.upper is None:
+            return False
+        if self.lower == self.upper:
+            return not (self.lower_inclusive and self.upper_inclusive) or self.lower in self.excluded
+        return self.lower > self.upper
+
+    def __iter__(self):
+        return iter(self.constraints)
+
+    def __len__(self):
+        return len(self.constraints)
+
+    def __bool__(self):
+        return bool(self.constraints)
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        return isinstance(other, VersionRange) and self.constraints == other.constraints
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __str__(self):
+        return ', '.join('%s %s' % x for x in self.constraints)
+
+    def __repr__(self):
+        return 'VersionRange(%r)' % str(self)